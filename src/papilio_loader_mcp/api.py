@@ -1,39 +1,85 @@
 """FastAPI REST API for remote network access."""
 
+import asyncio
+import json
+import logging
 import os
 import secrets
+import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Cookie, Response, Request, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse
 from pydantic import BaseModel
+from sse_starlette.sse import EventSourceResponse
 from starlette.middleware.sessions import SessionMiddleware
 
 from .tools.serial_ports import list_serial_ports
-from .tools.device_info import get_device_info
-from .tools.flash_status import get_flash_status
+from .tools.device_registry import get_device_registry, query_device
+from .tools.port_resolver import resolve_port
+from .tools.singleflight import get_single_flight
+from .tools.tool_registry import get_tool_registry
+from .tools.engine import shutdown_backends
 from .tools.fpga_flash import flash_fpga_device
-from .tools.esp_flash import flash_esp_device
+from .tools.esp_flash import flash_esp_device, flash_esp_multi_partition
 from .config import get_config
-from .file_detector import validate_file_for_device
+from .scheduler import get_scheduler
+from .progress import get_progress_broker
+from .file_detector import image_metadata, validate_file_for_device
+from .uploads import (
+    MAX_PARTITIONS,
+    MULTIPART_OVERHEAD,
+    UploadLimitMiddleware,
+    save_upload,
+    temp_upload_path,
+)
 from .database import (
-    add_saved_file,
-    get_saved_files,
+    add_saved_file_reference,
+    get_blob,
+    save_file_by_hash,
+    get_saved_files_version,
+    list_saved_files,
     get_saved_file,
     delete_saved_file,
     update_saved_file_name,
     update_saved_file_description,
     get_saved_file_path,
-    get_saved_files_dir
+    get_saved_files_dir,
+    get_history,
+    run_db,
 )
+from .history import OPERATIONS, history_stats
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# How often a request waiting on a flash checks that its client is still there
+DISCONNECT_POLL_SECONDS = 1.0
+
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Stop the in-process tool workers when the server exits.
+
+    Mounted apps don't get lifespan events, so the combined server passes this
+    to its own Starlette app as well.
+    """
+    try:
+        yield
+    finally:
+        shutdown_backends()
+
 
 # Create FastAPI app
 api = FastAPI(
     title="Papilio Loader API",
     description="REST API for remote FPGA and ESP32 device programming",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -46,6 +92,20 @@ api.add_middleware(
     max_age=3600 * 24,  # 24 hours
 )
 
+# Refuse oversized uploads before their bodies are parsed
+_single_upload_limit = config.max_upload_size + MULTIPART_OVERHEAD
+_multi_upload_limit = config.max_upload_size * MAX_PARTITIONS + MULTIPART_OVERHEAD
+api.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/flash/upload": _single_upload_limit,
+        "/web/flash": _single_upload_limit,
+        "/web/save-file": _single_upload_limit,
+        "/flash/multi": _multi_upload_limit,
+        "/web/flash-multi": _multi_upload_limit,
+    },
+)
+
 api.add_middleware(
     CORSMiddleware,
     allow_origins=config.cors_origins,
@@ -54,11 +114,15 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so rejected and failed requests are counted too
+api.add_middleware(metrics.MetricsMiddleware)
+
 
 # Request/Response models
 class DeviceInfoRequest(BaseModel):
     port: str
     device_type: str  # "fpga" or "esp32"
+    refresh: bool = False  # probe the device even if a cached answer exists
 
 
 class FlashRequest(BaseModel):
@@ -85,8 +149,10 @@ async def verify_api_key(x_api_key: Optional[str] = Header(None)) -> bool:
 
 @api.get("/health")
 async def health_check():
-    """Health check endpoint."""
-    return {"status": "healthy", "service": "papilio-loader-mcp"}
+    """Health check endpoint, with the esptool/pesptool versions and capabilities found."""
+    registry = get_tool_registry()
+    registry.start()
+    return {"status": "healthy", "service": "papilio-loader-mcp", "tools": registry.status()}
 
 
 @api.get("/ports")
@@ -94,7 +160,11 @@ async def get_ports(_: bool = Header(None, alias="x-api-key")):
     """List all available serial ports."""
     await verify_api_key(_)
     result = await list_serial_ports()
-    return ApiResponse(success=True, message="Ports retrieved", data={"ports": result})
+    return ApiResponse(
+        success=True,
+        message="Ports retrieved",
+        data={"ports": result["ports"], "generation": result["generation"]},
+    )
 
 
 @api.post("/device/info")
@@ -103,7 +173,7 @@ async def device_info(
 ):
     """Get device information."""
     await verify_api_key(_)
-    result = await get_device_info(request.port, request.device_type)
+    result = await query_device("info", request.port, request.device_type, request.refresh)
     return ApiResponse(success=True, message="Device info retrieved", data={"info": result})
 
 
@@ -113,61 +183,281 @@ async def flash_status(
 ):
     """Get flash status."""
     await verify_api_key(_)
-    result = await get_flash_status(request.port, request.device_type)
+    result = await query_device("status", request.port, request.device_type, request.refresh)
     return ApiResponse(success=True, message="Flash status retrieved", data={"status": result})
 
 
+async def _saved_file_source(saved_file_id: int) -> tuple[Path, dict]:
+    """Resolve a saved file to its stored path so it can be flashed in place."""
+    file_path = await run_db(get_saved_file_path, saved_file_id)
+    file_info = await run_db(get_saved_file, saved_file_id) if file_path else None
+    if not file_path or not file_path.exists():
+        raise HTTPException(status_code=404, detail=f"Saved file {saved_file_id} not found")
+    return file_path, file_info
+
+
+async def _cancel_on_disconnect(request: Request, awaitable):
+    """
+    Await a device operation, cancelling it if the HTTP client disconnects.
+
+    Handlers keep running after their client has gone; without this a flash
+    nobody is waiting for would keep its port until it finished.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info(f"Client left {request.url.path}, cancelling its operation")
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        task.cancel()
+
+
 @api.post("/flash/upload")
 async def upload_and_flash(
+    request: Request,
     port: str,
     device_type: str,
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
     address: Optional[str] = None,
     verify: bool = True,
+    operation_id: Optional[str] = None,
+    differential: bool = False,
+    sparse: bool = False,
+    saved_file_id: Optional[int] = None,
     x_api_key: Optional[str] = Header(None),
 ):
-    """Upload and flash a firmware file."""
+    """Upload and flash a firmware file.
+
+    Pass an ``operation_id`` and subscribe to ``/flash/progress/{operation_id}``
+    beforehand to receive live progress. With ``differential=true`` only the
+    blocks that differ from what is already on the device are written, and
+    with ``sparse=true`` runs of 0xFF padding are erased instead of written.
+    Instead of uploading, ``saved_file_id`` flashes a file from the saved
+    files library directly from where it is stored.
+    """
     await verify_api_key(x_api_key)
 
-    # Validate file size
-    contents = await file.read()
-    if len(contents) > config.max_upload_size:
-        raise HTTPException(
-            status_code=413, detail=f"File too large (max {config.max_upload_size} bytes)"
-        )
+    if saved_file_id is not None:
+        temp_file = None
+        source, file_info = await _saved_file_source(saved_file_id)
+        filename, sha256 = file_info["original_filename"], file_info["sha256"]
+    elif file is not None:
+        # Stream the upload to a temp file, enforcing the size limit as it arrives
+        temp_file = temp_upload_path(config.user_data_dir / "temp", file.filename)
+        upload = await save_upload(file, temp_file, config.max_upload_size)
+        source, filename, sha256 = temp_file, file.filename, upload.sha256
+    else:
+        raise HTTPException(status_code=400, detail="Send a file or a saved_file_id")
 
-    # Save uploaded file temporarily
-    temp_dir = Path("temp")
-    temp_dir.mkdir(exist_ok=True)
-    temp_file = temp_dir / file.filename
-    
     try:
-        with open(temp_file, "wb") as f:
-            f.write(contents)
-
-        # Flash the device
+        # Flash the device once the port is free
+        scheduler = get_scheduler()
         if device_type == "fpga":
-            result = await flash_fpga_device(str(temp_file), port, verify)
+            # Resolve AUTO first, so the job waits in the queue of the port it opens
+            port = await resolve_port(port, device_type)
+            result = await _cancel_on_disconnect(request, scheduler.submit(
+                port, flash_fpga_device, port, str(source), address or "0x100000", verify, operation_id,
+                description=f"flash fpga {filename}", differential=differential, sparse=sparse, sha256=sha256,
+            ))
         elif device_type == "esp32":
             if not address:
                 raise HTTPException(status_code=400, detail="Address required for ESP32")
-            result = await flash_esp_device(str(temp_file), port, address, verify)
+            port = await resolve_port(port, device_type)
+            result = await _cancel_on_disconnect(request, scheduler.submit(
+                port, flash_esp_device, port, str(source), address, verify, operation_id,
+                description=f"flash esp32 {filename}", differential=differential, sparse=sparse, sha256=sha256,
+            ))
         else:
             raise HTTPException(status_code=400, detail="Invalid device type")
 
+        if not result.get("success"):
+            raise HTTPException(status_code=500, detail=result.get("error") or result.get("output", "Flash failed"))
         return ApiResponse(
             success=True,
             message="Device flashed successfully",
-            data={"result": result},
+            data={"result": result, "sha256": sha256},
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
     finally:
-        # Clean up temp file
-        if temp_file.exists():
-            temp_file.unlink()
+        # Clean up temp file (saved files are flashed in place and kept)
+        if temp_file is not None:
+            temp_file.unlink(missing_ok=True)
+
+
+async def _flash_partitions(
+    request: Request,
+    port: str,
+    files: list[UploadFile],
+    addresses: list[str],
+    device_types: Optional[list[str]],
+    verify: bool,
+    operation_id: Optional[str],
+) -> dict:
+    """Save N uploaded images and flash them in one esptool session."""
+    if len(files) != len(addresses):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Got {len(files)} files but {len(addresses)} addresses",
+        )
+    device_types = device_types or ["esp32"] * len(files)
+    if len(device_types) != len(files) or any(t not in ("esp32", "fpga") for t in device_types):
+        raise HTTPException(status_code=400, detail="device_types must list esp32 or fpga for each file")
+    if len(files) > MAX_PARTITIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PARTITIONS} files per request")
+
+    temp_dir = config.user_data_dir / "temp"
+    temp_files = []
+    try:
+        partitions = []
+        for upload, address in zip(files, addresses):
+            # Unique names: layouts often reuse file names (e.g. several *.bin builds)
+            temp_file = temp_upload_path(temp_dir, upload.filename)
+            await save_upload(upload, temp_file, config.max_upload_size)
+            temp_files.append(temp_file)
+            partitions.append((address, str(temp_file)))
+
+        # Layouts that include an FPGA bitstream go through pesptool
+        tool = "pesptool" if "fpga" in device_types else "esptool"
+        port = await resolve_port(port, "fpga" if tool == "pesptool" else "esp32")
+        return await _cancel_on_disconnect(request, get_scheduler().submit(
+            port, flash_esp_multi_partition, port, partitions, verify, operation_id, tool,
+            description=f"flash {len(partitions)} partitions",
+        ))
+
+    finally:
+        for temp_file in temp_files:
+            temp_file.unlink(missing_ok=True)
+
+
+@api.post("/flash/multi")
+async def upload_and_flash_multi(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    addresses: list[str] = Form(...),
+    device_types: Optional[list[str]] = Form(None),
+    port: str = Form("AUTO"),
+    verify: bool = Form(True),
+    operation_id: Optional[str] = Form(None),
+    x_api_key: Optional[str] = Header(None),
+):
+    """Upload several images with their flash addresses and flash them in one session.
+
+    Send one ``addresses`` field per file, in the same order. ``device_types``
+    (esp32/fpga per file) is only needed for combined FPGA + ESP32 layouts.
+    """
+    await verify_api_key(x_api_key)
+    result = await _flash_partitions(request, port, files, addresses, device_types, verify, operation_id)
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=result.get("error") or result.get("output", "Flash failed"))
+    return ApiResponse(
+        success=True,
+        message=f"Flashed {len(files)} partitions successfully",
+        data={"result": result},
+    )
+
+
+@api.get("/flash/queue")
+async def flash_queue(x_api_key: Optional[str] = Header(None)):
+    """Show per-port job queues and running operations."""
+    await verify_api_key(x_api_key)
+    data = {
+        **get_scheduler().status(),
+        "device_cache": get_device_registry().stats(),
+        "coalescing": get_single_flight().stats(),
+    }
+    return ApiResponse(success=True, message="Queue status retrieved", data=data)
+
+
+def _progress_response(operation_id: str) -> EventSourceResponse:
+    """Stream an operation's progress events as Server-Sent Events."""
+    operation = get_progress_broker().get(operation_id, create=True)
+    if operation is None:
+        raise HTTPException(status_code=400, detail="Invalid operation id")
+
+    async def event_source():
+        metrics.SSE_SESSIONS.inc(stream="progress")
+        try:
+            async for event in operation.events():
+                yield {"event": event["type"], "data": json.dumps(event)}
+        finally:
+            metrics.SSE_SESSIONS.dec(stream="progress")
+
+    return EventSourceResponse(event_source(), ping=15)
+
+
+def _log_response(operation_id: str) -> FileResponse:
+    """Return the full tool output of an operation."""
+    log_path = get_progress_broker().log_path(operation_id)
+    if log_path is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    return FileResponse(path=log_path, media_type="text/plain")
+
+
+@api.get("/flash/progress/{operation_id}")
+async def flash_progress(operation_id: str, x_api_key: Optional[str] = Header(None)):
+    """Stream live progress for a flash operation (Server-Sent Events)."""
+    await verify_api_key(x_api_key)
+    return _progress_response(operation_id)
+
+
+@api.get("/flash/logs/{operation_id}")
+async def flash_log(operation_id: str, x_api_key: Optional[str] = Header(None)):
+    """Get the full tool output of a flash operation."""
+    await verify_api_key(x_api_key)
+    return _log_response(operation_id)
+
+
+@api.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(x_api_key: Optional[str] = Header(None)):
+    """Metrics in the Prometheus text format."""
+    await verify_api_key(x_api_key)
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@api.get("/history")
+async def operation_history(
+    operation: Optional[str] = None,
+    port: Optional[str] = None,
+    device_type: Optional[str] = None,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    x_api_key: Optional[str] = Header(None),
+):
+    """List recorded device operations, newest first.
+
+    Pass the ``id`` of the last record as ``before_id`` to get the next page.
+    """
+    await verify_api_key(x_api_key)
+    if operation is not None and operation not in OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"operation must be one of {', '.join(OPERATIONS)}")
+    records = await run_db(
+        get_history, operation=operation, port=port, device_type=device_type,
+        limit=limit, before_id=before_id,
+    )
+    return ApiResponse(success=True, message=f"{len(records)} records", data={"records": records})
+
+
+@api.get("/stats")
+async def operation_stats(
+    operation: str = "flash",
+    days: Optional[float] = 30,
+    x_api_key: Optional[str] = Header(None),
+):
+    """p50/p95 durations and throughput per port and device type."""
+    await verify_api_key(x_api_key)
+    if operation not in OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"operation must be one of {', '.join(OPERATIONS)}")
+    stats = await run_db(history_stats, operation, days)
+    return ApiResponse(success=True, message="Stats computed", data=stats)
 
 
 # ============================================================================
@@ -246,10 +536,11 @@ async def web_get_ports(request: Request):
     """Get serial ports (web interface)."""
     check_web_session(request)
     result = await list_serial_ports()
-    # list_serial_ports returns JSON string, parse it
-    import json
-    parsed_result = json.loads(result)
-    return {"success": True, "ports": parsed_result.get("ports", [])}
+    return {
+        "success": True,
+        "ports": result.get("ports", []),
+        "generation": result.get("generation"),
+    }
 
 
 @api.post("/web/flash")
@@ -257,23 +548,39 @@ async def web_flash_device(
     request: Request,
     port: str = Form(...),
     device_type: str = Form(...),
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
     address: Optional[str] = Form("0x10000"),
     verify: bool = Form(True),
     advanced: bool = Form(False),
+    operation_id: Optional[str] = Form(None),
+    differential: bool = Form(False),
+    sparse: bool = Form(False),
+    saved_file_id: Optional[int] = Form(None),
 ):
-    """Flash device via web interface (requires authentication)."""
+    """Flash device via web interface (requires authentication).
+
+    Either upload a file, or pass ``saved_file_id`` to flash a saved file
+    from where it is stored without sending it again.
+    """
     check_web_session(request)
     
-    # Validate file size
-    contents = await file.read()
-    if len(contents) > config.max_upload_size:
-        raise HTTPException(
-            status_code=413, detail=f"File too large (max {config.max_upload_size} bytes)"
-        )
+    if saved_file_id is not None:
+        temp_file = None
+        source, file_info = await _saved_file_source(saved_file_id)
+        filename, sha256 = file_info["original_filename"], file_info["sha256"]
+        validation = await asyncio.to_thread(validate_file_for_device, source, device_type)
+    elif file is not None:
+        # Stream the upload into the user data directory, enforcing the size limit
+        temp_file = temp_upload_path(config.user_data_dir / "temp", file.filename)
+        upload = await save_upload(file, temp_file, config.max_upload_size)
+        source, filename, sha256 = temp_file, file.filename, upload.sha256
+        validation = await asyncio.to_thread(upload.validate_for_device, device_type)
+    else:
+        raise HTTPException(status_code=400, detail="Send a file or a saved_file_id")
+    # The image was parsed while validating; the flash reuses that report
+    image = validation["image"] if validation["detected_type"] == device_type else None
     
     # Validate file type matches intended device (warn but don't block)
-    validation = validate_file_for_device(contents, device_type)
     file_type_warning = None
     
     # Store warning if file type mismatch detected
@@ -285,38 +592,37 @@ async def web_flash_device(
             "details": validation["details"]
         }
 
-    # Save uploaded file temporarily in user data directory
-    temp_dir = config.user_data_dir / "temp"
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    temp_file = temp_dir / file.filename
-    
     try:
-        with open(temp_file, "wb") as f:
-            f.write(contents)
-
+        # Resolve AUTO first, so the job waits in the queue of the port it opens
+        if device_type in ("fpga", "esp32"):
+            port = await resolve_port(port, device_type)
         # Flash the device and get command string
-        import json as json_lib
-        
         if device_type == "fpga":
             # Get FPGA address from form or use default
             fpga_address = address if address else "0x100000"
-            result_json = await flash_fpga_device(port, str(temp_file), fpga_address, verify)
-            result = json_lib.loads(result_json)
+            result = await _cancel_on_disconnect(request, get_scheduler().submit(
+                port, flash_fpga_device, port, str(source), fpga_address, verify, operation_id,
+                description=f"flash fpga {filename}", differential=differential, sparse=sparse, sha256=sha256,
+                image=image,
+            ))
             # Build command string for display
             if port and port.upper() != "AUTO":
-                command = f"python tools/pesptool/pesptool.py --port {port} write-flash {fpga_address} {temp_file.name}"
+                command = f"python tools/pesptool/pesptool.py --port {port} write-flash {fpga_address} {filename}"
             else:
-                command = f"python tools/pesptool/pesptool.py write-flash {fpga_address} {temp_file.name}  # auto-detect port"
+                command = f"python tools/pesptool/pesptool.py write-flash {fpga_address} {filename}  # auto-detect port"
         elif device_type == "esp32":
             if not address:
                 address = "0x10000"
-            result_json = await flash_esp_device(port, str(temp_file), address, verify)
-            result = json_lib.loads(result_json)
+            result = await _cancel_on_disconnect(request, get_scheduler().submit(
+                port, flash_esp_device, port, str(source), address, verify, operation_id,
+                description=f"flash esp32 {filename}", differential=differential, sparse=sparse, sha256=sha256,
+                image=image,
+            ))
             # Build command string for display
             if port and port.upper() != "AUTO":
-                command = f"python -m esptool --port {port} write-flash {address} {temp_file.name}"
+                command = f"python -m esptool --port {port} write-flash {address} {filename}"
             else:
-                command = f"python -m esptool write-flash {address} {temp_file.name}  # auto-detect port"
+                command = f"python -m esptool write-flash {address} {filename}  # auto-detect port"
         else:
             raise HTTPException(status_code=400, detail="Invalid device type")
 
@@ -328,14 +634,16 @@ async def web_flash_device(
                 data={
                     "command": command,
                     "output": result.get("output", ""),
-                    "error": result.get("error", "Unknown error")
+                    "error": result.get("error", "Unknown error"),
+                    "log_id": result.get("log_id")
                 }
             )
 
         response_data = {
             "command": command if advanced else None,
             "output": result.get("output", "") if advanced else None,
-            "result": result
+            "result": result,
+            "sha256": sha256,
         }
         
         # Include file type warning if present
@@ -359,70 +667,208 @@ async def web_flash_device(
         )
     
     finally:
-        # Clean up temp file
-        if temp_file.exists():
-            temp_file.unlink()
+        # Clean up temp file (saved files are flashed in place and kept)
+        if temp_file is not None:
+            temp_file.unlink(missing_ok=True)
+
+
+@api.post("/web/flash-multi")
+async def web_flash_multi(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    addresses: list[str] = Form(...),
+    device_types: Optional[list[str]] = Form(None),
+    port: str = Form("AUTO"),
+    verify: bool = Form(True),
+    operation_id: Optional[str] = Form(None),
+):
+    """Flash several images in one session via web interface (requires authentication)."""
+    check_web_session(request)
+    result = await _flash_partitions(request, port, files, addresses, device_types, verify, operation_id)
+    if not result.get("success"):
+        return ApiResponse(
+            success=False,
+            message=result.get("error", "Flash operation failed"),
+            data={
+                "output": result.get("output", ""),
+                "error": result.get("error", "Unknown error"),
+                "log_id": result.get("log_id")
+            }
+        )
+    return ApiResponse(
+        success=True,
+        message=f"Flashed {len(files)} partitions successfully",
+        data={"result": result},
+    )
+
+
+@api.get("/web/flash/progress/{operation_id}")
+async def web_flash_progress(request: Request, operation_id: str):
+    """Stream live progress for a flash started from the web interface."""
+    check_web_session(request)
+    return _progress_response(operation_id)
+
+
+@api.get("/web/logs/{operation_id}")
+async def web_flash_log(request: Request, operation_id: str):
+    """Get the full tool output of a flash started from the web interface."""
+    check_web_session(request)
+    return _log_response(operation_id)
 
 
 # Saved Files Management Endpoints
 @api.get("/web/saved-files")
-async def web_get_saved_files(request: Request, device_type: Optional[str] = None):
-    """Get list of saved files."""
+async def web_get_saved_files(
+    request: Request,
+    device_type: Optional[str] = None,
+    q: Optional[str] = None,
+    sort: str = "created_at",
+    order: str = "desc",
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    detected_type: Optional[str] = None,
+    chip: Optional[str] = None,
+    project_name: Optional[str] = None,
+    app_version: Optional[str] = None,
+    idf_version: Optional[str] = None,
+    fpga_idcode: Optional[str] = None,
+    sha256: Optional[str] = None,
+    built_after: Optional[str] = None,
+    built_before: Optional[str] = None,
+):
+    """Get one page of saved files.
+
+    ``q`` searches file names and descriptions. The other filters match the
+    metadata extracted from each image when it was saved: e.g.
+    ``chip=ESP32-S3&app_version=1.2.3``, ``fpga_idcode=0x0000081B``, or
+    ``built_after=2025-01-01``. Pass ``next_cursor`` from a response as
+    ``cursor`` to get the following page. Responses carry an ETag that
+    changes whenever the library changes, so clients sending If-None-Match
+    get 304 for a page they already have.
+    """
+    check_web_session(request)
+    
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    
+    # Cheap check before running the query
+    etag = f'W/"saved-files-{await run_db(get_saved_files_version)}"'
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    try:
+        page = await run_db(
+            list_saved_files,
+            device_type=device_type,
+            search=q,
+            sort=sort,
+            descending=order == "desc",
+            limit=limit,
+            cursor=cursor,
+            detected_type=detected_type,
+            chip=chip,
+            project_name=project_name,
+            app_version=app_version,
+            idf_version=idf_version,
+            fpga_idcode=fpga_idcode,
+            sha256=sha256,
+            built_after=built_after,
+            built_before=built_before,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return JSONResponse(
+        {"success": True, "files": page["files"], "next_cursor": page["next_cursor"]},
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+    )
+
+
+@api.get("/web/saved-files/by-hash/{sha256}")
+async def web_lookup_saved_file_hash(request: Request, sha256: str):
+    """Check whether content with this SHA-256 is already stored.
+
+    If it is, save it by posting ``sha256`` to ``/web/save-file`` without a file.
+    """
     check_web_session(request)
     
-    files = get_saved_files(device_type)
-    return {"success": True, "files": files}
+    blob = await run_db(get_blob, sha256.lower())
+    if not blob:
+        return {"success": True, "exists": False}
+    return {"success": True, "exists": True, "file_size": blob["file_size"], "references": blob["ref_count"]}
 
 
 @api.post("/web/save-file")
 async def web_save_file(
     request: Request,
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
     device_type: str = Form(...),
     description: str = Form(""),
     custom_filename: str = Form(""),
+    sha256: str = Form(""),
 ):
-    """Save a file for later use."""
+    """Save a file for later use.
+
+    Send either the file, or just the ``sha256`` of content the server
+    already has (see ``/web/saved-files/by-hash/{sha256}``).
+    """
     check_web_session(request)
     
-    # Read file content
-    contents = await file.read()
-    file_size = len(contents)
-    
-    # Validate file size
-    if file_size > config.max_upload_size:
-        raise HTTPException(
-            status_code=413, detail=f"File too large (max {config.max_upload_size} bytes)"
+    if file is None:
+        if not sha256 or not custom_filename.strip():
+            raise HTTPException(status_code=400, detail="Send a file, or sha256 with custom_filename")
+        file_id = await run_db(
+            add_saved_file_reference,
+            sha256=sha256.lower(),
+            original_filename=custom_filename.strip(),
+            device_type=device_type,
+            description=description,
+        )
+        if file_id is None:
+            raise HTTPException(status_code=404, detail="No stored file has that hash, upload it instead")
+        return ApiResponse(
+            success=True,
+            message="File saved successfully (already stored)",
+            data={"file_id": file_id, "filename": custom_filename.strip(), "sha256": sha256.lower(), "deduplicated": True}
         )
     
     # Use custom filename if provided, otherwise use original
-    import os
     original_filename = custom_filename.strip() if custom_filename.strip() else file.filename
     
-    # Generate unique filename for storage
-    import uuid
-    file_extension = os.path.splitext(file.filename)[1]
-    stored_filename = f"{uuid.uuid4()}{file_extension}"
-    
-    # Save file to disk
+    # Stream the file to disk, enforcing the size limit as it arrives; the
+    # content is stored under its hash once that is known
     saved_files_dir = get_saved_files_dir()
-    file_path = saved_files_dir / stored_filename
-    with open(file_path, "wb") as f:
-        f.write(contents)
-    
-    # Add to database
-    file_id = add_saved_file(
-        original_filename=original_filename,
-        stored_filename=stored_filename,
-        device_type=device_type,
-        description=description,
-        file_size=file_size
+    upload = await save_upload(
+        file, saved_files_dir / f".upload-{uuid.uuid4().hex}", config.max_upload_size
     )
     
+    try:
+        # Content seen before was parsed when it was first saved
+        metadata = None
+        if not await run_db(get_blob, upload.sha256):
+            metadata = await asyncio.to_thread(image_metadata, upload.path)
+        
+        # Add to database
+        file_id, deduplicated = await run_db(
+            save_file_by_hash,
+            source_path=upload.path,
+            sha256=upload.sha256,
+            file_size=upload.size,
+            original_filename=original_filename,
+            device_type=device_type,
+            description=description,
+            extension=os.path.splitext(file.filename)[1],
+            metadata=metadata,
+        )
+    except BaseException:
+        # A failed save hands the upload back; don't leave it in the library
+        upload.path.unlink(missing_ok=True)
+        raise
+    
     return ApiResponse(
         success=True,
-        message="File saved successfully",
-        data={"file_id": file_id, "filename": original_filename}
+        message="File saved successfully" + (" (already stored)" if deduplicated else ""),
+        data={"file_id": file_id, "filename": original_filename, "sha256": upload.sha256, "deduplicated": deduplicated}
     )
 
 
@@ -435,7 +881,7 @@ async def web_rename_saved_file(
     """Rename a saved file."""
     check_web_session(request)
     
-    if update_saved_file_name(file_id, new_filename):
+    if await run_db(update_saved_file_name, file_id, new_filename):
         return ApiResponse(success=True, message="File renamed successfully")
     else:
         raise HTTPException(status_code=404, detail="File not found")
@@ -450,7 +896,7 @@ async def web_update_saved_file_description(
     """Update a saved file's description."""
     check_web_session(request)
     
-    if update_saved_file_description(file_id, new_description):
+    if await run_db(update_saved_file_description, file_id, new_description):
         return ApiResponse(success=True, message="Description updated successfully")
     else:
         raise HTTPException(status_code=404, detail="File not found")
@@ -461,7 +907,7 @@ async def web_delete_saved_file(request: Request, file_id: int):
     """Delete a saved file."""
     check_web_session(request)
     
-    if delete_saved_file(file_id):
+    if await run_db(delete_saved_file, file_id):
         return ApiResponse(success=True, message="File deleted successfully")
     else:
         raise HTTPException(status_code=404, detail="File not found")
@@ -472,11 +918,11 @@ async def web_download_saved_file(request: Request, file_id: int):
     """Download a saved file."""
     check_web_session(request)
     
-    file_info = get_saved_file(file_id)
+    file_info = await run_db(get_saved_file, file_id)
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_path = get_saved_file_path(file_id)
+    file_path = await run_db(get_saved_file_path, file_id)
     if not file_path or not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
     
@@ -69,8 +69,35 @@ class Config(BaseSettings):
     max_upload_size: int = 50 * 1024 * 1024  # 50 MB
 
     # Serial port settings
-    default_baud_rate: int = 115200
-    serial_timeout: int = 10  # seconds
+    default_baud_rate: int = 115200  # slowest rate a flash falls back to
+    flash_baud_rate: int | None = None  # opt-in high-speed start rate (e.g. 921600); unset: default_baud_rate
+    serial_timeout: int = 30  # seconds a device info/flash status query may take before it is killed
+    flash_timeout: int = 900  # seconds a flash (including differential hashing) may take
+    port_scan_interval: float = 2.0  # seconds between background port scans
+    device_cache_ttl: float = 300.0  # seconds a probed device info/flash status is reused (0 disables)
+    auto_port_probe_timeout: float = 5.0  # seconds per candidate when resolving AUTO
+    auto_port_usb_ids: list[str] = []  # extra "VID:PID" (hex) pairs treated as boards for AUTO
+    fpga_idcodes: list[str] = []  # IDCODEs (hex) of the FPGA parts bitstreams may target; empty allows any
+
+    # Job scheduling: jobs on one port run in order, ports run in parallel
+    max_concurrent_jobs: int = 16  # ports driven at the same time
+
+    # esptool/pesptool execution: "subprocess" spawns the executable per call,
+    # "inprocess" reuses worker processes that import the tool once
+    tool_backend: str = "subprocess"
+    tool_workers: int = 4  # idle worker processes kept per tool by the in-process backend
+
+    # Operation logs kept on disk for the progress/log endpoints
+    max_operation_logs: int = 200
+
+    # Flash history: oldest operation records beyond this many are pruned
+    max_history_records: int = 100_000
+
+    # Differential flashing: block size compared between device and image
+    diff_block_size: int = 16 * 1024  # bytes, multiple of the 4 KB flash sector
+
+    # Sparse flashing: shortest run of 0xFF erased instead of written
+    sparse_min_run: int = 16 * 1024  # bytes, multiple of the 4 KB flash sector
     
     # User data directory (for database, temp files, logs)
     user_data_dir: Path = get_user_data_dir()
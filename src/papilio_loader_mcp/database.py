@@ -1,11 +1,33 @@
-"""Database module for storing saved files metadata."""
+"""Database module for storing saved files metadata.
 
+Saved file contents are stored once per SHA-256 in the ``blobs`` table; each
+``saved_files`` row is a named reference to a blob, and a blob's file is only
+removed when its last reference is deleted. What the image parsers found in
+the content (chip, app version, FPGA IDCODE, ...) is stored with the blob in
+indexed columns, so saved files can be filtered by it without opening them.
+
+Each thread keeps one open connection per database file (WAL mode, so readers
+don't block the writer) and reuses its prepared statement cache. The functions
+here are blocking; async code should call them through ``run_db``.
+"""
+
+import asyncio
+import base64
+import os
+import re
 import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 from typing import List, Optional, Dict
 import json
+import logging
 from .config import get_config
+from .file_detector import image_metadata
+
+logger = logging.getLogger(__name__)
 
 # Database file location - uses user data directory
 def get_db_path() -> Path:
@@ -25,19 +47,69 @@ DB_PATH = None  # Will be set dynamically
 SAVED_FILES_DIR = None  # Will be set dynamically
 
 
+_local = threading.local()
+
+# Applied to every new connection
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # durable across app crashes; WAL makes this safe
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8192",  # 8 MB page cache
+    "PRAGMA mmap_size = 67108864",  # 64 MB
+)
+
+
 def get_db_connection():
-    """Get a database connection."""
+    """Get this thread's database connection, opening it on first use."""
     db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        # Autocommit; multi-statement writes use transaction()
+        conn = sqlite3.connect(db_path, isolation_level=None, cached_statements=256)
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        connections[db_path] = conn
     return conn
 
 
+def close_db_connection():
+    """Close this thread's database connections."""
+    for conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+@contextmanager
+def transaction():
+    """Run several statements atomically, holding the write lock from the start."""
+    conn = get_db_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+async def run_db(func, *args, **kwargs):
+    """Call a blocking database function from async code without stalling the event loop."""
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
 def init_db():
     """Initialize the database schema."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    with transaction() as cursor:
+        _create_schema(cursor)
+
+
+def _create_schema(cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS saved_files (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -50,8 +122,148 @@ def init_db():
         )
     """)
     
-    conn.commit()
-    conn.close()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            stored_filename TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Databases created before content addressing have no hash column;
+    # their rows keep pointing at their own file and are deleted as before
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(saved_files)")}
+    if "sha256" not in columns:
+        cursor.execute("ALTER TABLE saved_files ADD COLUMN sha256 TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_saved_files_sha256 ON saved_files (sha256)")
+    # Listing is newest first, optionally by device type
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_saved_files_device_created ON saved_files (device_type, created_at)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_saved_files_created ON saved_files (created_at)")
+    # Other listing sorts (keyset on the sort column, then id)
+    for column in ("original_filename", "file_size"):
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_saved_files_device_{column} ON saved_files (device_type, {column})"
+        )
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_saved_files_{column} ON saved_files ({column})")
+    
+    # Image metadata, extracted once per blob when it is saved
+    columns = {row["name"] for row in cursor.execute("PRAGMA table_info(blobs)")}
+    for column in IMAGE_COLUMNS:
+        if column not in columns:
+            kind = "INTEGER" if column == "image_valid" else "TEXT COLLATE NOCASE"
+            cursor.execute(f"ALTER TABLE blobs ADD COLUMN {column} {kind}")
+    for indexed in IMAGE_INDEXES:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_blobs_{'_'.join(indexed)} ON blobs ({', '.join(indexed)})"
+        )
+    
+    # Version counter for ETags on listings, bumped by triggers on every change
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('saved_files_version', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS saved_files_version_{event.lower()} AFTER {event} ON saved_files
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'saved_files_version';
+            END
+        """)
+    
+    _create_search_index(cursor)
+    
+    # One row per device operation (flash, info, status) for auditing and stats
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS operation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            operation TEXT NOT NULL,
+            device_type TEXT,
+            port TEXT,
+            device_serial TEXT,
+            image_sha256 TEXT,
+            image_size INTEGER,
+            duration REAL,
+            bytes_written INTEGER,
+            kbit_per_s REAL,
+            exit_code INTEGER,
+            success INTEGER NOT NULL,
+            log_id TEXT,
+            log_tail TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_history_operation_created ON operation_history (operation, created_at)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_port ON operation_history (port, id)")
+
+
+def _create_search_index(cursor):
+    """Full-text index over file names and descriptions, if SQLite has FTS5."""
+    global _fts_enabled
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'saved_files_fts'"
+    ).fetchone()
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS saved_files_fts USING fts5(
+                original_filename, description,
+                content = 'saved_files', content_rowid = 'id', prefix = '2 3'
+            )
+        """)
+    except sqlite3.OperationalError:
+        # Python built against an SQLite without FTS5; search falls back to LIKE
+        _fts_enabled = False
+        return
+    
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS saved_files_fts_insert AFTER INSERT ON saved_files BEGIN
+            INSERT INTO saved_files_fts (rowid, original_filename, description)
+            VALUES (new.id, new.original_filename, new.description);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS saved_files_fts_delete AFTER DELETE ON saved_files BEGIN
+            INSERT INTO saved_files_fts (saved_files_fts, rowid, original_filename, description)
+            VALUES ('delete', old.id, old.original_filename, old.description);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS saved_files_fts_update
+        AFTER UPDATE OF original_filename, description ON saved_files BEGIN
+            INSERT INTO saved_files_fts (saved_files_fts, rowid, original_filename, description)
+            VALUES ('delete', old.id, old.original_filename, old.description);
+            INSERT INTO saved_files_fts (rowid, original_filename, description)
+            VALUES (new.id, new.original_filename, new.description);
+        END
+    """)
+    if not exists:
+        # Index rows saved before the search index existed
+        cursor.execute("INSERT INTO saved_files_fts (saved_files_fts) VALUES ('rebuild')")
+    _fts_enabled = True
+
+
+# Blob columns filled from file_detector.image_metadata
+IMAGE_COLUMNS = (
+    "detected_type", "confidence", "image_valid", "chip", "project_name",
+    "app_version", "build_date", "idf_version", "fpga_idcode",
+)
+# "Which image is app version X for chip Y", and the other filters of list_saved_files
+IMAGE_INDEXES = (
+    ("chip", "app_version"),
+    ("project_name", "app_version"),
+    ("detected_type",),
+    ("idf_version",),
+    ("build_date",),
+    ("fpga_idcode",),
+)
 
 
 def add_saved_file(
@@ -75,11 +287,162 @@ def add_saved_file(
         VALUES (?, ?, ?, ?, ?)
     """, (original_filename, stored_filename, device_type, description, file_size))
     
-    file_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    return cursor.lastrowid
+
+
+def save_file_by_hash(
+    source_path: Path,
+    sha256: str,
+    file_size: int,
+    original_filename: str,
+    device_type: str,
+    description: str,
+    extension: Optional[str] = None,
+    metadata: Optional[Dict] = None,
+) -> tuple[int, bool]:
+    """
+    Add a saved file whose content has already been written to disk.
+    
+    If a blob with the same SHA-256 exists, the new record points at it and
+    source_path is removed; otherwise source_path becomes the blob.
     
-    return file_id
+    Args:
+        source_path: Uploaded file, in the saved files directory
+        sha256: Hex SHA-256 of the content
+        file_size: Size in bytes
+        original_filename: Display name
+        device_type: 'esp32' or 'fpga'
+        description: Free-text description
+        extension: Extension for a new blob's file (default: from original_filename)
+        metadata: Values for IMAGE_COLUMNS, from file_detector.image_metadata;
+            kept for a new blob, or an existing one that has none yet
+        
+    Returns:
+        (file_id, deduplicated) where deduplicated is True if the content
+        was already stored
+    """
+    blob_path = None
+    try:
+        # The write lock is taken up front so two saves of one hash can't both create the blob
+        with transaction() as cursor:
+            blob = cursor.execute(
+                "SELECT stored_filename, detected_type FROM blobs WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            
+            if blob:
+                stored_filename = blob["stored_filename"]
+                cursor.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE sha256 = ?", (sha256,))
+                if metadata and blob["detected_type"] is None:
+                    _set_image_metadata(cursor, sha256, metadata)
+            else:
+                if extension is None:
+                    extension = os.path.splitext(original_filename)[1]
+                stored_filename = f"{sha256}{extension}"
+                # Moved while the lock is held, so the blob exists as soon as its row does
+                blob_path = get_saved_files_dir() / stored_filename
+                os.replace(source_path, blob_path)
+                cursor.execute("""
+                    INSERT INTO blobs (sha256, stored_filename, file_size, ref_count)
+                    VALUES (?, ?, ?, 1)
+                """, (sha256, stored_filename, file_size))
+                if metadata:
+                    _set_image_metadata(cursor, sha256, metadata)
+            
+            cursor.execute("""
+                INSERT INTO saved_files (original_filename, stored_filename, device_type, description, file_size, sha256)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (original_filename, stored_filename, device_type, description, file_size, sha256))
+            file_id = cursor.lastrowid
+    except BaseException:
+        # Rolled back: no blob file without a row, and the caller keeps its file
+        if blob_path is not None:
+            os.replace(blob_path, source_path)
+        raise
+    
+    if blob:
+        source_path.unlink(missing_ok=True)
+    return file_id, bool(blob)
+
+
+def add_saved_file_reference(
+    sha256: str,
+    original_filename: str,
+    device_type: str,
+    description: str,
+) -> Optional[int]:
+    """
+    Add a saved file for content the server already has, without an upload.
+    
+    Returns:
+        The ID of the new record, or None if no blob has that hash
+    """
+    with transaction() as cursor:
+        blob = cursor.execute(
+            "SELECT stored_filename, file_size FROM blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        if not blob:
+            return None
+        
+        cursor.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE sha256 = ?", (sha256,))
+        cursor.execute("""
+            INSERT INTO saved_files (original_filename, stored_filename, device_type, description, file_size, sha256)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (original_filename, blob["stored_filename"], device_type, description, blob["file_size"], sha256))
+        return cursor.lastrowid
+
+
+def _set_image_metadata(cursor, sha256: str, metadata: Dict) -> None:
+    cursor.execute(
+        f"UPDATE blobs SET {', '.join(f'{column} = ?' for column in IMAGE_COLUMNS)} WHERE sha256 = ?",
+        [metadata.get(column) for column in IMAGE_COLUMNS] + [sha256],
+    )
+
+
+def backfill_image_metadata() -> int:
+    """
+    Fill in image metadata for blobs saved before it was extracted. Blocking.
+    
+    Returns:
+        Number of blobs updated
+    """
+    rows = get_db_connection().execute(
+        "SELECT sha256, stored_filename FROM blobs WHERE detected_type IS NULL"
+    ).fetchall()
+    saved_files_dir = get_saved_files_dir()
+    updated = 0
+    for row in rows:
+        try:
+            metadata = image_metadata(saved_files_dir / row["stored_filename"])
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read saved file {row['stored_filename']}: {e}")
+            continue
+        with transaction() as cursor:
+            _set_image_metadata(cursor, row["sha256"], metadata)
+        updated += 1
+    if updated:
+        logger.info(f"Indexed image metadata of {updated} saved files")
+    return updated
+
+
+def start_metadata_backfill() -> None:
+    """Run backfill_image_metadata in a background thread."""
+    threading.Thread(target=backfill_image_metadata, name="metadata-backfill", daemon=True).start()
+
+
+def get_blob(sha256: str) -> Optional[Dict]:
+    """Look up stored content by SHA-256."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        SELECT sha256, file_size, ref_count, created_at
+        FROM blobs
+        WHERE sha256 = ?
+    """, (sha256,))
+    
+    row = cursor.fetchone()
+    
+    return dict(row) if row else None
 
 
 def get_saved_files(device_type: Optional[str] = None) -> List[Dict]:
@@ -97,38 +460,189 @@ def get_saved_files(device_type: Optional[str] = None) -> List[Dict]:
     
     if device_type:
         cursor.execute("""
-            SELECT id, original_filename, device_type, description, file_size, created_at
+            SELECT id, original_filename, device_type, description, file_size, sha256, created_at
             FROM saved_files
             WHERE device_type = ?
             ORDER BY created_at DESC
         """, (device_type,))
     else:
         cursor.execute("""
-            SELECT id, original_filename, device_type, description, file_size, created_at
+            SELECT id, original_filename, device_type, description, file_size, sha256, created_at
             FROM saved_files
             ORDER BY created_at DESC
         """)
     
     rows = cursor.fetchall()
-    conn.close()
     
     # Convert rows to dictionaries
     return [dict(row) for row in rows]
 
 
+# Sort keys accepted by list_saved_files
+SORT_COLUMNS = ("created_at", "original_filename", "file_size")
+
+MAX_PAGE_SIZE = 200
+
+_fts_enabled = True
+
+_SAVED_FILE_COLUMNS = ", ".join(
+    [f"saved_files.{column}" for column in (
+        "id", "original_filename", "device_type", "description", "file_size", "sha256", "created_at"
+    )] + [f"blobs.{column}" for column in IMAGE_COLUMNS]
+)
+# Image metadata comes with the blob; files saved before hashing have none
+_SAVED_FILES_JOIN = "saved_files LEFT JOIN blobs ON blobs.sha256 = saved_files.sha256"
+
+
+def encode_cursor(value, file_id: int) -> str:
+    """Opaque keyset cursor for the row a page ended on."""
+    return base64.urlsafe_b64encode(json.dumps([value, file_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Decode a cursor from encode_cursor.
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        value, file_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(file_id, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return value, file_id
+
+
+def _fts_query(search: str) -> str:
+    """Turn free text into an FTS5 query: every word, as a prefix, must match."""
+    words = re.findall(r"\w+", search)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def get_saved_files_version() -> int:
+    """Counter that changes whenever any saved file is added, edited or deleted."""
+    row = get_db_connection().execute(
+        "SELECT value FROM meta WHERE key = 'saved_files_version'"
+    ).fetchone()
+    return row["value"] if row else 0
+
+
+def list_saved_files(
+    device_type: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: str = "created_at",
+    descending: bool = True,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    detected_type: Optional[str] = None,
+    chip: Optional[str] = None,
+    project_name: Optional[str] = None,
+    app_version: Optional[str] = None,
+    idf_version: Optional[str] = None,
+    fpga_idcode: Optional[str] = None,
+    sha256: Optional[str] = None,
+    built_after: Optional[str] = None,
+    built_before: Optional[str] = None,
+) -> Dict:
+    """
+    Get one page of saved files.
+    
+    Pages are keyset-paginated on (sort column, id), so each page costs the
+    same however deep into the list it is. Image metadata filters match
+    whole values, ignoring case.
+    
+    Args:
+        device_type: Optional filter by 'esp32' or 'fpga'
+        search: Words to find in file names and descriptions (prefix match)
+        sort: One of SORT_COLUMNS
+        descending: Sort direction
+        limit: Page size (capped at MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page
+        detected_type: Type found in the content ('esp32', 'fpga', 'unknown')
+        chip: ESP32 chip ('ESP32-S3') or FPGA part ('GW2A(R)-18(C)')
+        project_name: ESP-IDF project name
+        app_version: App version from the image
+        idf_version: ESP-IDF version the app was built with
+        fpga_idcode: IDCODE the bitstream targets ('0x0000081B')
+        sha256: Content hash
+        built_after: Build date on or after this 'YYYY-MM-DD'
+        built_before: Build date on or before this 'YYYY-MM-DD'
+        
+    Returns:
+        dict with 'files' and 'next_cursor' (None on the last page)
+        
+    Raises:
+        ValueError: For an unknown sort column or a malformed cursor
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {sort}")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    where = []
+    params: list = []
+    for column, value in (
+        ("saved_files.device_type", device_type),
+        ("saved_files.sha256", sha256.lower() if sha256 else None),
+        ("blobs.detected_type", detected_type),
+        ("blobs.chip", chip),
+        ("blobs.project_name", project_name),
+        ("blobs.app_version", app_version),
+        ("blobs.idf_version", idf_version),
+        ("blobs.fpga_idcode", fpga_idcode),
+    ):
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if built_after:
+        where.append("blobs.build_date >= ?")
+        params.append(built_after)
+    if built_before:
+        where.append("blobs.build_date <= ?")
+        params.append(built_before)
+    if search and search.strip():
+        if _fts_enabled:
+            match = _fts_query(search)
+            if match:
+                where.append("saved_files.id IN (SELECT rowid FROM saved_files_fts WHERE saved_files_fts MATCH ?)")
+                params.append(match)
+        else:
+            where.append("(saved_files.original_filename LIKE ? OR saved_files.description LIKE ?)")
+            params += [f"%{search.strip()}%"] * 2
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        op = "<" if descending else ">"
+        where.append(f"(saved_files.{sort}, saved_files.id) {op} (?, ?)")
+        params += [value, last_id]
+    
+    direction = "DESC" if descending else "ASC"
+    sql = f"SELECT {_SAVED_FILE_COLUMNS} FROM {_SAVED_FILES_JOIN}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY saved_files.{sort} {direction}, saved_files.id {direction} LIMIT ?"
+    params.append(limit + 1)
+    
+    rows = [dict(row) for row in get_db_connection().execute(sql, params)]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][sort], rows[-1]["id"])
+    return {"files": rows, "next_cursor": next_cursor}
+
+
 def get_saved_file(file_id: int) -> Optional[Dict]:
     """Get a specific saved file by ID."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT id, original_filename, stored_filename, device_type, description, file_size, created_at
-        FROM saved_files
-        WHERE id = ?
+    cursor.execute(f"""
+        SELECT {_SAVED_FILE_COLUMNS}, saved_files.stored_filename
+        FROM {_SAVED_FILES_JOIN}
+        WHERE saved_files.id = ?
     """, (file_id,))
     
     row = cursor.fetchone()
-    conn.close()
     
     return dict(row) if row else None
 
@@ -153,11 +667,7 @@ def update_saved_file_name(file_id: int, new_filename: str) -> bool:
         WHERE id = ?
     """, (new_filename, file_id))
     
-    rows_affected = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
-    return rows_affected > 0
+    return cursor.rowcount > 0
 
 
 def update_saved_file_description(file_id: int, new_description: str) -> bool:
@@ -180,17 +690,15 @@ def update_saved_file_description(file_id: int, new_description: str) -> bool:
         WHERE id = ?
     """, (new_description, file_id))
     
-    rows_affected = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
-    return rows_affected > 0
+    return cursor.rowcount > 0
 
 
 def delete_saved_file(file_id: int) -> bool:
     """
     Delete a saved file from database and filesystem.
     
+    The stored content is only removed when no other saved file refers to it.
+    
     Returns:
         True if deleted, False if not found
     """
@@ -200,17 +708,38 @@ def delete_saved_file(file_id: int) -> bool:
         return False
     
     # Delete from database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM saved_files WHERE id = ?", (file_id,))
-    conn.commit()
-    conn.close()
+    file_path = get_saved_files_dir() / file_info['stored_filename']
+    doomed_path = None
+    try:
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM saved_files WHERE id = ?", (file_id,))
+            if cursor.rowcount == 0:
+                # Deleted concurrently; that delete owns the reference
+                return False
+            if file_info["sha256"]:
+                cursor.execute(
+                    "UPDATE blobs SET ref_count = ref_count - 1 WHERE sha256 = ?", (file_info["sha256"],)
+                )
+                blob = cursor.execute(
+                    "SELECT ref_count FROM blobs WHERE sha256 = ?", (file_info["sha256"],)
+                ).fetchone()
+                if blob and blob["ref_count"] > 0:
+                    return True
+                cursor.execute("DELETE FROM blobs WHERE sha256 = ?", (file_info["sha256"],))
+            # Moved aside while the lock is held, so a save of the same content
+            # after the commit creates a fresh file instead of losing it to us
+            if file_path.exists():
+                doomed_path = file_path.with_name(f".delete-{uuid.uuid4().hex}")
+                os.replace(file_path, doomed_path)
+    except BaseException:
+        # Rolled back: the blob row still points at its file
+        if doomed_path is not None:
+            os.replace(doomed_path, file_path)
+        raise
     
     # Delete physical file
-    saved_files_dir = get_saved_files_dir()
-    file_path = saved_files_dir / file_info['stored_filename']
-    if file_path.exists():
-        file_path.unlink()
+    if doomed_path is not None:
+        doomed_path.unlink(missing_ok=True)
     
     return True
 
@@ -225,5 +754,91 @@ def get_saved_file_path(file_id: int) -> Optional[Path]:
     return saved_files_dir / file_info['stored_filename']
 
 
+HISTORY_COLUMNS = (
+    "operation", "device_type", "port", "device_serial", "image_sha256", "image_size",
+    "duration", "bytes_written", "kbit_per_s", "exit_code", "success", "log_id", "log_tail",
+)
+
+
+def add_history_record(record: Dict, max_records: Optional[int] = None) -> int:
+    """
+    Record one device operation.
+    
+    Args:
+        record: Values for HISTORY_COLUMNS (missing ones are stored as NULL)
+        max_records: If set, the oldest records beyond this many are pruned
+            (checked every 100 inserts)
+        
+    Returns:
+        The ID of the new record
+    """
+    conn = get_db_connection()
+    cursor = conn.execute(
+        f"INSERT INTO operation_history ({', '.join(HISTORY_COLUMNS)}) "
+        f"VALUES ({', '.join('?' for _ in HISTORY_COLUMNS)})",
+        [record.get(column) for column in HISTORY_COLUMNS],
+    )
+    record_id = cursor.lastrowid
+    if max_records and record_id % 100 == 0:
+        conn.execute("DELETE FROM operation_history WHERE id <= ?", (record_id - max_records,))
+    return record_id
+
+
+def get_history(
+    operation: Optional[str] = None,
+    port: Optional[str] = None,
+    device_type: Optional[str] = None,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Get recorded operations, newest first.
+    
+    Args:
+        operation: Optional filter ('flash', 'info' or 'status')
+        port: Optional filter by serial port
+        device_type: Optional filter by 'esp32', 'fpga' or 'esp32+fpga'
+        limit: Page size (capped at MAX_PAGE_SIZE)
+        before_id: Only records older than this ID (for the next page)
+    """
+    where, params = [], []
+    for column, value in (("operation", operation), ("port", port), ("device_type", device_type)):
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    
+    sql = "SELECT * FROM operation_history"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(max(1, min(limit, MAX_PAGE_SIZE)))
+    
+    return [dict(row) for row in get_db_connection().execute(sql, params)]
+
+
+def get_history_samples(operation: str, since: Optional[str] = None) -> List[Dict]:
+    """
+    Get the fields stats are computed from for one kind of operation.
+    
+    Args:
+        operation: 'flash', 'info' or 'status'
+        since: Optional 'YYYY-MM-DD HH:MM:SS' (UTC) lower bound on created_at
+    """
+    sql = """
+        SELECT port, device_type, duration, kbit_per_s, bytes_written, success
+        FROM operation_history
+        WHERE operation = ?
+    """
+    params = [operation]
+    if since:
+        sql += " AND created_at >= ?"
+        params.append(since)
+    
+    return [dict(row) for row in get_db_connection().execute(sql, params)]
+
+
 # Initialize database on module import
 init_db()
@@ -82,7 +82,7 @@ class DesktopApp:
             from mcp.server.sse import SseServerTransport
             
             from .server import app as mcp_app
-            from .api import api
+            from .api import api, lifespan
             
             # Create SSE transport for MCP
             sse = SseServerTransport("/messages/")
@@ -108,6 +108,7 @@ class DesktopApp:
                     Route("/sse", endpoint=handle_sse),
                     Mount("/", app=api),
                 ],
+                lifespan=lifespan,
             )
         
         # Create server config
@@ -0,0 +1,327 @@
+"""ESP32 firmware image parsing.
+
+An ESP32 app or bootloader image is a 24-byte header (magic 0xE9, segment
+count, flash settings, entry point, and an extended header with the chip id),
+followed by segments of (load address, length, data). After the segments,
+padded to a 16-byte boundary, comes an XOR checksum of all segment data, and
+usually the SHA-256 of everything before it. Apps start their first segment
+with ``esp_app_desc_t``, which names the project, version and ESP-IDF
+version.
+
+The parser walks that structure over a memoryview in bounded chunks, so a
+memory-mapped file is checked in one pass without being copied. Merged
+images (``esptool merge-bin``) are recognised by the partition table at
+0x8000; the bootloader and every app partition present in the file are
+checked.
+"""
+
+import hashlib
+import struct
+from dataclasses import asdict, dataclass, field
+
+ESP_IMAGE_MAGIC = 0xE9
+APP_DESC_MAGIC = 0xABCD5432
+CHECKSUM_SEED = 0xEF
+MAX_SEGMENTS = 16
+
+# magic, segment count, flash mode, flash size/frequency, entry point; then the
+# extended header: WP pin, SPI pin drive, chip id, legacy min revision, min and
+# max revision, reserved, hash appended
+IMAGE_HEADER = struct.Struct("<BBBBIB3sHBHH4sB")
+SEGMENT_HEADER = struct.Struct("<II")  # load address, length
+# magic, secure version, reserved, version, project name, time, date, IDF version, ELF SHA-256
+APP_DESC = struct.Struct("<II8s32s32s16s16s32s32s")
+# magic, type, subtype, offset, size, label, flags
+PARTITION_ENTRY = struct.Struct("<2sBBII16sI")
+
+PARTITION_TABLE_OFFSET = 0x8000
+PARTITION_TABLE_SIZE = 0xC00
+PARTITION_MAGIC = b"\xaa\x50"
+PARTITION_TYPE_APP = 0x00
+
+# Where merged images put the bootloader: 0x1000 on the ESP32 and ESP32-S2,
+# 0x2000 on the ESP32-P4 and ESP32-C5, 0x0 on the rest
+BOOTLOADER_OFFSETS = (0x0, 0x1000, 0x2000)
+
+# Segment data is checked this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+
+CHIP_NAMES = {
+    0: "ESP32",
+    2: "ESP32-S2",
+    5: "ESP32-C3",
+    9: "ESP32-S3",
+    12: "ESP32-C2",
+    13: "ESP32-C6",
+    16: "ESP32-H2",
+    18: "ESP32-P4",
+    20: "ESP32-C61",
+    23: "ESP32-C5",
+}
+FLASH_MODES = {0: "qio", 1: "qout", 2: "dio", 3: "dout"}
+FLASH_SIZES = {0: "1MB", 1: "2MB", 2: "4MB", 3: "8MB", 4: "16MB", 5: "32MB", 6: "64MB", 7: "128MB"}
+
+
+@dataclass
+class AppDescription:
+    """The ``esp_app_desc_t`` an ESP-IDF app embeds at the start of its first segment."""
+
+    project_name: str
+    version: str
+    idf_version: str
+    build_date: str
+    build_time: str
+    secure_version: int
+    elf_sha256: str
+
+
+@dataclass
+class Segment:
+    """One segment; offset is where its data starts, relative to the image."""
+
+    load_address: int
+    offset: int
+    length: int
+
+
+@dataclass
+class EspImage:
+    """What walking one image found. Any entry in errors makes it unusable."""
+
+    offset: int  # where the image starts in the file
+    chip_id: int | None = None
+    entry_point: int | None = None
+    flash_mode: str | None = None
+    flash_size: str | None = None
+    segments: list[Segment] = field(default_factory=list)
+    size: int | None = None  # header to end of the appended hash
+    checksum_valid: bool | None = None
+    sha256: str | None = None  # appended digest, None if the image has none
+    sha256_valid: bool | None = None
+    app: AppDescription | None = None
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def chip(self) -> str | None:
+        return CHIP_NAMES.get(self.chip_id)
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> dict:
+        return {"chip": self.chip, "valid": self.valid, **asdict(self)}
+
+
+@dataclass
+class EspFirmware:
+    """Every image in a file: one, or the bootloader and apps of a merged image."""
+
+    images: list[EspImage]
+    merged: bool = False
+
+    @property
+    def errors(self) -> list[str]:
+        return [f"Image at 0x{image.offset:x}: {error}" for image in self.images for error in image.errors]
+
+    @property
+    def valid(self) -> bool:
+        return bool(self.images) and not self.errors
+
+    @property
+    def app(self) -> AppDescription | None:
+        return next((image.app for image in self.images if image.app), None)
+
+    @property
+    def chip(self) -> str | None:
+        return next((image.chip for image in self.images if image.chip), None)
+
+    def to_dict(self) -> dict:
+        app = self.app
+        return {
+            "format": "esp32-merged" if self.merged else "esp32-image",
+            "valid": self.valid,
+            "errors": self.errors,
+            "chip": self.chip,
+            "app": asdict(app) if app else None,
+            "images": [image.to_dict() for image in self.images],
+        }
+
+
+def _text(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode("utf-8", "replace")
+
+
+def _xor_fold(value: int) -> int:
+    """XOR of all bytes of a non-negative integer."""
+    size = (value.bit_length() + 7) // 8
+    while size > 1:
+        half = size // 2
+        value = (value >> (8 * half)) ^ (value & ((1 << (8 * half)) - 1))
+        size -= half
+    return value
+
+
+def _xor_bytes(view: memoryview, start: int, end: int) -> int:
+    # XOR-ing the chunks as integers lines their bytes up column by column;
+    # folding the result once at the end gives the XOR of every byte
+    accumulated = 0
+    for position in range(start, end, CHUNK_SIZE):
+        accumulated ^= int.from_bytes(view[position:min(position + CHUNK_SIZE, end)], "little")
+    return _xor_fold(accumulated)
+
+
+def _sha256(view: memoryview, start: int, end: int) -> str:
+    digest = hashlib.sha256()
+    for position in range(start, end, CHUNK_SIZE * 16):
+        digest.update(view[position:min(position + CHUNK_SIZE * 16, end)])
+    return digest.hexdigest()
+
+
+def _app_description(view: memoryview, position: int) -> AppDescription | None:
+    if position + APP_DESC.size > len(view):
+        return None
+    (magic, secure_version, _reserved, version, project_name,
+     build_time, build_date, idf_version, elf_sha256) = APP_DESC.unpack_from(view, position)
+    if magic != APP_DESC_MAGIC:
+        return None
+    return AppDescription(
+        project_name=_text(project_name),
+        version=_text(version),
+        idf_version=_text(idf_version),
+        build_date=_text(build_date),
+        build_time=_text(build_time),
+        secure_version=secure_version,
+        elf_sha256=elf_sha256.hex(),
+    )
+
+
+def parse_esp_image(view: memoryview, offset: int = 0) -> EspImage:
+    """
+    Walk one ESP32 image: header, segments, checksum, appended SHA-256.
+
+    Args:
+        view: Unsigned byte view of the file
+        offset: Where the image starts in the view
+
+    Returns:
+        EspImage; problems are listed in its errors rather than raised
+    """
+    image = EspImage(offset)
+    end = len(view)
+    if end - offset < IMAGE_HEADER.size:
+        image.errors.append("File too short for an image header")
+        return image
+
+    (magic, segment_count, flash_mode, size_freq, entry_point, _wp_pin, _drive, chip_id,
+     _min_rev, _min_rev_full, _max_rev_full, _reserved, hash_appended) = IMAGE_HEADER.unpack_from(view, offset)
+    if magic != ESP_IMAGE_MAGIC:
+        image.errors.append(f"Bad magic byte 0x{magic:02x} (expected 0x{ESP_IMAGE_MAGIC:02x})")
+        return image
+    image.chip_id = chip_id
+    image.entry_point = entry_point
+    image.flash_mode = FLASH_MODES.get(flash_mode)
+    image.flash_size = FLASH_SIZES.get(size_freq >> 4)
+    if not 1 <= segment_count <= MAX_SEGMENTS:
+        image.errors.append(f"Implausible segment count {segment_count}")
+        return image
+
+    position = offset + IMAGE_HEADER.size
+    checksum = CHECKSUM_SEED
+    for index in range(segment_count):
+        if position + SEGMENT_HEADER.size > end:
+            image.errors.append(f"Truncated: file ends in the header of segment {index}")
+            return image
+        load_address, length = SEGMENT_HEADER.unpack_from(view, position)
+        position += SEGMENT_HEADER.size
+        if length > end - position:
+            image.errors.append(
+                f"Truncated: segment {index} needs {length} bytes at 0x{position:x}, "
+                f"only {end - position} left"
+            )
+            return image
+        image.segments.append(Segment(load_address, position - offset, length))
+        checksum ^= _xor_bytes(view, position, position + length)
+        position += length
+
+    # The checksum byte ends the image on a 16-byte boundary
+    position += 15 - (position - offset) % 16
+    if position >= end:
+        image.errors.append("Truncated: checksum byte missing")
+        return image
+    image.checksum_valid = view[position] == checksum
+    if not image.checksum_valid:
+        image.errors.append(
+            f"Checksum mismatch: image has 0x{view[position]:02x}, segments give 0x{checksum:02x}"
+        )
+    position += 1
+
+    if hash_appended == 1:
+        if position + 32 > end:
+            image.errors.append("Truncated: appended SHA-256 missing")
+            return image
+        image.sha256 = view[position:position + 32].hex()
+        image.sha256_valid = _sha256(view, offset, position) == image.sha256
+        if not image.sha256_valid:
+            image.errors.append("SHA-256 mismatch: image contents do not match the appended digest")
+        position += 32
+    image.size = position - offset
+
+    first = image.segments[0]
+    image.app = _app_description(view, offset + first.offset) if first.length >= APP_DESC.size else None
+    return image
+
+
+def partition_table(view: memoryview) -> list[dict] | None:
+    """Entries of the partition table at 0x8000, None if there is none."""
+    if bytes(view[PARTITION_TABLE_OFFSET:PARTITION_TABLE_OFFSET + 2]) != PARTITION_MAGIC:
+        return None
+    entries = []
+    table_end = min(len(view), PARTITION_TABLE_OFFSET + PARTITION_TABLE_SIZE)
+    for position in range(PARTITION_TABLE_OFFSET, table_end - PARTITION_ENTRY.size + 1, PARTITION_ENTRY.size):
+        magic, kind, subtype, offset, size, label, flags = PARTITION_ENTRY.unpack_from(view, position)
+        # The table ends with an MD5 entry or erased flash
+        if magic != PARTITION_MAGIC:
+            break
+        entries.append({
+            "label": _text(label), "type": kind, "subtype": subtype,
+            "offset": offset, "size": size, "flags": flags,
+        })
+    return entries
+
+
+def merged_bootloader_offset(view: memoryview) -> int | None:
+    """Bootloader offset if the view is a merged image (bootloader + partition table), else None."""
+    if len(view) < PARTITION_TABLE_OFFSET + PARTITION_ENTRY.size:
+        return None
+    if bytes(view[PARTITION_TABLE_OFFSET:PARTITION_TABLE_OFFSET + 2]) != PARTITION_MAGIC:
+        return None
+    return next((offset for offset in BOOTLOADER_OFFSETS if view[offset] == ESP_IMAGE_MAGIC), None)
+
+
+def parse_esp_firmware(view: memoryview) -> EspFirmware | None:
+    """
+    Parse a single ESP32 image, or every image in a merged flash image.
+
+    Args:
+        view: Unsigned byte view of the file
+
+    Returns:
+        EspFirmware, or None if the data is neither an image nor a merged image
+    """
+    bootloader = merged_bootloader_offset(view)
+    if bootloader is None:
+        if not len(view) or view[0] != ESP_IMAGE_MAGIC:
+            return None
+        return EspFirmware([parse_esp_image(view, 0)])
+
+    images = [parse_esp_image(view, bootloader)]
+    # An app flashed on its own can run past 0x8000; a bootloader never does
+    if images[0].size is not None and bootloader + images[0].size > PARTITION_TABLE_OFFSET:
+        return EspFirmware(images)
+    for entry in partition_table(view) or []:
+        start = entry["offset"]
+        # OTA slots are usually left out of merged images
+        if entry["type"] == PARTITION_TYPE_APP and start < len(view) and view[start] == ESP_IMAGE_MAGIC:
+            images.append(parse_esp_image(view, start))
+    return EspFirmware(images, merged=True)
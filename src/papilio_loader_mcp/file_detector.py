@@ -1,23 +1,91 @@
-"""Binary file type detection for ESP32 and FPGA files."""
+"""Binary file type detection for ESP32 and FPGA files.
 
-def detect_binary_type(file_content: bytes) -> dict:
+Detection takes a file path or any buffer-protocol object (bytes, bytearray,
+memoryview, mmap). Files are memory-mapped rather than read, so only the pages
+a check touches are loaded and the cost of validating a 64 MB image is the
+same as a 1 KB one. Checks that look past the header work on bounded windows
+of the mapping, and ``parse_image`` hands the mapping to the structural
+parser for the detected type (``esp_image`` for ESP32 images,
+``gowin_bitstream`` for FPGA bitstreams).
+"""
+
+import mmap
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Union
+
+from .config import get_config
+from .esp_image import merged_bootloader_offset, parse_esp_firmware
+from .gowin_bitstream import GOWIN_SYNC_WORDS, SYNC_SEARCH_LIMIT, parse_gowin_bitstream
+
+# Detection only looks at the start of the file
+HEADER_SIZE = 32
+
+# A path, or bytes-like content already in memory
+FileSource = Union[str, os.PathLike, bytes, bytearray, memoryview, mmap.mmap]
+
+
+@contextmanager
+def open_image(source: FileSource) -> Iterator[memoryview]:
+    """
+    Read-only byte view of a file or buffer, without copying it.
+    
+    Paths are memory-mapped. Slices taken from the view must not outlive the
+    ``with`` block; copy what you keep with ``bytes()``.
+    
+    Args:
+        source: File path or buffer-protocol object
+        
+    Yields:
+        memoryview of unsigned bytes
+    
+    Raises:
+        FileNotFoundError: If source is a path that does not exist
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        with memoryview(source) as view, view.cast("B") as flat:
+            yield flat
+        return
+    
+    with open(source, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                yield view
+
+
+def detect_binary_type(source: FileSource) -> dict:
     """
     Detect if a binary file is ESP32 firmware or FPGA bitstream.
     
     Args:
-        file_content: Binary content of the file
+        source: File path, or the file content as bytes/memoryview/mmap
         
     Returns:
-        dict with 'type' (esp32/fpga/unknown), 'confidence', and 'reason'
+        dict with 'type' (esp32/fpga/unknown), 'confidence', 'reason' and 'size'
+    
+    Raises:
+        FileNotFoundError: If source is a path that does not exist
     """
-    if len(file_content) < 32:
+    with open_image(source) as view:
+        detection = _detect(view)
+        detection["size"] = len(view)
+    return detection
+
+
+def _detect(view: memoryview) -> dict:
+    if len(view) < HEADER_SIZE:
         return {
             "type": "unknown",
             "confidence": "low",
             "reason": "File too small to identify"
         }
     
-    header = file_content[:32]
+    header = view[:HEADER_SIZE].tobytes()
     
     # ESP32 firmware detection
     # ESP32 images start with magic byte 0xE9
@@ -28,6 +96,16 @@ def detect_binary_type(file_content: bytes) -> dict:
             "reason": "ESP32 image magic byte (0xE9) detected at start"
         }
     
+    # Merged images for chips with the bootloader at 0x1000 start with erased
+    # flash, which would otherwise look like FPGA padding
+    bootloader = merged_bootloader_offset(view)
+    if bootloader is not None:
+        return {
+            "type": "esp32",
+            "confidence": "high",
+            "reason": f"Merged ESP32 image (bootloader at 0x{bootloader:x}, partition table at 0x8000)"
+        }
+    
     # FPGA bitstream detection (Gowin)
     # Gowin bitstreams typically start with many 0xFF bytes (padding)
     # followed by sync pattern
@@ -43,6 +121,16 @@ def detect_binary_type(file_content: bytes) -> dict:
                     "reason": "Gowin FPGA bitstream pattern detected (0xFF padding + sync word)"
                 }
         
+        # Longer padding pushes the sync word past the header
+        window = view[:SYNC_SEARCH_LIMIT].tobytes()
+        rest = window.lstrip(b"\xff")
+        if rest[:2] in GOWIN_SYNC_WORDS:
+            return {
+                "type": "fpga",
+                "confidence": "high",
+                "reason": f"Gowin FPGA bitstream pattern detected ({len(window) - len(rest)} bytes of 0xFF padding + sync word)"
+            }
+        
         # Even without sync word, many 0xFF bytes suggest FPGA
         return {
             "type": "fpga",
@@ -58,18 +146,107 @@ def detect_binary_type(file_content: bytes) -> dict:
     }
 
 
-def validate_file_for_device(file_content: bytes, intended_device: str) -> dict:
+def _parse(view: memoryview, detected_type: str, check_part: bool = True) -> dict | None:
+    if detected_type == "esp32":
+        firmware = parse_esp_firmware(view)
+        return firmware.to_dict() if firmware else None
+    if detected_type == "fpga":
+        idcodes = [int(code, 16) for code in get_config().fpga_idcodes] if check_part else []
+        bitstream = parse_gowin_bitstream(view, idcodes)
+        return bitstream.to_dict() if bitstream else None
+    return None
+
+
+def parse_image(source: FileSource, detected_type: str | None = None) -> dict | None:
+    """
+    Walk the structure of a firmware file with the parser for its type.
+    
+    Args:
+        source: File path, or the file content as bytes/memoryview/mmap
+        detected_type: Type to parse as; detected from the content if omitted
+        
+    Returns:
+        The parser's report, with 'valid' and 'errors', or None if there is
+        no parser for the type or the content is not in its format
+    
+    Raises:
+        FileNotFoundError: If source is a path that does not exist
+    """
+    with open_image(source) as view:
+        if detected_type is None:
+            detected_type = _detect(view)["type"]
+        return _parse(view, detected_type)
+
+
+def image_metadata(source: FileSource) -> dict:
+    """
+    What saved files are indexed by: detected type and what the image parser found.
+    
+    Args:
+        source: File path, or the file content as bytes/memoryview/mmap
+        
+    Returns:
+        dict with 'detected_type', 'confidence', 'image_valid', 'chip' (ESP32
+        chip or FPGA part), 'project_name', 'app_version', 'build_date'
+        (YYYY-MM-DD), 'idf_version' and 'fpga_idcode'; None where the file
+        has no such field
+    
+    Raises:
+        FileNotFoundError: If source is a path that does not exist
+    """
+    with open_image(source) as view:
+        detection = _detect(view)
+        # Damage only; which part the board takes is checked when flashing
+        image = _parse(view, detection["type"], check_part=False)
+    
+    metadata = {
+        "detected_type": detection["type"],
+        "confidence": detection["confidence"],
+        **dict.fromkeys(("image_valid", "chip", "project_name", "app_version", "build_date",
+                         "idf_version", "fpga_idcode")),
+    }
+    if image is None:
+        return metadata
+    metadata["image_valid"] = image["valid"]
+    if image["format"] == "gowin-bitstream":
+        metadata["chip"] = image["part"]
+        metadata["fpga_idcode"] = image["idcode"]
+        return metadata
+    metadata["chip"] = image["chip"]
+    app = image["app"]
+    if app:
+        metadata["project_name"] = app["project_name"]
+        metadata["app_version"] = app["version"]
+        metadata["idf_version"] = app["idf_version"]
+        try:
+            # __DATE__ format, "Mar  5 2024"
+            metadata["build_date"] = datetime.strptime(app["build_date"], "%b %d %Y").date().isoformat()
+        except ValueError:
+            metadata["build_date"] = app["build_date"] or None
+    return metadata
+
+
+def validate_file_for_device(source: FileSource, intended_device: str) -> dict:
     """
     Validate if a binary file matches the intended device type.
     
+    Files of a type with a structural parser are also checked for damage
+    (truncation, bad checksums); the report is returned as 'image'.
+    
     Args:
-        file_content: Binary content of the file
+        source: File path, or the file content as bytes/memoryview/mmap
         intended_device: 'esp32' or 'fpga'
         
     Returns:
-        dict with 'valid', 'detected_type', 'warning', 'details'
+        dict with 'valid', 'detected_type', 'warning', 'details', 'image'
+    
+    Raises:
+        FileNotFoundError: If source is a path that does not exist
     """
-    detection = detect_binary_type(file_content)
+    with open_image(source) as view:
+        detection = _detect(view)
+        detection["size"] = len(view)
+        image = _parse(view, detection["type"])
     detected = detection["type"]
     
     if detected == "unknown":
@@ -77,15 +254,19 @@ def validate_file_for_device(file_content: bytes, intended_device: str) -> dict:
             "valid": True,  # Allow unknown types (user's choice)
             "detected_type": "unknown",
             "warning": f"⚠️ Could not identify file type. {detection['reason']}",
-            "details": detection
+            "details": detection,
+            "image": None
         }
     
     if detected == intended_device:
+        damaged = image is not None and not image["valid"]
         return {
             "valid": True,
             "detected_type": detected,
-            "warning": None,
-            "details": detection
+            # The flash itself refuses damaged images
+            "warning": f"⚠️ Damaged image: {'; '.join(image['errors'])}" if damaged else None,
+            "details": detection,
+            "image": image
         }
     
     # Mismatch detected!
@@ -94,5 +275,6 @@ def validate_file_for_device(file_content: bytes, intended_device: str) -> dict:
         "valid": False,
         "detected_type": detected,
         "warning": f"⚠️ WARNING: This appears to be {device_names.get(detected, 'unknown')} firmware, but you're trying to flash it to {device_names.get(intended_device, 'unknown')}!",
-        "details": detection
+        "details": detection,
+        "image": image
     }
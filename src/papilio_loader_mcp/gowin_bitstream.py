@@ -0,0 +1,365 @@
+"""Gowin FPGA bitstream parsing.
+
+A Gowin ``.bin`` bitstream is 0xFF padding, a sync word (0xA5C3), and a
+header of configuration commands: the IDCODE of the part it was built for,
+option flags, and the number of configuration frames with a flag saying
+whether the frames carry CRCs. Each frame is its data, a CRC-16/ARC, and a
+six-byte 0xFF trailer. The CRC covers the previous frame's trailer and the
+data; the first frame's covers the header commands instead. A footer with a
+checksum and the "program done" command ends the stream.
+
+The header does not give the frame length, so it is found by running the CRC
+over the first frame until it matches the two bytes that follow. The other
+frames are then checked without a per-byte loop in Python. CRC-16 is linear,
+so every bit of a CRC is the parity of the message ANDed with a fixed mask,
+and the frames after the first, each taken with the trailer before it, form
+one message with a zero CRC when every frame's CRC is right. The polynomial
+repeats every 32767 bits, so that message is folded into 32767 bytes and
+checked at once; only if that fails is it halved, down to single frames, to
+find the damaged ones. All of this works on a memoryview, so a memory-mapped
+file is checked without being read into memory.
+"""
+
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from typing import Iterable
+
+GOWIN_SYNC_WORDS = (b"\xa5\xc3", b"\xa5\x5c")
+
+# How far into a file the sync word is searched for, past the 0xFF padding
+SYNC_SEARCH_LIMIT = 4096
+
+CMD_IDCODE = 0x06
+CMD_CHECKSUM = 0x0A
+CMD_SECURITY = 0x0B
+CMD_CONFIG = 0x10
+CMD_FRAMES = 0x3B
+CMD_SPI_ADDRESS = 0xD2
+CMD_DONE = 0x08
+
+# Header commands and their length in bytes, command byte included
+HEADER_COMMANDS = {
+    CMD_IDCODE: 8,
+    CMD_CHECKSUM: 8,
+    CMD_SECURITY: 4,
+    CMD_CONFIG: 8,
+    0x12: 4,
+    0x51: 8,  # compression keys
+    0x52: 8,
+    CMD_FRAMES: 4,  # last command; frames follow
+    CMD_SPI_ADDRESS: 8,  # not covered by the first frame's CRC
+}
+CONFIG_COMPRESSED = 1 << 13
+FRAMES_CRC_CHECK = 1 << 23
+
+FRAME_TRAILER = b"\xff" * 6
+# Longest first frame searched for its CRC; the largest parts use ~2 KB
+MAX_FRAME_DATA = 16 * 1024
+# Bytes between the last frame and "program done" (dummy line, checksum)
+FOOTER_LIMIT = 256
+MAX_REPORTED_FRAMES = 16
+
+CRC_POLY = 0xA001  # CRC-16/ARC, reflected, initial value 0
+# x^16 + x^15 + x^2 + 1 divides x^32767 + 1: bits 32767 apart, and so bytes
+# 32767 apart, contribute the same to a CRC
+CRC_PERIOD = 32767
+
+GOWIN_PARTS = {
+    0x0900281B: "GW1N-1",
+    0x0100681B: "GW1NZ-1",
+    0x0100381B: "GW1N(R)-4",
+    0x0100981B: "GW1NS(R)-4C",
+    0x0100481B: "GW1N(R)-9",
+    0x1100481B: "GW1N(R)-9C",
+    0x0000081B: "GW2A(R)-18(C)",
+    0x0000281B: "GW2A-55",
+    0x0001481B: "GW5A(R)-25",
+}
+
+
+def _crc_table() -> list[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ CRC_POLY if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+def _low_bits_table() -> list[str]:
+    # The register's low bit before each of the 8 shifts of one table step,
+    # which depends only on its low byte
+    table = []
+    for byte in range(256):
+        bits = []
+        for _ in range(8):
+            bits.append("1" if byte & 1 else "0")
+            byte = (byte >> 1) ^ CRC_POLY if byte & 1 else byte >> 1
+        table.append("".join(bits))
+    return table
+
+
+CRC_TABLE = _crc_table()
+LOW_BITS = _low_bits_table()
+
+
+def crc16(data, crc: int = 0) -> int:
+    """CRC-16/ARC of data, continuing from crc."""
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+@lru_cache(maxsize=8)
+def _crc_masks(length: int) -> tuple[int, ...]:
+    """
+    Masks m with bit b of crc16(data) == parity(int.from_bytes(data, "little") & m[b]).
+
+    Holds for any data of this length. A data bit at little-endian position i
+    ends up as the register value u(8 * length + 15 - i), where u(t) is the
+    register t shifts after starting at 0x8000 with no further input. Mask b
+    collects bit b of those values. Bit b + 1 of u(t) is bit b of u(t + 1)
+    with the feedback taken out, so every mask is a shift of the previous
+    one and only the low bit of u has to be generated.
+    """
+    total = 8 * length + 16
+    # Start at t = 16 and record the low bit of u(t) up to t = total + 15
+    state = 0x8000
+    for _ in range(2):
+        state = (state >> 8) ^ CRC_TABLE[state & 0xFF]
+    chunks = []
+    for _ in range(total // 8):
+        chunks.append(LOW_BITS[state & 0xFF])
+        state = (state >> 8) ^ CRC_TABLE[state & 0xFF]
+    sequence = int("".join(chunks), 2)
+
+    full = (1 << total) - 1
+    masks = [sequence]
+    for bit in range(15):
+        shifted = (masks[-1] << 1) & full
+        masks.append(shifted ^ sequence if CRC_POLY >> bit & 1 else shifted)
+    # The low 16 bits only fed the shifts
+    return tuple(mask >> 16 for mask in masks)
+
+
+def _crc_is_zero(view: memoryview, start: int, length: int) -> bool:
+    # XOR period-long chunks lined up at the end of the message; the leading
+    # chunk is short, and leading zeros do not change the CRC. One set of
+    # masks then serves messages of any length.
+    value = 0
+    for end in range(start + length, start, -CRC_PERIOD):
+        chunk = view[max(start, end - CRC_PERIOD):end]
+        value ^= int.from_bytes(chunk, "little") << 8 * (CRC_PERIOD - len(chunk))
+    for mask in _crc_masks(CRC_PERIOD):
+        if (value & mask).bit_count() & 1:
+            return False
+    return True
+
+
+@dataclass
+class GowinBitstream:
+    """What walking a bitstream found. Any entry in errors makes it unusable."""
+
+    size: int
+    idcode: int | None = None
+    compressed: bool = False
+    security: bool = False
+    crc_check: bool = False  # frames carry CRCs
+    frame_count: int | None = None  # as the header gives it
+    frame_size: int | None = None  # data bytes per frame
+    frames_checked: int = 0
+    bad_frames: list[int] = field(default_factory=list)  # numbered from 1, first few only
+    checksum: int | None = None  # from the footer; reported, not verified
+    errors: list[str] = field(default_factory=list)
+    warnings: list[str] = field(default_factory=list)
+
+    @property
+    def part(self) -> str | None:
+        return GOWIN_PARTS.get(self.idcode)
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> dict:
+        report = asdict(self)
+        report["idcode"] = _hex_idcode(self.idcode) if self.idcode is not None else None
+        report["checksum"] = f"0x{self.checksum:04X}" if self.checksum is not None else None
+        return {"format": "gowin-bitstream", "valid": self.valid, "part": self.part, **report}
+
+
+def _hex_idcode(idcode: int) -> str:
+    return f"0x{idcode:08X}"
+
+
+def _describe_part(idcode: int) -> str:
+    part = GOWIN_PARTS.get(idcode)
+    return f"{part} ({_hex_idcode(idcode)})" if part else _hex_idcode(idcode)
+
+
+def _check_part(bitstream: GowinBitstream, idcodes: list[int]) -> None:
+    if not idcodes:
+        return
+    if bitstream.idcode is None:
+        bitstream.warnings.append("No IDCODE in the header; the target part could not be checked")
+    elif bitstream.idcode not in idcodes:
+        bitstream.errors.append(
+            f"Built for {_describe_part(bitstream.idcode)}, "
+            f"but this board takes {', '.join(_describe_part(code) for code in idcodes)}"
+        )
+
+
+def _frame_data_length(view: memoryview, start: int, crc: int) -> int | None:
+    """Data bytes of the frame at start: where the running CRC first matches the next two bytes."""
+    table = CRC_TABLE
+    end = min(len(view) - 2 - len(FRAME_TRAILER), start + MAX_FRAME_DATA)
+    for position in range(start, end):
+        crc = (crc >> 8) ^ table[(crc ^ view[position]) & 0xFF]
+        if crc == view[position + 1] | view[position + 2] << 8 and view[position + 3:position + 9] == FRAME_TRAILER:
+            return position + 1 - start
+    return None
+
+
+def _bad_frames(view: memoryview, start: int, count: int, length: int) -> list[int]:
+    """
+    Indices of frames with a wrong CRC among count frames of length bytes.
+
+    Each frame is taken as the previous trailer, data and CRC, so start is
+    where the trailer before the first of them begins, and a correct frame
+    has a zero CRC. Frames that all check out give a zero CRC together, so
+    only halves that do not are looked into.
+    """
+    if _crc_is_zero(view, start, count * length):
+        return []
+    if count == 1:
+        return [0]
+    half = count // 2
+    second = _bad_frames(view, start + half * length, count - half, length)
+    return _bad_frames(view, start, half, length) + [half + index for index in second]
+
+
+def _check_frames(bitstream: GowinBitstream, view: memoryview, start: int, crc: int) -> int | None:
+    """Check every frame's CRC; returns where the frames end, None if that is unknown."""
+    count = bitstream.frame_count
+    data_length = _frame_data_length(view, start, crc)
+    if data_length is None:
+        bitstream.errors.append(f"Frame 1 at 0x{start:x}: no matching CRC within {MAX_FRAME_DATA} bytes")
+        return None
+    bitstream.frames_checked = 1
+
+    if bitstream.compressed:
+        # Compressed frames differ in length; each one is found like the first
+        position = start + data_length + 8
+        for number in range(2, count + 1):
+            data_length = _frame_data_length(view, position, crc16(FRAME_TRAILER))
+            if data_length is None:
+                bitstream.errors.append(f"Frame {number} at 0x{position:x}: no matching CRC")
+                return None
+            bitstream.frames_checked = number
+            position += data_length + 8
+        return position
+
+    bitstream.frame_size = data_length
+    length = data_length + 2 + len(FRAME_TRAILER)
+    available = min(count, (len(view) - start) // length)
+    bad = _bad_frames(view, start + data_length + 2, available - 1, length)
+    bitstream.frames_checked = available
+    if bad:
+        first = bad[0] + 2
+        bitstream.bad_frames = [index + 2 for index in bad[:MAX_REPORTED_FRAMES]]
+        bitstream.errors.append(
+            f"CRC mismatch in {len(bad)} of {count} frames "
+            f"(first: frame {first} at 0x{start + (first - 1) * length:x})"
+        )
+    if available < count:
+        bitstream.errors.append(
+            f"Truncated: {count} frames of {length} bytes need {start + count * length} bytes, "
+            f"file has {len(view)}"
+        )
+        return None
+    return start + count * length
+
+
+def _check_footer(bitstream: GowinBitstream, view: memoryview, position: int) -> None:
+    end = min(len(view), position + FOOTER_LIMIT)
+    # A dummy line of 0xFF with a CRC over it and the last frame's trailer
+    padding = len(view[position:end]) - len(bytes(view[position:end]).lstrip(b"\xff"))
+    stored = bytes(view[position + padding:position + padding + 2])
+    if len(stored) == 2 and int.from_bytes(stored, "little") == crc16(b"\xff" * (len(FRAME_TRAILER) + padding)):
+        position += padding + 2
+
+    while position < end:
+        command = view[position]
+        if command == 0xFF:
+            position += 1
+        elif command == CMD_CHECKSUM and position + 8 <= end:
+            bitstream.checksum = int.from_bytes(view[position + 6:position + 8], "big")
+            position += 8
+        elif command == CMD_DONE and position + 4 <= end:
+            return
+        else:
+            bitstream.warnings.append(f"Unexpected byte 0x{command:02x} at 0x{position:x} after the frames")
+            return
+    bitstream.errors.append("Truncated: no program-done command after the frames")
+
+
+def parse_gowin_bitstream(view: memoryview, idcodes: Iterable[int] = ()) -> GowinBitstream | None:
+    """
+    Walk a Gowin bitstream: header commands, frame CRCs, footer.
+
+    Args:
+        view: Unsigned byte view of the file
+        idcodes: IDCODEs of the parts the bitstream may target; any part if empty
+
+    Returns:
+        GowinBitstream, or None if there is no sync word after the padding;
+        problems are listed in its errors rather than raised
+    """
+    window = bytes(view[:SYNC_SEARCH_LIMIT])
+    position = len(window) - len(window.lstrip(b"\xff"))
+    if bytes(view[position:position + 2]) not in GOWIN_SYNC_WORDS:
+        return None
+    bitstream = GowinBitstream(size=len(view))
+    position += 2
+
+    # The header commands, except the SPI address, start the first frame's CRC
+    crc = 0
+    while True:
+        if position >= len(view):
+            bitstream.errors.append("Truncated: file ends in the header")
+            return bitstream
+        command = view[position]
+        length = HEADER_COMMANDS.get(command)
+        if length is None:
+            bitstream.warnings.append(f"Unknown header command 0x{command:02x} at 0x{position:x}; frames not checked")
+            _check_part(bitstream, list(idcodes))
+            return bitstream
+        if position + length > len(view):
+            bitstream.errors.append(f"Truncated: header command 0x{command:02x} at 0x{position:x}")
+            return bitstream
+        line = view[position:position + length]
+        if command != CMD_SPI_ADDRESS:
+            crc = crc16(line, crc)
+        value = int.from_bytes(line, "big")
+        position += length
+        if command == CMD_IDCODE:
+            bitstream.idcode = value & 0xFFFFFFFF
+        elif command == CMD_CONFIG:
+            bitstream.compressed = bool(value & CONFIG_COMPRESSED)
+        elif command == CMD_SECURITY:
+            bitstream.security = True
+        elif command == CMD_FRAMES:
+            bitstream.crc_check = bool(value & FRAMES_CRC_CHECK)
+            bitstream.frame_count = value & 0xFFFF
+            break
+
+    _check_part(bitstream, list(idcodes))
+    if not bitstream.crc_check:
+        bitstream.warnings.append("Frame CRCs are disabled in this bitstream; frames not checked")
+        return bitstream
+    frames_end = _check_frames(bitstream, view, position, crc)
+    if frames_end is not None:
+        _check_footer(bitstream, view, frames_end)
+    return bitstream
@@ -0,0 +1,162 @@
+"""Flash history: an audit record of every device operation, and stats over it.
+
+Tools call ``record_operation`` when they finish. Records go to the
+``operation_history`` table with what the tool output says about the run
+(bytes written, effective throughput, which port was auto-detected, parsed by
+``tools.output_parser``), so slow ports, cables and hubs show up in
+``history_stats``.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from .config import get_config
+from .database import add_history_record, get_history_samples, run_db
+from .tools.output_parser import parse_output
+
+logger = logging.getLogger(__name__)
+
+LOG_TAIL_CHARS = 4000
+
+OPERATIONS = ("flash", "info", "status")
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile of a list of numbers (None when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * pct / 100))
+    return ordered[rank - 1]
+
+
+def _file_sha256(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _usb_serial(port: str) -> str | None:
+    """USB serial number of a port, from the port watcher's table."""
+    from .tools.serial_ports import get_port_watcher
+
+    for info in get_port_watcher().snapshot()["ports"]:
+        if info["device"] == port:
+            return info.get("serial_number")
+    return None
+
+
+async def record_operation(
+    operation: str,
+    device_type: str,
+    port: str,
+    success: bool,
+    duration: float | None = None,
+    exit_code: int | None = None,
+    output: str = "",
+    log_id: str | None = None,
+    image_path: Path | None = None,
+    image_sha256: str | None = None,
+) -> None:
+    """
+    Add a device operation to the history. Never raises: a failure to record
+    must not turn a successful flash into an error.
+
+    Args:
+        operation: "flash", "info" or "status"
+        device_type: "esp32", "fpga" or "esp32+fpga"
+        port: Port as requested (an auto-detected port is read from the output)
+        success: Whether the operation succeeded
+        duration: Wall-clock seconds
+        exit_code: Tool exit code, None if the tool never ran to completion
+        output: Tool output (only the tail is stored)
+        log_id: Operation id of the full log, if there is one
+        image_path: Image that was flashed
+        image_sha256: SHA-256 of the image when the caller already has it
+            (uploads and saved files); otherwise the image is hashed here
+    """
+    try:
+        report = parse_output(output)
+        if not port or port.upper() == "AUTO":
+            # esptool prints the port it ended up on
+            port = report.port or "AUTO"
+
+        serial = _usb_serial(port) or report.mac
+
+        image_size = None
+        if image_path is not None and Path(image_path).exists():
+            image_size = Path(image_path).stat().st_size
+            if image_sha256 is None:
+                image_sha256 = await asyncio.to_thread(_file_sha256, Path(image_path))
+
+        await run_db(add_history_record, {
+            "operation": operation,
+            "device_type": device_type,
+            "port": port,
+            "device_serial": serial,
+            "image_sha256": image_sha256,
+            "image_size": image_size,
+            "duration": round(duration, 3) if duration is not None else None,
+            "bytes_written": report.bytes_written,
+            "kbit_per_s": report.kbit_per_s,
+            "exit_code": exit_code,
+            "success": int(bool(success)),
+            "log_id": log_id,
+            "log_tail": output[-LOG_TAIL_CHARS:],
+        }, get_config().max_history_records)
+    except Exception as e:
+        logger.warning(f"Could not record {operation} on {port} in history: {e}")
+
+
+def _summarize(samples: list[dict]) -> dict:
+    durations = [s["duration"] for s in samples if s["duration"] is not None and s["success"]]
+    rates = [s["kbit_per_s"] for s in samples if s["kbit_per_s"] is not None and s["success"]]
+    return {
+        "count": len(samples),
+        "failures": sum(1 for s in samples if not s["success"]),
+        "duration_p50": percentile(durations, 50),
+        "duration_p95": percentile(durations, 95),
+        "kbit_per_s_p50": percentile(rates, 50),
+        "kbit_per_s_min": min(rates) if rates else None,
+    }
+
+
+def history_stats(operation: str = "flash", days: float | None = 30) -> dict:
+    """
+    Duration and throughput percentiles per port and per device type.
+
+    Durations and throughput only count successful runs; failures are
+    counted separately.
+
+    Args:
+        operation: "flash", "info" or "status"
+        days: Only look at the last this many days (None for everything)
+
+    Returns:
+        dict with "by_port" and "by_device_type" summaries
+    """
+    since = None
+    if days is not None:
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    samples = get_history_samples(operation, since)
+
+    by_port: dict[str, list] = defaultdict(list)
+    by_device_type: dict[str, list] = defaultdict(list)
+    for sample in samples:
+        by_port[sample["port"] or "unknown"].append(sample)
+        by_device_type[sample["device_type"] or "unknown"].append(sample)
+
+    return {
+        "operation": operation,
+        "since": since,
+        "total": _summarize(samples),
+        "by_port": {port: _summarize(group) for port, group in sorted(by_port.items())},
+        "by_device_type": {dt: _summarize(group) for dt, group in sorted(by_device_type.items())},
+    }
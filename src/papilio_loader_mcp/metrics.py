@@ -0,0 +1,314 @@
+"""Prometheus-style metrics.
+
+A small hand-rolled registry of counters, gauges and histograms rendered in
+the Prometheus text exposition format at ``/metrics``, so the server can be
+scraped without adding a client library. Metrics are module-level objects;
+code that has something to measure imports the metric and updates it.
+Values that already live elsewhere (queue depth) are read when scraped.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers fast API calls up to multi-minute flashes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SPAWN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, or is read from a callback when scraped.
+
+    A callback returns {label values tuple: value}, or a plain number for an
+    unlabelled gauge.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Callable | None = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list[str]:
+        if self._callback is not None:
+            values = self._callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+            items = sorted((tuple(str(v) for v in key), value) for key, value in values.items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """Context manager that observes the time spent inside it."""
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    """Ordered collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _queue_depths() -> dict:
+    from .scheduler import get_scheduler
+
+    status = get_scheduler().status()
+    return {(port,): len(info["queued"]) for port, info in status["ports"].items()}
+
+
+def _running_jobs() -> int:
+    from .scheduler import get_scheduler
+
+    return get_scheduler().status()["running"]
+
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "papilio_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")
+))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "papilio_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")
+))
+MCP_TOOL_CALLS = REGISTRY.register(Counter(
+    "papilio_mcp_tool_calls_total", "MCP tool calls by tool and outcome.", ("tool", "status")
+))
+MCP_TOOL_LATENCY = REGISTRY.register(Histogram(
+    "papilio_mcp_tool_duration_seconds", "MCP tool call latency.", ("tool",)
+))
+TOOL_SPAWN = REGISTRY.register(Histogram(
+    "papilio_tool_spawn_seconds", "Time to start an esptool/pesptool process.", ("tool",),
+    buckets=SPAWN_BUCKETS,
+))
+TOOL_TIMEOUTS = REGISTRY.register(Counter(
+    "papilio_tool_timeouts_total", "Tool runs killed at their deadline, by the phase they hung in.",
+    ("tool", "phase"),
+))
+FLASH_PHASE = REGISTRY.register(Histogram(
+    "papilio_flash_phase_duration_seconds", "Time spent in each flash phase.", ("phase",)
+))
+FLASH_DURATION = REGISTRY.register(Histogram(
+    "papilio_flash_duration_seconds", "Total flash operation time.", ("result",)
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "papilio_queue_depth", "Jobs waiting per serial port.", ("port",), callback=_queue_depths
+))
+JOBS_RUNNING = REGISTRY.register(Gauge(
+    "papilio_jobs_running", "Jobs currently driving a serial port.", callback=_running_jobs
+))
+SSE_SESSIONS = REGISTRY.register(Gauge(
+    "papilio_sse_sessions", "Open Server-Sent Events streams.", ("stream",)
+))
+SINGLEFLIGHT_CALLS = REGISTRY.register(Counter(
+    "papilio_singleflight_calls_total",
+    "Device queries that ran the tool or joined an identical one in flight.",
+    ("operation", "result"),
+))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    "papilio_upload_bytes_total", "Bytes received in file uploads."
+))
+UPLOADS = REGISTRY.register(Counter(
+    "papilio_uploads_total", "File uploads by outcome.", ("result",)
+))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text format."""
+    return REGISTRY.render()
+
+
+class MetricsMiddleware:
+    """
+    Count requests and time them per route template.
+
+    Labels use the matched route's path ("/web/saved-files/{file_id}") rather
+    than the URL, so ids do not create new series; unmatched paths share one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method=method, route=path, status=status)
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=method, route=path)
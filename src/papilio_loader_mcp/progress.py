@@ -0,0 +1,276 @@
+"""Live progress for long-running tool operations.
+
+Flash tools feed esptool/pesptool output into an ``Operation`` line by line.
+Each line is appended to a log file on disk (so the full log never has to be
+held in memory), the last few lines are kept for the final response, and
+progress/phase events are published to any subscribers, e.g. the SSE endpoint
+used by the web interface.
+"""
+
+import asyncio
+import logging
+import re
+import time
+import uuid
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import AsyncIterator
+
+from .config import get_config
+from .metrics import FLASH_DURATION, FLASH_PHASE
+from .tools.output_parser import OutputParser, ToolReport
+
+logger = logging.getLogger(__name__)
+
+# esptool 4.x: "Writing at 0x00010000... (12 %)"
+# esptool 5.x: "Writing at 0x00010000 [=====>      ] 12.3% 65536/524288 bytes..."
+WRITE_PROGRESS_RE = re.compile(r"Writing at (0x[0-9a-fA-F]+)\D*?(\d{1,3}(?:\.\d+)?)\s*%")
+
+# First line of each phase, in the order esptool prints them
+PHASE_PATTERNS = [
+    ("connect", re.compile(r"^Connecting|^Serial port ")),
+    ("erase", re.compile(r"^Erasing flash|^Flash will be erased|^Flash memory erased")),
+    ("write", re.compile(r"^Compressed \d+ bytes|^Writing at ")),
+    ("verify", re.compile(r"^Hash of data verified|^Verifying")),
+    ("reset", re.compile(r"^(Hard resetting|Leaving)")),
+]
+
+OPERATION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+TAIL_LINES = 40
+
+
+def detect_phase(line: str) -> str | None:
+    """The phase a line of tool output starts, if it starts one."""
+    for phase, pattern in PHASE_PATTERNS:
+        if pattern.search(line):
+            return phase
+    return None
+
+
+def new_operation_id() -> str:
+    """Generate an id for an operation the caller did not name."""
+    return uuid.uuid4().hex
+
+
+def get_logs_dir() -> Path:
+    """Get the operation log directory from config."""
+    logs_dir = get_config().user_data_dir / "logs"
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    return logs_dir
+
+
+class Operation:
+    """One tool run: log file, output tail and subscriber fan-out."""
+
+    def __init__(self, operation_id: str, description: str = "", logs_dir: Path | None = None):
+        self.id = operation_id
+        self.description = description
+        self.log_path = (logs_dir or get_logs_dir()) / f"{operation_id}.log"
+        self.tail: deque[str] = deque(maxlen=TAIL_LINES)
+        self.phase: str | None = None
+        self.percent: float | None = None
+        self.started = False
+        self.done = False
+        self.success: bool | None = None
+        self.started_at = time.time()
+        self.line_count = 0
+        self._clock = time.perf_counter()
+        self._phase_clock = self._clock
+        self._parser = OutputParser()
+        self._log_file = None
+        self._subscribers: list[asyncio.Queue] = []
+        self._last_event: dict | None = None
+
+    def begin(self) -> None:
+        """Open the log file and announce the operation."""
+        if self._log_file is None:
+            self._log_file = open(self.log_path, "w", encoding="utf-8", errors="replace")
+        # A placeholder may have been waiting for a subscriber; time from now
+        self.started = True
+        self.started_at = time.time()
+        self._clock = self._phase_clock = time.perf_counter()
+        self._publish({"type": "start", "description": self.description})
+
+    def feed(self, line: str) -> None:
+        """Record one line of tool output."""
+        line = line.rstrip()
+        if not line:
+            return
+        self.line_count += 1
+        if self._log_file is not None:
+            self._log_file.write(line + "\n")
+        self._parser.feed(line)
+
+        stripped = line.strip()
+        phase = detect_phase(stripped)
+        if phase is not None and phase != self.phase:
+            self._end_phase()
+            self.phase = phase
+            self._publish({"type": "phase", "phase": phase})
+
+        match = WRITE_PROGRESS_RE.search(stripped)
+        if match:
+            self.percent = float(match.group(2))
+            self._publish({"type": "progress", "address": match.group(1), "percent": self.percent})
+            # Progress lines are redrawn many times; keep only the latest in the tail
+            if self.tail and WRITE_PROGRESS_RE.search(self.tail[-1]):
+                self.tail[-1] = stripped
+                return
+        else:
+            self._publish({"type": "log", "line": stripped})
+        self.tail.append(stripped)
+
+    def finish(self, success: bool, summary: dict | None = None) -> None:
+        """Close the log and tell subscribers the operation is over."""
+        if not self.done:
+            self._end_phase()
+            FLASH_DURATION.observe(
+                time.perf_counter() - self._clock, result="success" if success else "failure"
+            )
+        self.done = True
+        self.success = success
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        event = {"type": "done", "success": success}
+        if summary:
+            event["summary"] = summary
+        self._publish(event)
+
+    def _end_phase(self) -> None:
+        """Record how long the current phase took."""
+        now = time.perf_counter()
+        if self.phase is not None:
+            FLASH_PHASE.observe(now - self._phase_clock, phase=self.phase)
+        self._phase_clock = now
+
+    @property
+    def report(self) -> ToolReport:
+        """Device and write details parsed from all output so far."""
+        return self._parser.report
+
+    def output_tail(self) -> str:
+        """Last lines of output, for inclusion in a response."""
+        return "\n".join(self.tail)
+
+    def summary(self) -> dict:
+        """Reference to this operation for tool results."""
+        return {
+            "log_id": self.id,
+            "log_lines": self.line_count,
+            "phase": self.phase,
+            "percent": self.percent,
+        }
+
+    def _publish(self, event: dict) -> None:
+        event = {"operation_id": self.id, **event}
+        if event["type"] != "log":
+            self._last_event = event
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def events(self) -> AsyncIterator[dict]:
+        """Yield events until the operation finishes."""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        try:
+            # Late subscribers start from the latest state instead of nothing
+            if self._last_event is not None:
+                yield self._last_event
+                if self._last_event["type"] == "done":
+                    return
+            while True:
+                event = await queue.get()
+                yield event
+                if event["type"] == "done":
+                    return
+        finally:
+            self._subscribers.remove(queue)
+
+
+class ProgressBroker:
+    """Registry of recent operations so clients can subscribe by id."""
+
+    def __init__(self, max_operations: int = 200, logs_dir: Path | None = None):
+        self.max_operations = max_operations
+        self.logs_dir = logs_dir
+        self._operations: OrderedDict[str, Operation] = OrderedDict()
+
+    def start(self, operation_id: str | None = None, description: str = "") -> Operation:
+        """
+        Start recording an operation.
+
+        Args:
+            operation_id: Id chosen by the client (so it can subscribe before
+                the request that starts the operation), or None to generate one
+            description: Label included in the start event
+
+        Returns:
+            The Operation to feed tool output into
+        """
+        if not operation_id or not OPERATION_ID_RE.match(operation_id):
+            operation_id = new_operation_id()
+
+        operation = self._operations.get(operation_id)
+        if operation is None or operation.done:
+            operation = Operation(operation_id, description, self.logs_dir)
+            self._operations[operation_id] = operation
+        else:
+            # A subscriber got here first and created a placeholder
+            operation.description = description
+        operation.begin()
+        self._prune()
+        return operation
+
+    def get(self, operation_id: str, create: bool = False) -> Operation | None:
+        """Look up an operation, optionally creating a placeholder to subscribe to."""
+        if not OPERATION_ID_RE.match(operation_id):
+            return None
+        operation = self._operations.get(operation_id)
+        if operation is None and create:
+            operation = Operation(operation_id, logs_dir=self.logs_dir)
+            self._operations[operation_id] = operation
+            self._prune()
+        return operation
+
+    def log_path(self, operation_id: str) -> Path | None:
+        """Path of an operation's full log, if it exists."""
+        if not OPERATION_ID_RE.match(operation_id):
+            return None
+        path = (self.logs_dir or get_logs_dir()) / f"{operation_id}.log"
+        return path if path.exists() else None
+
+    def _prune(self) -> None:
+        """Forget the oldest finished operations and delete their logs.
+
+        Running operations are never forgotten, however old, so their log
+        stays in place while the tool writes to it. Placeholders nobody
+        started have no log and can go.
+        """
+        excess = len(self._operations) - self.max_operations
+        if excess <= 0:
+            return
+        stale = [
+            (operation_id, operation) for operation_id, operation in self._operations.items()
+            if operation.done or not operation.started
+        ]
+        for operation_id, operation in stale[:excess]:
+            del self._operations[operation_id]
+            if not operation.started:
+                continue
+            try:
+                operation.log_path.unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Could not delete log {operation.log_path}: {e}")
+
+
+_broker: ProgressBroker | None = None
+
+
+def get_progress_broker() -> ProgressBroker:
+    """Get or create the global progress broker."""
+    global _broker
+    if _broker is None:
+        _broker = ProgressBroker(get_config().max_operation_logs)
+    return _broker
@@ -0,0 +1,224 @@
+"""Per-port job scheduler for serial device operations.
+
+Every operation that opens a serial port is submitted here instead of being
+awaited directly. Jobs for the same port run strictly in submission order,
+jobs for different ports run in parallel, and a global semaphore caps how
+many ports are being driven at once.
+
+A caller that stops waiting (HTTP client disconnected, MCP request
+cancelled) cancels its job: a queued job is skipped, a running one is
+cancelled, which kills the tool it is running. The next job on the port only
+starts once the cancelled one has cleaned up.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from .config import get_config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_port_key(port: str | None) -> str:
+    """Return the queue key for a port.
+
+    Windows port names are case-insensitive, and an empty port means
+    auto-detection, which may touch any port, so all AUTO jobs share one queue.
+    """
+    if not port or port.upper() == "AUTO":
+        return "AUTO"
+    if port.upper().startswith("COM"):
+        return port.upper()
+    return port
+
+
+@dataclass
+class FlashJob:
+    """A queued operation bound to one serial port."""
+
+    job_id: int
+    port: str
+    description: str
+    func: Callable[..., Awaitable[Any]]
+    args: tuple
+    kwargs: dict
+    future: asyncio.Future
+    submitted_at: float = field(default_factory=time.monotonic)
+    started_at: float | None = None
+
+    def to_dict(self) -> dict:
+        now = time.monotonic()
+        return {
+            "job_id": self.job_id,
+            "port": self.port,
+            "description": self.description,
+            "waiting_seconds": round((self.started_at or now) - self.submitted_at, 3),
+            "running_seconds": round(now - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class FlashScheduler:
+    """One FIFO queue per serial port plus a global concurrency cap."""
+
+    def __init__(self, max_concurrent: int = 4):
+        self.max_concurrent = max(1, max_concurrent)
+        self._semaphore: asyncio.Semaphore | None = None
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._active: dict[str, FlashJob] = {}
+        self._ids = itertools.count(1)
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    async def submit(
+        self,
+        port: str | None,
+        func: Callable[..., Awaitable[Any]],
+        *args,
+        description: str = "",
+        **kwargs,
+    ) -> Any:
+        """
+        Queue an operation for a port and wait for its result.
+
+        Args:
+            port: Serial port the operation will open ("AUTO" for auto-detection)
+            func: Coroutine function to run once the port is free
+            *args: Positional arguments for func
+            description: Human-readable label shown in queue status
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            Whatever func returns; exceptions raised by func are re-raised here
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        key = normalize_port_key(port)
+        loop = asyncio.get_running_loop()
+        job = FlashJob(
+            job_id=next(self._ids),
+            port=key,
+            description=description or getattr(func, "__name__", "job"),
+            func=func,
+            args=args,
+            kwargs=kwargs,
+            future=loop.create_future(),
+        )
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue()
+        queue.put_nowait(job)
+
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._run_port(key, queue))
+
+        logger.debug(f"Queued job {job.job_id} ({job.description}) on {key}, depth {queue.qsize()}")
+        return await job.future
+
+    async def _run_port(self, key: str, queue: asyncio.Queue) -> None:
+        """Drain one port's queue, one job at a time, then exit."""
+        job = None
+        try:
+            while not queue.empty():
+                job = queue.get_nowait()
+                if job.future.done():
+                    # Caller went away while the job was still queued
+                    continue
+
+                async with self._semaphore:
+                    job.started_at = time.monotonic()
+                    self._active[key] = job
+                    task = asyncio.ensure_future(job.func(*job.args, **job.kwargs))
+
+                    def cancel_job(future: asyncio.Future, task=task) -> None:
+                        if future.cancelled():
+                            task.cancel()
+
+                    job.future.add_done_callback(cancel_job)
+                    try:
+                        # Wait for the job to wind down even when it was
+                        # cancelled, so the port is free before the next one
+                        await asyncio.wait({task})
+                    finally:
+                        task.cancel()
+                        job.future.remove_done_callback(cancel_job)
+                        self._active.pop(key, None)
+
+                    if task.cancelled():
+                        self.cancelled += 1
+                        logger.info(f"Job {job.job_id} ({job.description}) on {key} was cancelled")
+                        # Cancelled from inside, not by the caller: the caller still waits
+                        if not job.future.done():
+                            job.future.cancel()
+                    elif task.exception() is not None:
+                        self.failed += 1
+                        if not job.future.done():
+                            job.future.set_exception(task.exception())
+                    else:
+                        self.completed += 1
+                        if not job.future.done():
+                            job.future.set_result(task.result())
+        finally:
+            # No await between the empty() check and this cleanup, so a
+            # concurrent submit() either sees this worker or starts a new one.
+            self._workers.pop(key, None)
+            # Left early (cancelled at shutdown): nothing will run the current
+            # or queued jobs, so release everyone waiting on them
+            if job is not None and not job.future.done():
+                job.future.cancel()
+            while not queue.empty():
+                queued = queue.get_nowait()
+                if not queued.future.done():
+                    queued.future.cancel()
+            self._queues.pop(key, None)
+
+    def is_busy(self, port: str | None) -> bool:
+        """Whether a port has a job running or waiting."""
+        key = normalize_port_key(port)
+        queue = self._queues.get(key)
+        return key in self._active or bool(queue and queue.qsize())
+
+    def queue_depth(self, port: str | None = None) -> int:
+        """Number of jobs waiting (not running) for one port, or for all ports."""
+        if port is not None:
+            queue = self._queues.get(normalize_port_key(port))
+            return queue.qsize() if queue else 0
+        return sum(q.qsize() for q in self._queues.values())
+
+    def status(self) -> dict:
+        """Snapshot of queues and running jobs for diagnostics."""
+        ports = {}
+        for key in sorted(set(self._queues) | set(self._active)):
+            queue = self._queues.get(key)
+            active = self._active.get(key)
+            ports[key] = {
+                "running": active.to_dict() if active else None,
+                "queued": [job.to_dict() for job in list(queue._queue)] if queue else [],
+            }
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": len(self._active),
+            "queued": self.queue_depth(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "ports": ports,
+        }
+
+
+_scheduler: FlashScheduler | None = None
+
+
+def get_scheduler() -> FlashScheduler:
+    """Get or create the global scheduler instance."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FlashScheduler(get_config().max_concurrent_jobs)
+    return _scheduler
@@ -2,18 +2,25 @@
 
 import asyncio
 import logging
+import time
 from typing import Any
 
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
 
-from .tools.serial_ports import list_serial_ports
-from .tools.device_info import get_device_info
-from .tools.flash_status import get_flash_status
+from .tools.serial_ports import get_port_watcher, list_serial_ports
+from .tools.device_registry import query_device
+from .tools.port_resolver import resolve_port
+from .tools.tool_registry import get_tool_registry
+from .tools.engine import shutdown_backends
 from .tools.fpga_flash import flash_fpga_device
-from .tools.esp_flash import flash_esp_device
+from .tools.esp_flash import flash_esp_device, flash_esp_multi_partition
 from .file_detector import validate_file_for_device
+from .scheduler import get_scheduler
+from .database import get_saved_file, get_saved_file_path, list_saved_files, run_db, start_metadata_backfill
+from .tools.results import ToolResult
+from .metrics import MCP_TOOL_CALLS, MCP_TOOL_LATENCY
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,7 +36,7 @@ async def list_tools() -> list[Tool]:
     return [
         Tool(
             name="list_serial_ports",
-            description="List all available serial/COM ports on the system",
+            description="List all available serial/COM ports on the system. Includes a generation counter that changes whenever a port is plugged in or removed.",
             inputSchema={
                 "type": "object",
                 "properties": {},
@@ -50,6 +57,11 @@ async def list_tools() -> list[Tool]:
                         "enum": ["fpga", "esp32"],
                         "description": "Type of device to query",
                     },
+                    "refresh": {
+                        "type": "boolean",
+                        "description": "Probe the device even if a recent answer is cached (default: false)",
+                        "default": False,
+                    },
                 },
                 "required": ["device_type"],
             },
@@ -69,6 +81,11 @@ async def list_tools() -> list[Tool]:
                         "enum": ["fpga", "esp32"],
                         "description": "Type of device",
                     },
+                    "refresh": {
+                        "type": "boolean",
+                        "description": "Probe the device even if a recent answer is cached (default: false)",
+                        "default": False,
+                    },
                 },
                 "required": ["device_type"],
             },
@@ -106,32 +123,226 @@ async def list_tools() -> list[Tool]:
                         "description": "Force flashing even if file type validation fails (default: false)",
                         "default": False,
                     },
+                    "differential": {
+                        "type": "boolean",
+                        "description": "Compare the image with the device block by block (MD5) and only write changed blocks. Needs an explicit port (default: false)",
+                        "default": False,
+                    },
+                    "sparse": {
+                        "type": "boolean",
+                        "description": "Erase runs of 0xFF padding (merged images, padded bitstreams) instead of writing them. Needs an explicit port (default: false)",
+                        "default": False,
+                    },
                 },
                 "required": ["device_type", "file_path"],
             },
         ),
+        Tool(
+            name="flash_partitions",
+            description="Flash several images (e.g. bootloader, partition table and app, optionally an FPGA bitstream) in a single session with one reset and sync. Port will be auto-detected if not provided.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "port": {
+                        "type": "string",
+                        "description": "COM port. If not provided, will auto-detect.",
+                    },
+                    "partitions": {
+                        "type": "array",
+                        "description": "Images to flash with their addresses",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "address": {
+                                    "type": "string",
+                                    "description": "Flash address in hex (e.g., 0x0, 0x8000, 0x10000, 0x100000)",
+                                },
+                                "file_path": {
+                                    "type": "string",
+                                    "description": "Path to the .bin image",
+                                },
+                                "device_type": {
+                                    "type": "string",
+                                    "enum": ["fpga", "esp32"],
+                                    "description": "What the image is for (default: esp32). Any fpga image makes the session use pesptool.",
+                                    "default": "esp32",
+                                },
+                            },
+                            "required": ["address", "file_path"],
+                        },
+                        "minItems": 1,
+                    },
+                    "verify": {
+                        "type": "boolean",
+                        "description": "Verify after flashing (default: true)",
+                        "default": True,
+                    },
+                    "force": {
+                        "type": "boolean",
+                        "description": "Force flashing even if file type validation fails (default: false)",
+                        "default": False,
+                    },
+                },
+                "required": ["partitions"],
+            },
+        ),
+        Tool(
+            name="flash_saved_file",
+            description="Flash a file from the saved files library by its ID, straight from where the server stores it (no upload). The device type comes from the saved file. Port will be auto-detected if not provided.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "saved_file_id": {
+                        "type": "integer",
+                        "description": "ID of the saved file",
+                    },
+                    "port": {
+                        "type": "string",
+                        "description": "COM port. If not provided, will auto-detect.",
+                    },
+                    "address": {
+                        "type": "string",
+                        "description": "Flash address in hex (default: 0x10000 for ESP32, 0x100000 for FPGA)",
+                    },
+                    "verify": {
+                        "type": "boolean",
+                        "description": "Verify after flashing (default: true)",
+                        "default": True,
+                    },
+                    "force": {
+                        "type": "boolean",
+                        "description": "Force flashing even if file type validation fails (default: false)",
+                        "default": False,
+                    },
+                    "differential": {
+                        "type": "boolean",
+                        "description": "Only write blocks that differ from the device. Needs an explicit port (default: false)",
+                        "default": False,
+                    },
+                    "sparse": {
+                        "type": "boolean",
+                        "description": "Erase runs of 0xFF padding instead of writing them. Needs an explicit port (default: false)",
+                        "default": False,
+                    },
+                },
+                "required": ["saved_file_id"],
+            },
+        ),
+        Tool(
+            name="find_saved_files",
+            description="Search the saved files library by what is inside the images: chip or FPGA part, project, app version, ESP-IDF version, build date, FPGA IDCODE or SHA-256, plus words from names and descriptions. Returns matching files with their IDs for flash_saved_file.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "search": {
+                        "type": "string",
+                        "description": "Words to find in file names and descriptions",
+                    },
+                    "device_type": {
+                        "type": "string",
+                        "enum": ["esp32", "fpga"],
+                        "description": "Device type the file was saved for",
+                    },
+                    "chip": {
+                        "type": "string",
+                        "description": "ESP32 chip (e.g. ESP32-S3) or FPGA part (e.g. GW2A(R)-18(C))",
+                    },
+                    "project_name": {
+                        "type": "string",
+                        "description": "ESP-IDF project name",
+                    },
+                    "app_version": {
+                        "type": "string",
+                        "description": "App version embedded in the ESP32 image",
+                    },
+                    "idf_version": {
+                        "type": "string",
+                        "description": "ESP-IDF version the app was built with (e.g. v5.3.1)",
+                    },
+                    "fpga_idcode": {
+                        "type": "string",
+                        "description": "IDCODE the bitstream targets (e.g. 0x0000081B)",
+                    },
+                    "sha256": {
+                        "type": "string",
+                        "description": "SHA-256 of the file content",
+                    },
+                    "built_after": {
+                        "type": "string",
+                        "description": "Only images built on or after this date (YYYY-MM-DD)",
+                    },
+                    "built_before": {
+                        "type": "string",
+                        "description": "Only images built on or before this date (YYYY-MM-DD)",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Most files to return (default: 20)",
+                        "default": 20,
+                    },
+                    "cursor": {
+                        "type": "string",
+                        "description": "next_cursor from a previous call, for the following page",
+                    },
+                },
+            },
+        ),
     ]
 
 
+def _validate_firmware(file_path: str, device_type: str, force: bool) -> tuple[str | None, dict | None]:
+    """
+    Check that a firmware file matches the device it is meant for.
+    
+    Returns:
+        (error, image): an error message to return to the client, or None to
+        go ahead; and the image report parsed for device_type (None if the
+        file is of another type), which the flash reuses instead of parsing
+        the file again
+    """
+    try:
+        # Maps the file instead of reading it, and parses the image structure
+        validation = validate_file_for_device(file_path, device_type)
+        
+        if not validation["valid"]:
+            if not force:
+                return f"❌ File type mismatch!\n\n{validation['warning']}\n\nDetected: {validation['detected_type']}\nIntended: {device_type}\n\nThis could brick your device. Please use the correct firmware file.\n\nTo override this check, set force=true.", None
+            else:
+                logger.warning(f"⚠️ FORCED FLASH: {validation['warning']} - User overrode validation")
+        
+        if validation["warning"] and validation["valid"]:
+            logger.warning(f"File validation warning: {validation['warning']}")
+    
+    except FileNotFoundError:
+        return f"Error: File not found: {file_path}", None
+    except Exception as e:
+        return f"Error validating file: {str(e)}", None
+    
+    return None, validation["image"] if validation["detected_type"] == device_type else None
+
+
 @app.call_tool()
 async def call_tool(name: str, arguments: Any) -> list[TextContent]:
     """Handle tool calls."""
+    started = time.perf_counter()
+    tool_label = name
+    status = "ok"
     try:
         if name == "list_serial_ports":
             result = await list_serial_ports()
-            return [TextContent(type="text", text=result)]
+            return [TextContent(type="text", text=result.to_json())]
 
         elif name == "get_device_info":
             port = arguments.get("port", "AUTO")
             device_type = arguments["device_type"]
-            result = await get_device_info(port, device_type)
-            return [TextContent(type="text", text=result)]
+            result = await query_device("info", port, device_type, arguments.get("refresh", False))
+            return [TextContent(type="text", text=result.to_json())]
 
         elif name == "get_flash_status":
             port = arguments.get("port", "AUTO")
             device_type = arguments["device_type"]
-            result = await get_flash_status(port, device_type)
-            return [TextContent(type="text", text=result)]
+            result = await query_device("status", port, device_type, arguments.get("refresh", False))
+            return [TextContent(type="text", text=result.to_json())]
 
         elif name == "flash_device":
             port = arguments.get("port", "AUTO")
@@ -142,49 +353,128 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
             address = arguments.get("address", default_address)
             verify = arguments.get("verify", True)
             force = arguments.get("force", False)
+            differential = arguments.get("differential", False)
+            sparse = arguments.get("sparse", False)
 
             # Validate file type before flashing
-            try:
-                with open(file_path, 'rb') as f:
-                    file_content = f.read()
-                
-                validation = validate_file_for_device(file_content, device_type)
-                
-                if not validation["valid"]:
-                    if not force:
-                        error_msg = f"❌ File type mismatch!\n\n{validation['warning']}\n\nDetected: {validation['detected_type']}\nIntended: {device_type}\n\nThis could brick your device. Please use the correct firmware file.\n\nTo override this check, set force=true."
-                        return [TextContent(type="text", text=error_msg)]
-                    else:
-                        logger.warning(f"⚠️ FORCED FLASH: {validation['warning']} - User overrode validation")
-                
-                if validation["warning"] and validation["valid"]:
-                    logger.warning(f"File validation warning: {validation['warning']}")
-            
-            except FileNotFoundError:
-                return [TextContent(type="text", text=f"Error: File not found: {file_path}")]
-            except Exception as e:
-                return [TextContent(type="text", text=f"Error validating file: {str(e)}")]
-
-            if device_type == "fpga":
-                result = await flash_fpga_device(port, file_path, address, verify)
-            else:  # esp32
-                result = await flash_esp_device(port, file_path, address, verify)
-
-            return [TextContent(type="text", text=result)]
+            error_msg, image = await asyncio.to_thread(_validate_firmware, file_path, device_type, force)
+            if error_msg:
+                return [TextContent(type="text", text=error_msg)]
+
+            # Resolve AUTO first, so the job waits in the queue of the port it opens
+            port = await resolve_port(port, device_type)
+            flash_func = flash_fpga_device if device_type == "fpga" else flash_esp_device
+            result = await get_scheduler().submit(
+                port, flash_func, port, file_path, address, verify,
+                description=f"flash {device_type} {file_path}", differential=differential, sparse=sparse,
+                image=image,
+            )
+
+            return [TextContent(type="text", text=result.to_json())]
+
+        elif name == "flash_saved_file":
+            saved_file_id = arguments["saved_file_id"]
+            file_info = await run_db(get_saved_file, saved_file_id)
+            file_path = await run_db(get_saved_file_path, saved_file_id) if file_info else None
+            if not file_path or not file_path.exists():
+                return [TextContent(type="text", text=f"Error: Saved file {saved_file_id} not found")]
+
+            port = arguments.get("port", "AUTO")
+            device_type = file_info["device_type"]
+            default_address = "0x10000" if device_type == "esp32" else "0x100000"
+            address = arguments.get("address", default_address)
+            verify = arguments.get("verify", True)
+            force = arguments.get("force", False)
+            differential = arguments.get("differential", False)
+            sparse = arguments.get("sparse", False)
+
+            error_msg, image = await asyncio.to_thread(_validate_firmware, str(file_path), device_type, force)
+            if error_msg:
+                return [TextContent(type="text", text=error_msg)]
+
+            port = await resolve_port(port, device_type)
+            flash_func = flash_fpga_device if device_type == "fpga" else flash_esp_device
+            result = await get_scheduler().submit(
+                port, flash_func, port, str(file_path), address, verify,
+                description=f"flash {device_type} {file_info['original_filename']}",
+                differential=differential, sparse=sparse, sha256=file_info["sha256"], image=image,
+            )
+
+            return [TextContent(type="text", text=result.to_json())]
+
+        elif name == "find_saved_files":
+            filters = {
+                key: arguments[key] for key in (
+                    "device_type", "chip", "project_name", "app_version", "idf_version",
+                    "fpga_idcode", "sha256", "built_after", "built_before", "cursor",
+                ) if arguments.get(key)
+            }
+            page = await run_db(
+                list_saved_files, search=arguments.get("search"), limit=arguments.get("limit", 20), **filters
+            )
+            result = ToolResult({"success": True, **page})
+            return [TextContent(type="text", text=result.to_json())]
+
+        elif name == "flash_partitions":
+            port = arguments.get("port", "AUTO")
+            verify = arguments.get("verify", True)
+            force = arguments.get("force", False)
+
+            partitions = []
+            images = []
+            device_types = set()
+            for entry in arguments["partitions"]:
+                device_type = entry.get("device_type", "esp32")
+                error_msg, image = await asyncio.to_thread(_validate_firmware, entry["file_path"], device_type, force)
+                if error_msg:
+                    return [TextContent(type="text", text=error_msg)]
+                partitions.append((entry["address"], entry["file_path"]))
+                images.append(image)
+                device_types.add(device_type)
+
+            # Layouts that include an FPGA bitstream go through pesptool
+            tool = "pesptool" if "fpga" in device_types else "esptool"
+            port = await resolve_port(port, "fpga" if tool == "pesptool" else "esp32")
+            result = await get_scheduler().submit(
+                port, flash_esp_multi_partition, port, partitions, verify, None, tool,
+                description=f"flash {len(partitions)} partitions", images=images,
+            )
+            return [TextContent(type="text", text=result.to_json())]
 
         else:
+            # Keep arbitrary names out of the metric labels
+            tool_label = "unknown"
+            status = "error"
             return [TextContent(type="text", text=f"Unknown tool: {name}")]
 
+    except asyncio.CancelledError:
+        # Session closed or the client cancelled the request; the scheduler
+        # cancels the job and the engine kills its tool
+        status = "cancelled"
+        logger.info(f"Tool call {name} cancelled")
+        raise
+
     except Exception as e:
+        status = "error"
         logger.error(f"Error calling tool {name}: {e}", exc_info=True)
         return [TextContent(type="text", text=f"Error: {str(e)}")]
 
+    finally:
+        MCP_TOOL_CALLS.inc(tool=tool_label, status=status)
+        MCP_TOOL_LATENCY.observe(time.perf_counter() - started, tool=tool_label)
+
 
 async def main():
     """Run the MCP server."""
     logger.info("Starting Papilio Loader MCP Server...")
-    async with stdio_server() as (read_stream, write_stream):
-        await app.run(read_stream, write_stream, app.create_initialization_options())
+    get_port_watcher()  # first port scan runs while the client connects
+    get_tool_registry().start()  # tool versions are probed in the background too
+    start_metadata_backfill()  # saved files from before metadata extraction
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await app.run(read_stream, write_stream, app.create_initialization_options())
+    finally:
+        shutdown_backends()  # in-process tool workers and their output queue manager
 
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+"""Baud-rate negotiation for flashing.
+
+esptool syncs with the chip at 115200 baud and then switches to the
+``--baud`` rate for the transfer. Fast rates (921600, 2M) cut flash time
+several-fold, but not every USB-serial adapter or cable holds them. A flash
+therefore starts at ``PAPILIO_FLASH_BAUD_RATE``, or at the lower rate the
+adapter recently had to step down to from it. High speed is opt-in: without
+that setting flashes run at ``PAPILIO_DEFAULT_BAUD_RATE`` as they always did.
+If the link fails after the switch, the flash is retried at the next lower
+standard rate, down to ``PAPILIO_DEFAULT_BAUD_RATE``. Failures before the
+switch (no board, wrong port) are not retried, since a lower rate cannot
+help. A stepped-down rate is forgotten after a while or a few clean flashes
+(see ``device_registry``), so one bad transfer does not pin an adapter.
+"""
+
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+
+from ..config import get_config
+from .device_registry import get_device_registry
+from .engine import LineCallback, ProcessResult, run_tool
+from .output_parser import OutputParser
+
+logger = logging.getLogger(__name__)
+
+# Rates supported by the common adapters (CP210x, CH34x, FTDI, native USB)
+STANDARD_RATES = (2000000, 1500000, 921600, 460800, 230400, 115200)
+
+# esptool prints this once it has synced and asks the chip to switch rates
+BAUD_SWITCH_PREFIX = "Changing baud rate"
+
+
+def baud_ladder(start: int, floor: int) -> list[int]:
+    """Rates to try, fastest first: start, then the standard rates down to floor."""
+    if start <= floor:
+        return [floor]
+    return [start] + [rate for rate in STANDARD_RATES if floor < rate < start] + [floor]
+
+
+@dataclass
+class BaudAttempt:
+    """One try at a flash at a given rate."""
+
+    baud: int
+    success: bool
+    switched: bool  # the tool got as far as changing to this rate
+    kbit_per_s: float | None = None
+
+
+@dataclass
+class BaudNegotiation:
+    """Rates tried for one flash and the one that was used in the end."""
+
+    baud: int | None = None
+    kbit_per_s: float | None = None
+    attempts: list[BaudAttempt] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "baud": self.baud,
+            "kbit_per_s": self.kbit_per_s,
+            "attempts": [asdict(attempt) for attempt in self.attempts],
+        }
+
+
+async def flash_with_baud_fallback(
+    tool: str,
+    port: str,
+    args: list[str],
+    on_line: LineCallback,
+    timeout: float | None = None,
+) -> tuple[ProcessResult, BaudNegotiation]:
+    """
+    Run a write-flash command line, stepping the baud rate down until it works.
+
+    Args:
+        tool: "esptool" or "pesptool"
+        port: Resolved serial port (step-downs are only remembered for real ports)
+        args: Command line without ``--baud``
+        on_line: Receives every output line of every attempt
+        timeout: Seconds all attempts together may take
+
+    Returns:
+        (result of the last attempt, negotiation record)
+    """
+    config = get_config()
+    registry = get_device_registry()
+    configured = config.flash_baud_rate or config.default_baud_rate
+    start = registry.baud_rate(port, configured) or configured
+    deadline = time.perf_counter() + timeout if timeout is not None else None
+    negotiation = BaudNegotiation()
+
+    rates = baud_ladder(start, config.default_baud_rate)
+    for index, baud in enumerate(rates):
+        parser = OutputParser()
+        switched = False
+
+        def feed(line: str) -> None:
+            nonlocal switched
+            if line.startswith(BAUD_SWITCH_PREFIX):
+                switched = True
+            parser.feed(line)
+            on_line(line)
+
+        remaining = deadline - time.perf_counter() if deadline is not None else None
+        result = await run_tool(tool, ["--baud", str(baud), *args], on_line=feed, timeout=remaining)
+        success = result.returncode == 0
+        attempt = BaudAttempt(baud, success, switched, parser.report.kbit_per_s)
+        negotiation.attempts.append(attempt)
+        negotiation.baud, negotiation.kbit_per_s = baud, attempt.kbit_per_s
+
+        if success:
+            if index:
+                registry.limit_baud_rate(port, baud, configured)
+            else:
+                registry.baud_rate_held(port, baud)
+            break
+        if not switched or index + 1 == len(rates):
+            break
+        logger.info(f"Flash on {port} failed at {baud} baud, retrying at {rates[index + 1]}")
+        on_line(f"Flash failed at {baud} baud, retrying at {rates[index + 1]} baud")
+
+    return result, negotiation
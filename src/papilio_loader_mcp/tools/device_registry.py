@@ -0,0 +1,303 @@
+"""Cache of probed device identities.
+
+``get_device_info`` and ``get_flash_status`` spawn esptool/pesptool and talk
+to the chip, which takes seconds, yet the answer only changes when a
+different board is plugged in. The registry remembers successful results
+keyed by the USB identity of the port (serial number, or hwid for adapters
+without one), so repeated queries are answered from memory.
+
+Entries expire after ``PAPILIO_DEVICE_CACHE_TTL`` seconds, and are dropped as
+soon as the port watcher sees their port disappear or change. Ports without
+a USB identity (and AUTO) are never cached.
+
+The registry also remembers when an adapter had to step down from the
+configured flash baud rate. That is a property of the adapter and cable
+rather than the board, so it survives unplugging. The lower rate is only a
+hint: it is dropped after ``BAUD_LIMIT_TTL`` seconds or
+``BAUD_LIMIT_CLEAN_FLASHES`` clean flashes at it, after which the configured
+rate is tried again.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from ..config import get_config
+from ..scheduler import get_scheduler, normalize_port_key
+from .device_info import get_device_info
+from .flash_status import get_flash_status
+from .port_resolver import resolve_port
+from .results import ToolResult
+from .serial_ports import get_port_watcher
+from .singleflight import get_single_flight
+
+logger = logging.getLogger(__name__)
+
+# How long, and for how many clean flashes, a stepped-down rate is kept
+BAUD_LIMIT_TTL = 3600.0
+BAUD_LIMIT_CLEAN_FLASHES = 5
+
+# Results that describe the device rather than a failure to reach it
+SUCCESS_STATUSES = ("Connected", "Success")
+
+# operation -> (tool function, queue label)
+QUERIES = {
+    "info": (get_device_info, "info"),
+    "status": (get_flash_status, "flash status"),
+}
+
+
+def port_identity(port_info: dict | None) -> str | None:
+    """USB identity of a port from the watcher table, None if it has none."""
+    if not port_info:
+        return None
+    if port_info.get("serial_number"):
+        return f"serial:{port_info['serial_number']}"
+    hwid = port_info.get("hwid")
+    if hwid and hwid != "n/a":
+        return f"hwid:{hwid}"
+    return None
+
+
+@dataclass
+class BaudLimit:
+    """A rate an adapter stepped down to from a configured start rate."""
+
+    baud: int
+    start: int  # configured rate the step-down was learned under
+    learned_at: float  # time.monotonic()
+    clean_flashes: int = 0
+
+
+@dataclass
+class DeviceEntry:
+    """A cached probe result."""
+
+    result: ToolResult
+    port: str
+    probed_at: float  # time.monotonic()
+
+
+class DeviceRegistry:
+    """Probe results keyed by (operation, device identity, device type)."""
+
+    def __init__(self, ttl: float = 300.0, ports: Callable[[], list[dict]] | None = None):
+        self.ttl = ttl
+        self._ports = ports or (lambda: get_port_watcher().snapshot()["ports"])
+        self._entries: dict[tuple[str, str, str], DeviceEntry] = {}
+        self._baud_limits: dict[str, BaudLimit] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def identity(self, port: str) -> str | None:
+        """Identity of the device on a port, if it can be told apart from others."""
+        if self.ttl <= 0:
+            return None
+        return self._lookup_identity(port)
+
+    def _lookup_identity(self, port: str) -> str | None:
+        if not port or port.upper() == "AUTO":
+            return None
+        for info in self._ports():
+            if info["device"] == port:
+                return port_identity(info)
+        return None
+
+    def _baud_key(self, port: str) -> str | None:
+        """USB identity of the adapter, or the port name for adapters without one."""
+        if not port or port.upper() == "AUTO":
+            return None
+        return self._lookup_identity(port) or f"port:{port}"
+
+    def baud_rate(self, port: str, start: int) -> int | None:
+        """
+        Rate to start at instead of start on this adapter, if it had to step down.
+
+        A limit learned under a different configured rate, or older than
+        ``BAUD_LIMIT_TTL``, is ignored.
+        """
+        key = self._baud_key(port)
+        if key is None:
+            return None
+        with self._lock:
+            limit = self._baud_limits.get(key)
+            if limit is None:
+                return None
+            if limit.start != start or time.monotonic() - limit.learned_at > BAUD_LIMIT_TTL:
+                del self._baud_limits[key]
+                return None
+            return min(limit.baud, start)
+
+    def limit_baud_rate(self, port: str, baud: int, start: int) -> None:
+        """Record that a flash starting at start only succeeded at baud on this adapter."""
+        key = self._baud_key(port)
+        if key is None or baud >= start:
+            return
+        with self._lock:
+            self._baud_limits[key] = BaudLimit(baud, start, time.monotonic())
+
+    def baud_rate_held(self, port: str, baud: int) -> None:
+        """Count a clean flash at baud; enough of them at a limit drop it."""
+        key = self._baud_key(port)
+        if key is None:
+            return
+        with self._lock:
+            limit = self._baud_limits.get(key)
+            if limit is None or limit.baud != baud:
+                return
+            limit.clean_flashes += 1
+            if limit.clean_flashes >= BAUD_LIMIT_CLEAN_FLASHES:
+                logger.info(f"{port} held {baud} baud {limit.clean_flashes} times, trying {limit.start} again")
+                del self._baud_limits[key]
+
+    def get(self, operation: str, port: str, device_type: str) -> ToolResult | None:
+        """
+        Cached result for a query, if there is a fresh one.
+
+        Returns:
+            A copy of the cached result with "cached" and "age_seconds" added,
+            or None on a miss
+        """
+        identity = self.identity(port)
+        if identity is None:
+            return None
+        key = (operation, identity, device_type)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.probed_at > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return ToolResult(entry.result, cached=True, age_seconds=round(now - entry.probed_at, 3))
+
+    def put(self, operation: str, port: str, device_type: str, result: ToolResult) -> None:
+        """Remember a successful probe result."""
+        identity = self.identity(port)
+        if identity is None:
+            return
+        with self._lock:
+            self._entries[(operation, identity, device_type)] = DeviceEntry(
+                result=result, port=port, probed_at=time.monotonic()
+            )
+
+    def invalidate_port(self, port: str) -> int:
+        """Drop every entry probed on a port. Returns how many were dropped."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.port == port]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def on_ports_changed(self, added: list[dict], removed: list[dict]) -> None:
+        """Port watcher callback: forget devices that were unplugged or changed."""
+        for info in removed:
+            identity = port_identity(info)
+            with self._lock:
+                stale = [
+                    key for key, entry in self._entries.items()
+                    if key[1] == identity or entry.port == info["device"]
+                ]
+                for key in stale:
+                    del self._entries[key]
+                self.invalidations += len(stale)
+            if stale:
+                logger.info(f"Forgot {len(stale)} cached probe(s) for {info['device']}")
+
+    async def query(
+        self,
+        operation: str,
+        port: str,
+        device_type: str,
+        probe: Callable[[], Awaitable[ToolResult]],
+        refresh: bool = False,
+    ) -> ToolResult:
+        """
+        Answer a device query from the cache, or probe the device and cache the result.
+
+        Args:
+            operation: "info" or "status"
+            port: Serial port
+            device_type: "fpga" or "esp32"
+            probe: Coroutine function that runs the real query
+            refresh: Skip the cache and probe the device
+
+        Returns:
+            The tool result
+        """
+        if not refresh:
+            cached = self.get(operation, port, device_type)
+            if cached is not None:
+                return cached
+        result = await probe()
+        if result.get("status") in SUCCESS_STATUSES:
+            self.put(operation, port, device_type, result)
+        else:
+            # The board stopped answering; whatever was cached for the port is suspect
+            self.invalidate_port(port)
+        return result
+
+    def stats(self) -> dict:
+        """Counters for diagnostics."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "baud_rates": {key: limit.baud for key, limit in self._baud_limits.items()},
+            }
+
+
+_registry: DeviceRegistry | None = None
+
+
+def get_device_registry() -> DeviceRegistry:
+    """Get or create the global device registry, subscribed to port changes."""
+    global _registry
+    if _registry is None:
+        _registry = DeviceRegistry(get_config().device_cache_ttl)
+        get_port_watcher().subscribe(_registry.on_ports_changed)
+    return _registry
+
+
+async def query_device(operation: str, port: str, device_type: str, refresh: bool = False) -> ToolResult:
+    """
+    Get device info or flash status, from the registry when possible.
+
+    Cache misses are queued on the port's scheduler queue like any other
+    device operation; hits do not wait for the port at all. Concurrent
+    misses for the same port and device type share one tool run.
+
+    Args:
+        operation: "info" (chip_id/flash_id) or "status" (flash_id)
+        port: Serial port
+        device_type: "fpga" or "esp32"
+        refresh: Probe the device even if a cached result exists
+
+    Returns:
+        ToolResult from the tool, with "cached": true when served from memory
+    """
+    func, label = QUERIES[operation]
+    # Resolve AUTO first, so AUTO queries can be answered from the cache too
+    port = await resolve_port(port, device_type)
+
+    async def run() -> ToolResult:
+        return await get_scheduler().submit(
+            port, func, port, device_type, description=f"{device_type} {label}"
+        )
+
+    async def probe() -> ToolResult:
+        key = (operation, normalize_port_key(port), device_type)
+        return await get_single_flight().do(key, run)
+
+    return await get_device_registry().query(operation, port, device_type, probe, refresh)
@@ -0,0 +1,371 @@
+"""Differential (skip-unchanged) and sparse (skip-erased) flashing.
+
+Before writing an image, the target flash region is hashed on the device in
+fixed-size blocks with the esptool stub's ``flash_md5sum`` command and
+compared with the same blocks of the local file. Only blocks that differ are
+written, merged into contiguous extents so they still go out in a single
+``write-flash`` session.
+
+Sparse flashing needs nothing from the device: runs of whole 4 KB sectors
+that are all 0xFF (erased flash, the padding of merged images and bitstreams)
+are erased with the stub's ``erase_region`` command instead of being sent
+and programmed, and only the extents between them are written.
+
+Device hashing and erasing need esptool as a library, so they always run in
+the in-process engine's worker for the tool, whatever backend is configured
+for the write itself.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from ..config import get_config
+from ..file_detector import open_image
+from .engine import call_in_tool, inprocess_available
+
+logger = logging.getLogger(__name__)
+
+SECTOR_SIZE = 4096
+
+# Sparse scan: sectors are compared in chunks copied out of the mapping
+SCAN_CHUNK = 64 * 1024
+ERASED_CHUNK = b"\xff" * SCAN_CHUNK
+
+
+@dataclass
+class DiffPlan:
+    """Which parts of an image need writing."""
+
+    address: int
+    size: int
+    block_size: int
+    extents: list[tuple[int, int]]  # (offset into file, length)
+    blocks_total: int
+    blocks_changed: int
+    hash_seconds: float
+    temp_files: list[Path] = field(default_factory=list)
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(length for _, length in self.extents)
+
+    @property
+    def bytes_skipped(self) -> int:
+        return self.size - self.bytes_written
+
+    def to_dict(self) -> dict:
+        return {
+            "enabled": True,
+            "block_size": self.block_size,
+            "blocks_total": self.blocks_total,
+            "blocks_changed": self.blocks_changed,
+            "bytes_written": self.bytes_written,
+            "bytes_skipped": self.bytes_skipped,
+            "hash_seconds": round(self.hash_seconds, 3),
+        }
+
+    @property
+    def nothing_to_write(self) -> str:
+        return f"Differential flash: all {self.size} bytes already match, nothing to write"
+
+
+@dataclass
+class SparsePlan:
+    """Which parts of an image are data to write, and which are erased flash."""
+
+    address: int
+    size: int
+    extents: list[tuple[int, int]]  # (offset into file, length) to write
+    erased: list[tuple[int, int]]  # (offset into file, length) to erase, whole sectors
+    scan_seconds: float
+    erase_seconds: float = 0.0
+    temp_files: list[Path] = field(default_factory=list)
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(length for _, length in self.extents)
+
+    @property
+    def bytes_skipped(self) -> int:
+        return self.size - self.bytes_written
+
+    @property
+    def nothing_to_write(self) -> str:
+        return f"Sparse flash: all {self.size} bytes are erased flash, nothing to write"
+
+    def to_dict(self) -> dict:
+        return {
+            "enabled": True,
+            "extents": len(self.extents),
+            "erased_regions": len(self.erased),
+            "bytes_written": self.bytes_written,
+            "bytes_skipped": self.bytes_skipped,
+            "scan_seconds": round(self.scan_seconds, 4),
+            "erase_seconds": round(self.erase_seconds, 3),
+        }
+
+
+def local_block_md5s(file_path: Path, block_size: int) -> list[str]:
+    """MD5 of each block of a local file, read one block at a time."""
+    hashes = []
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            hashes.append(hashlib.md5(block).hexdigest())
+    return hashes
+
+
+def _device_block_md5s(port: str, address: int, size: int, block_size: int) -> list[str]:
+    """Hash a flash region block by block. Runs inside an engine worker process."""
+    from esptool.cmds import detect_chip
+
+    esp = detect_chip(port)
+    try:
+        esp = esp.run_stub()
+        hashes = []
+        for offset in range(0, size, block_size):
+            length = min(block_size, size - offset)
+            hashes.append(esp.flash_md5sum(address + offset, length).lower())
+        return hashes
+    finally:
+        # Leave the chip running its firmware in case nothing needs writing
+        esp.hard_reset()
+        esp._port.close()
+
+
+def _erase_device_regions(port: str, regions: list[tuple[int, int]]) -> None:
+    """Erase (address, length) flash regions. Runs inside an engine worker process."""
+    from esptool.cmds import detect_chip
+
+    esp = detect_chip(port)
+    try:
+        esp = esp.run_stub()
+        for address, length in regions:
+            esp.erase_region(address, length)
+    finally:
+        esp.hard_reset()
+        esp._port.close()
+
+
+def erased_runs(source, min_run: int = SECTOR_SIZE) -> list[tuple[int, int]]:
+    """
+    Find runs of whole 4 KB sectors that are all 0xFF.
+
+    The file is memory-mapped and compared a 64 KB chunk at a time, so memory
+    stays constant and fully erased chunks cost a single comparison. A short
+    last sector counts as erased when all of its bytes are 0xFF; flash is
+    erased a whole sector at a time, so the returned lengths are rounded up
+    to the sector.
+
+    Args:
+        source: File path or bytes-like image
+        min_run: Shortest run to report, in bytes
+
+    Returns:
+        (offset, length) runs in file order
+    """
+    runs: list[tuple[int, int]] = []
+    run_start = None
+    with open_image(source) as view:
+        size = len(view)
+        for chunk_start in range(0, size, SCAN_CHUNK):
+            chunk = view[chunk_start:chunk_start + SCAN_CHUNK].tobytes()
+            if chunk == ERASED_CHUNK[:len(chunk)]:
+                erased = [True] * -(-len(chunk) // SECTOR_SIZE)
+            else:
+                erased = [
+                    chunk.startswith(ERASED_CHUNK[:min(SECTOR_SIZE, len(chunk) - offset)], offset)
+                    for offset in range(0, len(chunk), SECTOR_SIZE)
+                ]
+            for index, is_erased in enumerate(erased):
+                offset = chunk_start + index * SECTOR_SIZE
+                if is_erased and run_start is None:
+                    run_start = offset
+                elif not is_erased and run_start is not None:
+                    runs.append((run_start, offset - run_start))
+                    run_start = None
+    if run_start is not None:
+        runs.append((run_start, -(-(size - run_start) // SECTOR_SIZE) * SECTOR_SIZE))
+    return [(offset, length) for offset, length in runs if length >= min_run]
+
+
+def data_extents(runs: list[tuple[int, int]], size: int) -> list[tuple[int, int]]:
+    """The (offset, length) extents of a file between its erased runs."""
+    extents = []
+    position = 0
+    for offset, length in runs:
+        if offset > position:
+            extents.append((position, offset - position))
+        position = offset + length
+    if position < size:
+        extents.append((position, size - position))
+    return extents
+
+
+def changed_extents(
+    local: list[str], device: list[str], block_size: int, size: int
+) -> list[tuple[int, int]]:
+    """Merge runs of differing blocks into (offset, length) extents."""
+    extents: list[tuple[int, int]] = []
+    for index, (ours, theirs) in enumerate(zip(local, device)):
+        if ours == theirs:
+            continue
+        offset = index * block_size
+        length = min(block_size, size - offset)
+        if extents and extents[-1][0] + extents[-1][1] == offset:
+            extents[-1] = (extents[-1][0], extents[-1][1] + length)
+        else:
+            extents.append((offset, length))
+    return extents
+
+
+async def plan_differential_write(
+    tool: str, port: str, file_path: Path, address: str, timeout: float | None = None
+) -> tuple[DiffPlan | None, str | None]:
+    """
+    Compare a local image with the device and work out what to write.
+
+    Args:
+        tool: "esptool" or "pesptool"
+        port: Serial port (AUTO is not supported for differential mode)
+        file_path: Image to flash
+        address: Flash address in hex
+        timeout: Seconds the on-device hashing may take
+
+    Returns:
+        (plan, None) on success, or (None, reason) when differential mode
+        cannot be used and a full write should be done instead
+    """
+    if not port or port.upper() == "AUTO":
+        return None, "differential mode needs an explicit port"
+    if not inprocess_available():
+        return None, "esptool library not available for on-device hashing"
+
+    start_address = int(address, 0)
+    if start_address % SECTOR_SIZE:
+        return None, f"address {address} is not 4 KB aligned"
+
+    block_size = get_config().diff_block_size
+    if block_size <= 0 or block_size % SECTOR_SIZE:
+        return None, f"diff_block_size {block_size} is not a multiple of 4096"
+
+    size = file_path.stat().st_size
+    start = time.perf_counter()
+    try:
+        device = await call_in_tool(
+            tool, _device_block_md5s, port, start_address, size, block_size, timeout=timeout
+        )
+    except Exception as e:
+        logger.warning(f"On-device hashing failed on {port}: {e}")
+        return None, f"on-device hashing failed: {e}"
+    local = local_block_md5s(file_path, block_size)
+
+    extents = changed_extents(local, device, block_size, size)
+    return DiffPlan(
+        address=start_address,
+        size=size,
+        block_size=block_size,
+        extents=extents,
+        blocks_total=len(local),
+        blocks_changed=sum(1 for ours, theirs in zip(local, device) if ours != theirs),
+        hash_seconds=time.perf_counter() - start,
+    ), None
+
+
+async def plan_sparse_write(
+    tool: str, port: str, file_path: Path, address: str, timeout: float | None = None
+) -> tuple[SparsePlan | None, str | None]:
+    """
+    Erase the all-0xFF runs of an image's target region and work out what to write.
+
+    Args:
+        tool: "esptool" or "pesptool"
+        port: Serial port (AUTO is not supported for sparse mode)
+        file_path: Image to flash
+        address: Flash address in hex
+        timeout: Seconds erasing may take
+
+    Returns:
+        (plan, None) once the runs are erased, or (None, reason) when sparse
+        mode cannot be used or saves nothing and a full write should be done
+    """
+    start_address = int(address, 0)
+    if start_address % SECTOR_SIZE:
+        return None, f"address {address} is not 4 KB aligned"
+
+    min_run = get_config().sparse_min_run
+    if min_run <= 0 or min_run % SECTOR_SIZE:
+        return None, f"sparse_min_run {min_run} is not a multiple of 4096"
+
+    start = time.perf_counter()
+    runs = await asyncio.to_thread(erased_runs, file_path, min_run)
+    scan_seconds = time.perf_counter() - start
+    if not runs:
+        return None, f"no run of 0xFF of {min_run} bytes or more"
+    if not port or port.upper() == "AUTO":
+        return None, "sparse mode needs an explicit port"
+    if not inprocess_available():
+        return None, "esptool library not available for erasing regions"
+
+    size = file_path.stat().st_size
+    start = time.perf_counter()
+    try:
+        await call_in_tool(
+            tool, _erase_device_regions, port,
+            [(start_address + offset, length) for offset, length in runs], timeout=timeout,
+        )
+    except Exception as e:
+        logger.warning(f"Erasing regions failed on {port}: {e}")
+        return None, f"erasing regions failed: {e}"
+
+    return SparsePlan(
+        address=start_address,
+        size=size,
+        extents=data_extents(runs, size),
+        erased=runs,
+        scan_seconds=scan_seconds,
+        erase_seconds=time.perf_counter() - start,
+    ), None
+
+
+def write_extent_files(
+    plan: DiffPlan | SparsePlan, file_path: Path, temp_dir: Path | None = None
+) -> list[tuple[str, str]]:
+    """
+    Copy each extent to write into its own temp file.
+
+    Args:
+        plan: Plan returned by plan_differential_write or plan_sparse_write
+        file_path: Image the plan was made for
+        temp_dir: Where to write extents (default: <user_data_dir>/temp)
+
+    Returns:
+        (address, file) pairs ready to pass to ``write-flash``
+    """
+    temp_dir = temp_dir or get_config().user_data_dir / "temp"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    pairs = []
+    with open(file_path, "rb") as src:
+        for offset, length in plan.extents:
+            src.seek(offset)
+            extent_path = temp_dir / f"diff-{uuid.uuid4().hex}.bin"
+            extent_path.write_bytes(src.read(length))
+            plan.temp_files.append(extent_path)
+            pairs.append((hex(plan.address + offset), str(extent_path)))
+    return pairs
+
+
+def cleanup(plan: DiffPlan | SparsePlan | None) -> None:
+    """Remove extent temp files."""
+    if plan is None:
+        return
+    for path in plan.temp_files:
+        path.unlink(missing_ok=True)
+    plan.temp_files.clear()
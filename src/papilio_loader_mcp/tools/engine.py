@@ -0,0 +1,639 @@
+"""Execution backends for esptool and pesptool.
+
+Two interchangeable backends run a tool command line and return its output:
+
+- ``subprocess``: launches ``esptool.exe``/``pesptool.exe`` for every call
+  (the original behaviour, and the fallback).
+- ``inprocess``: keeps a small pool of worker processes per tool with the tool
+  already imported, and calls its ``main()`` directly. This skips interpreter
+  and PyInstaller start-up on every call.
+
+Worker *processes* (not threads) are used because both tools are Python
+packages named ``esptool`` and both print to the global ``sys.stdout``, so
+they cannot share one interpreter.
+
+Every run can be given a deadline. A tool that is still running when the
+deadline passes, or whose caller is cancelled (e.g. the HTTP client or MCP
+session went away), is killed together with its children and reaped, so a
+board stuck in a bad state cannot hold its port forever.
+"""
+
+import asyncio
+import codecs
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import signal
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from ..config import get_config, get_pesptool_path
+from ..metrics import TOOL_SPAWN, TOOL_TIMEOUTS
+from ..progress import detect_phase
+from .tool_registry import TOOLS, find_tool_executable, get_tool_registry  # noqa: F401 (re-exported)
+
+logger = logging.getLogger(__name__)
+
+
+# When output is streamed to a callback, only this many lines per stream are
+# kept in the ProcessResult; the callback owner keeps the full log.
+STREAMED_TAIL_LINES = 200
+
+LineCallback = Callable[[str], None]
+
+
+@dataclass
+class ProcessResult:
+    """Outcome of one esptool/pesptool invocation."""
+
+    returncode: int
+    stdout: str
+    stderr: str
+    duration: float
+    backend: str
+
+    @property
+    def output(self) -> str:
+        """Combined stdout and stderr, in the order the tools have always reported them."""
+        return self.stdout + self.stderr
+
+
+class ToolTimeoutError(TimeoutError):
+    """A tool did not finish before its deadline and was killed."""
+
+    def __init__(self, tool: str, timeout: float, phase: str | None = None, last_line: str | None = None):
+        self.tool = tool
+        self.timeout = timeout
+        self.phase = phase
+        self.last_line = last_line
+        where = f" during {phase}" if phase else ""
+        message = f"{tool} did not finish within {timeout:.4g}s and was stopped{where}"
+        if last_line:
+            message += f" (last output: {last_line})"
+        super().__init__(message)
+
+
+def timeout_details(error: BaseException, phase: str | None = None) -> dict:
+    """
+    Extra result fields describing a timeout, empty for any other error.
+
+    Args:
+        error: The exception a tool call raised
+        phase: Phase known to the caller (e.g. from its Operation), used when
+            the engine saw none; the engine also sees a half-written last line
+    """
+    if not isinstance(error, ToolTimeoutError):
+        return {}
+    return {"timed_out": True, "timeout": round(error.timeout, 3), "phase": error.phase or phase}
+
+
+class PhaseTracker:
+    """Follows the phase and last line of output of a running tool."""
+
+    def __init__(self):
+        self.phase: str | None = None
+        self.last_line: str | None = None
+
+    def feed(self, line: str) -> None:
+        stripped = line.strip()
+        if stripped:
+            self.last_line = stripped
+            self.phase = detect_phase(stripped) or self.phase
+
+
+class LineSplitter:
+    """Split streamed text into lines on either newline or carriage return.
+
+    esptool redraws progress with carriage returns when it thinks it is on a
+    terminal, so both count as line ends.
+    """
+
+    def __init__(self):
+        self._partial = ""
+
+    def feed(self, text: str) -> list[str]:
+        text = self._partial + text
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        self._partial = lines.pop()
+        return lines
+
+    def flush(self) -> list[str]:
+        partial, self._partial = self._partial, ""
+        return [partial] if partial else []
+
+    @property
+    def pending(self) -> str:
+        """Text of the line still being written (e.g. "Connecting.....")."""
+        return self._partial
+
+
+async def _kill_process_tree(proc: asyncio.subprocess.Process) -> None:
+    """Kill a tool process and anything it started, then reap it."""
+    try:
+        if sys.platform == "win32":
+            # PyInstaller one-file executables run the tool in a child of the
+            # bootloader; killing only the bootloader would leave the port open.
+            killer = await asyncio.create_subprocess_exec(
+                "taskkill", "/F", "/T", "/PID", str(proc.pid),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            await killer.wait()
+        else:
+            # The tool runs in its own session, so its pid is the group id
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError as e:
+        logger.debug(f"Could not kill process tree of {proc.pid}: {e}")
+    if proc.returncode is None:
+        with contextlib.suppress(ProcessLookupError):
+            proc.kill()
+    await proc.wait()
+
+
+class SubprocessBackend:
+    """Run each command in a freshly spawned tool executable."""
+
+    name = "subprocess"
+
+    async def run(
+        self,
+        tool: str,
+        args: list[str],
+        on_line: LineCallback | None = None,
+        timeout: float | None = None,
+    ) -> ProcessResult:
+        registry = get_tool_registry()
+        executable = registry.path(tool)
+        start = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                str(executable),
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=sys.platform != "win32",
+            )
+        except FileNotFoundError:
+            # The executable went away since it was resolved; look again next time
+            registry.forget(tool)
+            raise
+        TOOL_SPAWN.observe(time.perf_counter() - start, tool=tool)
+
+        # Output is always read line by line so a timeout can tell where the
+        # tool got stuck; callers that do not stream get all of it back.
+        maxlen = STREAMED_TAIL_LINES if on_line is not None else None
+        stdout_tail: deque[str] = deque(maxlen=maxlen)
+        stderr_tail: deque[str] = deque(maxlen=maxlen)
+        tracker = PhaseTracker()
+        splitters = (LineSplitter(), LineSplitter())
+
+        def handle(line: str) -> None:
+            tracker.feed(line)
+            if on_line is not None:
+                on_line(line)
+
+        try:
+            async with asyncio.timeout(timeout):
+                await asyncio.gather(
+                    self._pump(proc.stdout, handle, stdout_tail, splitters[0]),
+                    self._pump(proc.stderr, handle, stderr_tail, splitters[1]),
+                )
+                await proc.wait()
+        except TimeoutError:
+            # A tool stuck connecting has printed "Connecting...." without a newline
+            for splitter in splitters:
+                if splitter.pending:
+                    tracker.feed(splitter.pending)
+            TOOL_TIMEOUTS.inc(tool=tool, phase=tracker.phase or "none")
+            logger.warning(f"{tool} {' '.join(args)} timed out after {timeout:.4g}s in phase {tracker.phase}")
+            raise ToolTimeoutError(tool, timeout, tracker.phase, tracker.last_line) from None
+        finally:
+            # Deadline passed or the caller was cancelled: do not leave the
+            # tool holding the serial port
+            if proc.returncode is None:
+                await _kill_process_tree(proc)
+        return ProcessResult(
+            returncode=proc.returncode,
+            stdout="".join(line + "\n" for line in stdout_tail),
+            stderr="".join(line + "\n" for line in stderr_tail),
+            duration=time.perf_counter() - start,
+            backend=self.name,
+        )
+
+    @staticmethod
+    async def _pump(
+        stream: asyncio.StreamReader,
+        on_line: LineCallback,
+        tail: deque,
+        splitter: LineSplitter | None = None,
+    ) -> None:
+        """Read a pipe in chunks and hand each complete line to the callback."""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        splitter = splitter or LineSplitter()
+        while True:
+            chunk = await stream.read(4096)
+            lines = splitter.feed(decoder.decode(chunk, final=not chunk))
+            if not chunk:
+                lines += splitter.flush()
+            for line in lines:
+                tail.append(line)
+                on_line(line)
+            if not chunk:
+                break
+
+    def shutdown(self) -> None:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# In-process backend. The functions below run inside the worker processes.
+# ---------------------------------------------------------------------------
+
+_worker_tool: str | None = None
+
+
+def _init_worker(tool: str, pesptool_path: str) -> None:
+    """Import the tool once when a worker process starts."""
+    global _worker_tool
+    _worker_tool = tool
+    if tool == "pesptool":
+        # The fork ships its own ``esptool`` package next to pesptool.py;
+        # put it first so it shadows the official one in this process.
+        sys.path.insert(0, str(Path(pesptool_path).parent))
+    import esptool  # noqa: F401
+
+
+class _QueueStream(io.TextIOBase):
+    """File-like object that forwards complete lines to the parent process."""
+
+    def __init__(self, queue, name: str):
+        self._queue = queue
+        self._name = name
+        self._splitter = LineSplitter()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        for line in self._splitter.feed(text):
+            self._queue.put((self._name, line))
+        return len(text)
+
+    def flush_lines(self) -> None:
+        for line in self._splitter.flush():
+            self._queue.put((self._name, line))
+
+
+def _run_in_worker(args: list[str], pesptool_path: str, line_queue=None) -> tuple[int, str, str]:
+    """Run one tool command line and capture or stream its output."""
+    if line_queue is not None:
+        stdout = _QueueStream(line_queue, "stdout")
+        stderr = _QueueStream(line_queue, "stderr")
+    else:
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+    returncode = 0
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            if _worker_tool == "pesptool":
+                import runpy
+                saved_argv = sys.argv
+                sys.argv = [pesptool_path, *args]
+                try:
+                    runpy.run_path(pesptool_path, run_name="__main__")
+                finally:
+                    sys.argv = saved_argv
+            else:
+                import esptool
+                esptool.main(args)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                returncode = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except Exception as e:
+            print(f"A fatal error occurred: {e}", file=sys.stderr)
+            returncode = 2
+    if line_queue is not None:
+        stdout.flush_lines()
+        stderr.flush_lines()
+        line_queue.put(None)  # end marker for _pump_lines
+        return returncode, "", ""
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+
+def _pump_lines(line_queue, stop: threading.Event, deliver) -> None:
+    """
+    Hand lines from a worker's queue to ``deliver`` until its end marker.
+
+    Runs in a thread, since every read of a manager queue is a blocking round
+    trip to the manager process. Also returns once ``stop`` is set, for a
+    worker killed before it could send the marker.
+    """
+    while True:
+        try:
+            item = line_queue.get(timeout=0.05)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        except (EOFError, OSError):
+            return  # manager shut down
+        if item is None:
+            return
+        deliver(item)
+
+
+class InProcessBackend:
+    """Run commands inside long-lived worker processes that import the tool once."""
+
+    name = "inprocess"
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max(1, max_workers)
+        # One single-process executor per call, so an abandoned call can be
+        # killed without touching calls running for other ports
+        self._idle: dict[str, list[ProcessPoolExecutor]] = {}
+        self._busy: set[ProcessPoolExecutor] = set()
+        self._manager = None
+
+    def _checkout(self, tool: str) -> ProcessPoolExecutor:
+        """A warm worker for one call, started if none is idle."""
+        idle = self._idle.setdefault(tool, [])
+        if idle:
+            executor = idle.pop()
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(tool, str(get_pesptool_path())),
+            )
+        self._busy.add(executor)
+        return executor
+
+    def _release(self, tool: str, executor: ProcessPoolExecutor) -> None:
+        """Keep a worker that finished its call for the next one, up to max_workers."""
+        self._busy.discard(executor)
+        idle = self._idle.setdefault(tool, [])
+        if len(idle) < self.max_workers:
+            idle.append(executor)
+        else:
+            executor.shutdown(wait=False)
+
+    def _line_queue(self):
+        """Queue the workers can push output lines into while a job runs."""
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager.Queue()
+
+    async def _abort(self, tool: str, executor: ProcessPoolExecutor) -> None:
+        """
+        Kill the worker running an abandoned call and reap it.
+
+        A call stuck inside a worker (e.g. waiting on a serial port) cannot be
+        interrupted any other way. Every call has its own worker, so calls
+        running for other ports carry on.
+        """
+        self._busy.discard(executor)
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        logger.warning(f"Stopping {tool} worker to abandon a call")
+        for process in processes:
+            with contextlib.suppress(OSError):
+                process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+        await asyncio.to_thread(lambda: [process.join(5) for process in processes])
+
+    async def run(
+        self,
+        tool: str,
+        args: list[str],
+        on_line: LineCallback | None = None,
+        timeout: float | None = None,
+    ) -> ProcessResult:
+        if tool == "pesptool" and not get_pesptool_path().exists():
+            raise FileNotFoundError(f"pesptool.py not found at: {get_pesptool_path()}")
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        line_queue = self._line_queue() if on_line is not None else None
+        tracker = PhaseTracker()
+        tails = {
+            "stdout": deque(maxlen=STREAMED_TAIL_LINES),
+            "stderr": deque(maxlen=STREAMED_TAIL_LINES),
+        }
+
+        def deliver(name: str, line: str) -> None:
+            tails[name].append(line)
+            tracker.feed(line)
+            on_line(line)
+
+        stop = threading.Event()
+        executor = self._checkout(tool)
+        try:
+            async with asyncio.timeout(timeout):
+                future = loop.run_in_executor(
+                    executor, _run_in_worker, list(args), str(get_pesptool_path()), line_queue
+                )
+                if line_queue is None:
+                    returncode, stdout, stderr = await future
+                else:
+                    # Queue proxy calls block on IPC, so lines are read in a thread
+                    pump = asyncio.ensure_future(asyncio.to_thread(
+                        _pump_lines, line_queue, stop,
+                        lambda item: stop.is_set() or loop.call_soon_threadsafe(deliver, *item),
+                    ))
+                    try:
+                        returncode, _, _ = await future
+                        # The worker's end marker follows its last line
+                        await pump
+                    finally:
+                        stop.set()
+                    stdout = "".join(line + "\n" for line in tails["stdout"])
+                    stderr = "".join(line + "\n" for line in tails["stderr"])
+        except BrokenProcessPool:
+            # The worker died (e.g. the tool crashed the interpreter)
+            self._busy.discard(executor)
+            executor.shutdown(wait=False)
+            raise
+        except TimeoutError:
+            await self._abort(tool, executor)
+            TOOL_TIMEOUTS.inc(tool=tool, phase=tracker.phase or "none")
+            raise ToolTimeoutError(tool, timeout, tracker.phase, tracker.last_line) from None
+        except asyncio.CancelledError:
+            await self._abort(tool, executor)
+            raise
+        except BaseException:
+            self._release(tool, executor)
+            raise
+        self._release(tool, executor)
+        return ProcessResult(
+            returncode=returncode,
+            stdout=stdout,
+            stderr=stderr,
+            duration=time.perf_counter() - start,
+            backend=self.name,
+        )
+
+    async def call(self, tool: str, func, *args, timeout: float | None = None):
+        """Run a module-level function in a worker that has the tool imported."""
+        if tool == "pesptool" and not get_pesptool_path().exists():
+            raise FileNotFoundError(f"pesptool.py not found at: {get_pesptool_path()}")
+        loop = asyncio.get_running_loop()
+        executor = self._checkout(tool)
+        try:
+            async with asyncio.timeout(timeout):
+                result = await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            self._busy.discard(executor)
+            executor.shutdown(wait=False)
+            raise
+        except TimeoutError:
+            await self._abort(tool, executor)
+            TOOL_TIMEOUTS.inc(tool=tool, phase="none")
+            raise ToolTimeoutError(tool, timeout) from None
+        except asyncio.CancelledError:
+            await self._abort(tool, executor)
+            raise
+        except BaseException:
+            # The function raised; its worker is still fine
+            self._release(tool, executor)
+            raise
+        self._release(tool, executor)
+        return result
+
+    def shutdown(self) -> None:
+        executors = [executor for idle in self._idle.values() for executor in idle]
+        for executor in executors + list(self._busy):
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._idle.clear()
+        self._busy.clear()
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+_backends: dict[str, SubprocessBackend | InProcessBackend] = {}
+
+
+def inprocess_available() -> bool:
+    """Whether esptool can be imported as a library in this environment."""
+    import importlib.util
+    return not getattr(sys, 'frozen', False) and importlib.util.find_spec("esptool") is not None
+
+
+def get_backend(name: str | None = None) -> SubprocessBackend | InProcessBackend:
+    """
+    Get a backend by name, defaulting to ``config.tool_backend``.
+
+    The in-process backend needs the esptool package importable; when it is
+    not (e.g. a frozen build without it), the subprocess backend is used.
+    """
+    name = name or get_config().tool_backend
+    if name not in ("subprocess", "inprocess"):
+        raise ValueError(f"Unknown tool backend: {name}")
+
+    if name == "inprocess" and not inprocess_available():
+        logger.warning("In-process tool backend unavailable, using subprocess backend")
+        name = "subprocess"
+
+    backend = _backends.get(name)
+    if backend is None:
+        if name == "inprocess":
+            backend = InProcessBackend(get_config().tool_workers)
+        else:
+            backend = SubprocessBackend()
+        _backends[name] = backend
+    return backend
+
+
+async def run_tool(
+    tool: str,
+    args: list[str],
+    backend: str | None = None,
+    on_line: LineCallback | None = None,
+    timeout: float | None = None,
+) -> ProcessResult:
+    """
+    Run an esptool/pesptool command line on the configured backend.
+
+    Args:
+        tool: "esptool" or "pesptool"
+        args: Command-line arguments (without the program name)
+        backend: Override the configured backend ("subprocess" or "inprocess")
+        on_line: Called with each output line as it is produced. When given,
+            the returned stdout/stderr only hold the last lines of output.
+        timeout: Seconds the tool may run before it is killed (None: no limit)
+
+    Returns:
+        ProcessResult with return code and captured output
+
+    Raises:
+        FileNotFoundError: If the tool cannot be located
+        ToolTimeoutError: If the tool was still running after ``timeout``
+    """
+    if tool not in TOOLS:
+        raise ValueError(f"Unknown tool: {tool}")
+
+    selected = get_backend(backend)
+    if selected.name == "inprocess":
+        started = time.perf_counter()
+        streamed = False
+
+        def forward(line: str) -> None:
+            nonlocal streamed
+            streamed = True
+            on_line(line)
+
+        try:
+            return await selected.run(tool, args, forward if on_line else None, timeout)
+        except (BrokenProcessPool, FileNotFoundError) as e:
+            if streamed:
+                # The tool got as far as printing; running it again would
+                # repeat its output and whatever it already did to the board
+                raise
+            logger.warning(f"In-process {tool} unavailable ({e}), retrying with subprocess backend")
+            if timeout is not None:
+                timeout = max(0.0, timeout - (time.perf_counter() - started))
+            return await get_backend("subprocess").run(tool, args, on_line, timeout)
+    return await selected.run(tool, args, on_line, timeout)
+
+
+async def call_in_tool(tool: str, func, *args, timeout: float | None = None):
+    """
+    Call a function inside an in-process worker for a tool.
+
+    Used for operations the command line does not expose, such as hashing a
+    flash region block by block. The function must be importable (module
+    level) and its arguments and result picklable.
+
+    Raises:
+        RuntimeError: If the in-process backend is not available
+        ToolTimeoutError: If the call did not return within ``timeout`` seconds
+    """
+    if tool not in TOOLS:
+        raise ValueError(f"Unknown tool: {tool}")
+    if not inprocess_available():
+        raise RuntimeError("esptool library is not available for in-process calls")
+    backend = _backends.get("inprocess")
+    if backend is None:
+        backend = _backends["inprocess"] = InProcessBackend(get_config().tool_workers)
+    return await backend.call(tool, func, *args, timeout=timeout)
+
+
+def shutdown_backends() -> None:
+    """Stop any worker processes started by the in-process backend."""
+    for backend in _backends.values():
+        backend.shutdown()
+    _backends.clear()
@@ -1,14 +1,31 @@
 """ESP32 flashing using official esptool."""
 
-import sys
-import json
 import asyncio
+import time
 from pathlib import Path
 
+from .baud import flash_with_baud_fallback
+from .engine import timeout_details
+from .tool_registry import get_tool_registry, tool_command
+from .results import ToolResult, damaged_image
+from .differential import plan_differential_write, plan_sparse_write, write_extent_files, cleanup
+from ..config import get_config
+from ..file_detector import parse_image
+from ..history import record_operation
+from ..progress import get_progress_broker
+
 
 async def flash_esp_device(
-    port: str, file_path: str, address: str, verify: bool = True
-) -> str:
+    port: str,
+    file_path: str,
+    address: str,
+    verify: bool = True,
+    operation_id: str | None = None,
+    differential: bool = False,
+    sparse: bool = False,
+    sha256: str | None = None,
+    image: dict | None = None,
+) -> ToolResult:
     """
     Flash an ESP32 device with firmware using official esptool.
     
@@ -17,173 +34,279 @@ async def flash_esp_device(
         file_path: Path to firmware file (.bin or .elf)
         address: Flash address in hex (e.g., "0x1000")
         verify: Whether to verify after flashing
+        operation_id: Id for progress events and the full log (generated if omitted)
+        differential: Hash the target region on the device first and only
+            write blocks that differ
+        sparse: Erase runs of 0xFF padding instead of writing them (used
+            when differential mode is off or unavailable)
+        sha256: SHA-256 of the file if already known (upload or saved
+            file), recorded in the history instead of hashing it again
+        image: parse_image report for the file if the caller already parsed
+            it for this device type; parsed here otherwise
     
     Returns:
-        JSON string with flashing results
+        ToolResult with flashing results; "output" holds the last lines of
+        tool output and "log_id" references the full log
     """
     file_path_obj = Path(file_path)
     
     # Validate file exists
     if not file_path_obj.exists():
-        return json.dumps({
+        return ToolResult({
             "success": False,
             "error": f"File not found: {file_path}"
-        }, indent=2)
+        })
     
     # Check file extension
     if file_path_obj.suffix.lower() not in ['.bin', '.elf']:
-        return json.dumps({
+        return ToolResult({
             "success": False,
             "error": f"Invalid file type: {file_path_obj.suffix}. Expected .bin or .elf"
-        }, indent=2)
+        })
+    
+    # Refuse truncated or corrupted images before touching the port
+    if image is None:
+        image = await asyncio.to_thread(parse_image, file_path_obj, "esp32")
+    if image is not None and not image["valid"]:
+        return damaged_image(file_path_obj, image)
     
+    operation = get_progress_broker().start(operation_id, f"Flash ESP32 {file_path_obj.name}")
+    started = time.perf_counter()
+    flash_timeout = get_config().flash_timeout
+    plan = None
+    diff_info = None
+    sparse_info = None
+    result = None
+    negotiation = None
     try:
-        # Use esptool.exe from the application directory
-        if getattr(sys, 'frozen', False):
-            # Running as frozen executable - esptool.exe is in same directory
-            esptool_path = Path(sys.executable).parent / "esptool.exe"
-        else:
-            # Running from source - use the dist/esptool.exe if available
-            esptool_path = Path(__file__).parent.parent.parent.parent / "dist" / "esptool.exe"
-            if not esptool_path.exists():
-                # Fallback: try to find in PATH
-                import shutil
-                esptool_in_path = shutil.which("esptool")
-                if esptool_in_path:
-                    esptool_path = Path(esptool_in_path)
-                else:
-                    return json.dumps({
-                        "success": False,
-                        "error": "esptool.exe not found. Please build it first with: python -m PyInstaller esptool.spec"
-                    }, indent=2)
-        
-        if not esptool_path.exists():
-            return json.dumps({
-                "success": False,
-                "error": f"esptool.exe not found at: {esptool_path}"
-            }, indent=2)
-        
         # Build flash command for ESP32
         # Note: esptool doesn't support --verify flag, verification happens automatically
-        cmd = [
-            str(esptool_path),
-        ]
+        cmd = []
         
         # Add port parameter only if not AUTO (for auto-detection)
         if port and port.upper() != "AUTO":
             cmd.extend(["--port", port])
         
-        cmd.extend([
-            "write-flash",
-            address,
-            str(file_path_obj)
-        ])
+        cmd.append(tool_command("esptool", "write-flash"))
         
-        # Execute flashing
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        # Differential mode: only write the blocks that differ on the device
+        if differential:
+            plan, reason = await plan_differential_write(
+                "esptool", port, file_path_obj, address, timeout=flash_timeout
+            )
+            diff_info = plan.to_dict() if plan else {"enabled": False, "reason": reason}
+            # Without block hashes, let the tool itself skip images already on the device
+            if plan is None and get_tool_registry().supports("esptool", "--skip-flashed"):
+                cmd.append("--skip-flashed")
+                diff_info["fallback"] = "--skip-flashed"
         
-        stdout, stderr = await proc.communicate()
+        # Sparse mode: erase the 0xFF padding on the device, write the rest
+        if sparse and plan is None:
+            plan, reason = await plan_sparse_write(
+                "esptool", port, file_path_obj, address, timeout=flash_timeout
+            )
+            sparse_info = plan.to_dict() if plan else {"enabled": False, "reason": reason}
         
-        output = stdout.decode() + stderr.decode()
+        if plan is not None and not plan.extents:
+            operation.feed(plan.nothing_to_write)
+            success = True
+        else:
+            if plan is not None:
+                for extent_address, extent_file in write_extent_files(plan, file_path_obj):
+                    cmd.extend([extent_address, extent_file])
+            else:
+                cmd.extend([address, str(file_path_obj)])
+            
+            # Execute flashing, streaming output to the operation log
+            result, negotiation = await flash_with_baud_fallback(
+                "esptool", port, cmd, operation.feed,
+                timeout=flash_timeout - (time.perf_counter() - started),
+            )
+            success = result.returncode == 0
+        operation.finish(success)
+        await record_operation(
+            "flash", "esp32", port, success, time.perf_counter() - started,
+            result.returncode if result else 0, operation.output_tail(), operation.id, file_path_obj, sha256,
+        )
         
-        return json.dumps({
-            "success": proc.returncode == 0,
+        response = {
+            "success": success,
             "device_type": "esp32",
             "port": port if port.upper() != "AUTO" else "auto-detected",
             "file": str(file_path_obj),
             "address": address,
             "verified": verify,
-            "output": output
-        }, indent=2)
+            "output": operation.output_tail(),
+            "report": operation.report.to_dict(),
+            **operation.summary()
+        }
+        if image is not None:
+            response["app"] = image["app"]
+        if negotiation is not None:
+            response["baud"] = negotiation.to_dict()
+        if diff_info is not None:
+            response["differential"] = diff_info
+        if sparse_info is not None:
+            response["sparse"] = sparse_info
+        return ToolResult(response)
+        
+    except asyncio.CancelledError:
+        # The caller went away; the engine has already killed the tool
+        operation.feed("Cancelled before the flash finished")
+        operation.finish(False)
+        await record_operation(
+            "flash", "esp32", port, False, time.perf_counter() - started,
+            None, operation.output_tail(), operation.id, file_path_obj, sha256,
+        )
+        raise
         
     except Exception as e:
-        return json.dumps({
+        operation.finish(False)
+        await record_operation(
+            "flash", "esp32", port, False, time.perf_counter() - started,
+            None, f"{operation.output_tail()}\n{e}", operation.id, file_path_obj, sha256,
+        )
+        return ToolResult({
             "success": False,
-            "error": str(e)
-        }, indent=2)
+            "error": str(e),
+            "log_id": operation.id,
+            **timeout_details(e, operation.phase),
+        })
+    
+    finally:
+        cleanup(plan)
 
 
 async def flash_esp_multi_partition(
-    port: str, partitions: list[tuple[str, str]], verify: bool = True
-) -> str:
+    port: str,
+    partitions: list[tuple[str, str]],
+    verify: bool = True,
+    operation_id: str | None = None,
+    tool: str = "esptool",
+    images: list[dict | None] | None = None,
+) -> ToolResult:
     """
-    Flash multiple partitions to ESP32 using official esptool.
+    Flash multiple partitions in a single esptool session.
+    
+    One session means one reset and sync for the whole layout (e.g.
+    bootloader + partition table + app), instead of one per image.
     
     Args:
-        port: Serial port (or "AUTO" for auto-detection)
+        port: Serial port, resolved by the caller before queueing (AUTO lets the tool scan)
         partitions: List of (address, file_path) tuples
         verify: Whether to verify after flashing
+        operation_id: Id for progress events and the full log (generated if omitted)
+        tool: "esptool" for ESP32-only layouts, "pesptool" when the layout
+            includes an FPGA bitstream (combined FPGA + ESP32 images)
+        images: parse_image reports for the files, in partition order, where
+            the caller already parsed them (None entries are parsed here)
     
     Returns:
-        JSON string with flashing results
+        ToolResult with flashing results
     """
-    try:
-        # Use esptool.exe from the application directory
-        if getattr(sys, 'frozen', False):
-            esptool_path = Path(sys.executable).parent / "esptool.exe"
-        else:
-            esptool_path = Path(__file__).parent.parent.parent.parent / "dist" / "esptool.exe"
-            if not esptool_path.exists():
-                import shutil
-                esptool_in_path = shutil.which("esptool")
-                if esptool_in_path:
-                    esptool_path = Path(esptool_in_path)
-                else:
-                    return json.dumps({
-                        "success": False,
-                        "error": "esptool.exe not found. Please build it first with: python -m PyInstaller esptool.spec"
-                    }, indent=2)
-        
-        if not esptool_path.exists():
-            return json.dumps({
+    if not partitions:
+        return ToolResult({
+            "success": False,
+            "error": "No partitions given"
+        })
+    
+    # Validate every image before touching the port
+    regions = []
+    for index, (address, file_path) in enumerate(partitions):
+        file_path_obj = Path(file_path)
+        if not file_path_obj.exists():
+            return ToolResult({
                 "success": False,
-                "error": f"esptool.exe not found at: {esptool_path}"
-            }, indent=2)
-        
+                "error": f"File not found: {file_path}"
+            })
+        if file_path_obj.suffix.lower() != '.bin':
+            return ToolResult({
+                "success": False,
+                "error": f"Invalid file type: {file_path_obj.suffix}. Multi-partition flashing needs .bin images"
+            })
+        try:
+            start = int(address, 0)
+        except ValueError:
+            return ToolResult({
+                "success": False,
+                "error": f"Invalid flash address: {address}"
+            })
+        # pesptool layouts mix ESP32 images and FPGA bitstreams
+        image = images[index] if images else None
+        if image is None:
+            image = await asyncio.to_thread(parse_image, file_path_obj)
+        if image is not None and not image["valid"]:
+            return damaged_image(file_path_obj, image)
+        regions.append((start, start + file_path_obj.stat().st_size, address, file_path))
+    
+    regions.sort()
+    for (_, end, address, file_path), (next_start, _, next_address, next_file) in zip(regions, regions[1:]):
+        if next_start < end:
+            return ToolResult({
+                "success": False,
+                "error": f"{Path(file_path).name} at {address} overlaps {Path(next_file).name} at {next_address}"
+            })
+    
+    operation = get_progress_broker().start(operation_id, f"Flash {len(partitions)} partitions")
+    device_type = "esp32+fpga" if tool == "pesptool" else "esp32"
+    started = time.perf_counter()
+    try:
         # Build multi-partition flash command
-        cmd = [
-            str(esptool_path),
-        ]
+        cmd = []
         
         # Add port parameter only if not AUTO (for auto-detection)
         if port and port.upper() != "AUTO":
             cmd.extend(["--port", port])
         
-        cmd.append("write-flash")  # Use non-deprecated command name
-        
-        if verify:
-            cmd.append("--verify")
+        # Note: write-flash has no --verify flag, the written data is always
+        # checked against its MD5
+        cmd.append(tool_command(tool, "write-flash"))
         
         # Add all partitions
         for address, file_path in partitions:
             cmd.extend([address, file_path])
         
-        # Execute flashing
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        # Execute flashing, streaming output to the operation log
+        result, negotiation = await flash_with_baud_fallback(
+            tool, port, cmd, operation.feed, timeout=get_config().flash_timeout
+        )
+        operation.finish(result.returncode == 0)
+        await record_operation(
+            "flash", device_type, port, result.returncode == 0, time.perf_counter() - started,
+            result.returncode, operation.output_tail(), operation.id,
         )
         
-        stdout, stderr = await proc.communicate()
-        
-        output = stdout.decode() + stderr.decode()
-        
-        return json.dumps({
-            "success": proc.returncode == 0,
-            "device_type": "esp32",
-            "port": port,
+        return ToolResult({
+            "success": result.returncode == 0,
+            "device_type": device_type,
+            "port": port if port and port.upper() != "AUTO" else "auto-detected",
             "partitions": [{"address": addr, "file": fp} for addr, fp in partitions],
             "verified": verify,
-            "output": output
-        }, indent=2)
+            "tool": tool,
+            "output": operation.output_tail(),
+            "report": operation.report.to_dict(),
+            "baud": negotiation.to_dict(),
+            **operation.summary()
+        })
+        
+    except asyncio.CancelledError:
+        operation.feed("Cancelled before the flash finished")
+        operation.finish(False)
+        await record_operation(
+            "flash", device_type, port, False, time.perf_counter() - started,
+            None, operation.output_tail(), operation.id,
+        )
+        raise
         
     except Exception as e:
-        return json.dumps({
+        operation.finish(False)
+        await record_operation(
+            "flash", device_type, port, False, time.perf_counter() - started,
+            None, f"{operation.output_tail()}\n{e}", operation.id,
+        )
+        return ToolResult({
             "success": False,
-            "error": str(e)
-        }, indent=2)
+            "error": str(e),
+            "log_id": operation.id,
+            **timeout_details(e, operation.phase),
+        })
@@ -1,12 +1,15 @@
 """Get flash status and memory information."""
 
-import sys
-import json
-import asyncio
-from pathlib import Path
+from .engine import run_tool, timeout_details
+from .output_parser import parse_output
+from .port_resolver import resolve_port
+from .results import ToolResult
+from .tool_registry import tool_command
+from ..config import get_config
+from ..history import record_operation
 
 
-async def get_flash_status(port: str, device_type: str) -> str:
+async def get_flash_status(port: str, device_type: str) -> ToolResult:
     """
     Get flash status and memory information for a device.
     
@@ -15,131 +18,103 @@ async def get_flash_status(port: str, device_type: str) -> str:
         device_type: Type of device ("fpga" or "esp32")
     
     Returns:
-        JSON string with flash status information
+        ToolResult with flash status information
     """
     if device_type == "fpga":
-        return await _get_fpga_flash_status(port)
+        return await _get_fpga_flash_status(await resolve_port(port, "fpga"))
     elif device_type == "esp32":
-        return await _get_esp32_flash_status(port)
+        return await _get_esp32_flash_status(await resolve_port(port, "esp32"))
     else:
-        return json.dumps({"error": f"Unknown device type: {device_type}"})
+        return ToolResult({"error": f"Unknown device type: {device_type}"})
 
 
-async def _get_fpga_flash_status(port: str) -> str:
+async def _get_fpga_flash_status(port: str) -> ToolResult:
     """Get Papilio FPGA flash status using pesptool."""
     try:
-        # Use pesptool.exe from the application directory
-        if getattr(sys, 'frozen', False):
-            pesptool_path = Path(sys.executable).parent / "pesptool.exe"
-        else:
-            pesptool_path = Path(__file__).parent.parent.parent.parent / "dist" / "pesptool.exe"
-            if not pesptool_path.exists():
-                import shutil
-                pesptool_in_path = shutil.which("pesptool")
-                if pesptool_in_path:
-                    pesptool_path = Path(pesptool_in_path)
-                else:
-                    return json.dumps({"error": "pesptool.exe not found"}, indent=2)
-        
         # Build command
-        cmd = [
-            str(pesptool_path),
-        ]
+        cmd = []
         
         # Add port parameter only if not AUTO (for auto-detection)
         if port and port.upper() != "AUTO":
             cmd.extend(["--port", port])
         
-        cmd.append("flash_id")
+        cmd.append(tool_command("pesptool", "flash_id"))
         
         # Run flash_id command to get flash information
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        result = await run_tool("pesptool", cmd, timeout=get_config().serial_timeout)
+        await record_operation(
+            "status", "fpga", port, result.returncode == 0, result.duration,
+            result.returncode, result.output,
         )
         
-        stdout, stderr = await proc.communicate()
-        
-        if proc.returncode == 0:
-            output = stdout.decode() + stderr.decode()
-            return json.dumps({
+        if result.returncode == 0:
+            output = result.output
+            return ToolResult({
                 "device_type": "fpga",
                 "port": port,
                 "status": "Success",
-                "flash_info": output
-            }, indent=2)
+                "flash_info": output,
+                "flash": parse_output(output).to_dict(),
+            })
         else:
-            return json.dumps({
+            return ToolResult({
                 "device_type": "fpga",
                 "port": port,
                 "status": "Error",
-                "error": stderr.decode()
-            }, indent=2)
+                "error": result.stderr
+            })
             
     except Exception as e:
-        return json.dumps({
+        await record_operation("status", "fpga", port, False, output=str(e))
+        return ToolResult({
             "device_type": "fpga",
             "port": port,
-            "error": str(e)
-        }, indent=2)
+            "error": str(e),
+            **timeout_details(e),
+        })
 
 
-async def _get_esp32_flash_status(port: str) -> str:
+async def _get_esp32_flash_status(port: str) -> ToolResult:
     """Get ESP32 flash status."""
     try:
-        # Use pesptool.exe from the application directory
-        if getattr(sys, 'frozen', False):
-            pesptool_path = Path(sys.executable).parent / "pesptool.exe"
-        else:
-            pesptool_path = Path(__file__).parent.parent.parent.parent / "dist" / "pesptool.exe"
-            if not pesptool_path.exists():
-                import shutil
-                pesptool_in_path = shutil.which("pesptool")
-                if pesptool_in_path:
-                    pesptool_path = Path(pesptool_in_path)
-                else:
-                    return json.dumps({"error": "pesptool.exe not found"}, indent=2)
-        
         # Build command
-        cmd = [
-            str(pesptool_path),
-        ]
+        cmd = []
         
         # Add port parameter only if not AUTO (for auto-detection)
         if port and port.upper() != "AUTO":
             cmd.extend(["--port", port])
         
-        cmd.append("flash_id")
+        cmd.append(tool_command("pesptool", "flash_id"))
         
         # Run flash_id command to get flash information
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        result = await run_tool("pesptool", cmd, timeout=get_config().serial_timeout)
+        await record_operation(
+            "status", "esp32", port, result.returncode == 0, result.duration,
+            result.returncode, result.output,
         )
         
-        stdout, stderr = await proc.communicate()
-        
-        if proc.returncode == 0:
-            output = stdout.decode() + stderr.decode()
-            return json.dumps({
+        if result.returncode == 0:
+            output = result.output
+            return ToolResult({
                 "device_type": "esp32",
                 "port": port,
                 "status": "Success",
-                "flash_info": output
-            }, indent=2)
+                "flash_info": output,
+                "flash": parse_output(output).to_dict(),
+            })
         else:
-            return json.dumps({
+            return ToolResult({
                 "device_type": "esp32",
                 "port": port,
                 "status": "Error",
-                "error": stderr.decode()
-            }, indent=2)
+                "error": result.stderr
+            })
             
     except Exception as e:
-        return json.dumps({
+        await record_operation("status", "esp32", port, False, output=str(e))
+        return ToolResult({
             "device_type": "esp32",
             "port": port,
-            "error": str(e)
-        }, indent=2)
+            "error": str(e),
+            **timeout_details(e),
+        })
@@ -1,12 +1,31 @@
 """FPGA flashing using pesptool (GadgetFactory esptool fork)."""
 
-import sys
-import json
 import asyncio
+import time
 from pathlib import Path
 
+from .baud import flash_with_baud_fallback
+from .engine import timeout_details
+from .tool_registry import get_tool_registry, tool_command
+from .results import ToolResult, damaged_image
+from .differential import plan_differential_write, plan_sparse_write, write_extent_files, cleanup
+from ..config import get_config
+from ..file_detector import parse_image
+from ..history import record_operation
+from ..progress import get_progress_broker
 
-async def flash_fpga_device(port: str, file_path: str, address: str = "0x100000", verify: bool = True) -> str:
+
+async def flash_fpga_device(
+    port: str,
+    file_path: str,
+    address: str = "0x100000",
+    verify: bool = True,
+    operation_id: str | None = None,
+    differential: bool = False,
+    sparse: bool = False,
+    sha256: str | None = None,
+    image: dict | None = None,
+) -> ToolResult:
     """
     Flash a Papilio board with Gowin FPGA using pesptool.
     
@@ -15,95 +34,149 @@ async def flash_fpga_device(port: str, file_path: str, address: str = "0x100000"
         file_path: Path to .bin file (Gowin FPGA bitstream)
         address: Flash address in hex (default: "0x100000" for FPGA bitstreams)
         verify: Whether to verify after flashing
+        operation_id: Id for progress events and the full log (generated if omitted)
+        differential: Hash the target region on the device first and only
+            write blocks that differ
+        sparse: Erase runs of 0xFF padding instead of writing them (used
+            when differential mode is off or unavailable)
+        sha256: SHA-256 of the file if already known (upload or saved
+            file), recorded in the history instead of hashing it again
+        image: parse_image report for the file if the caller already parsed
+            it for this device type; parsed here otherwise
     
     Returns:
-        JSON string with flashing results
+        ToolResult with flashing results; "output" holds the last lines of
+        tool output and "log_id" references the full log
     """
     file_path_obj = Path(file_path)
     
     # Validate file exists
     if not file_path_obj.exists():
-        return json.dumps({
+        return ToolResult({
             "success": False,
             "error": f"File not found: {file_path}"
-        }, indent=2)
+        })
     
     # Check file extension - only .bin supported for Gowin FPGA
     if file_path_obj.suffix.lower() != '.bin':
-        return json.dumps({
+        return ToolResult({
             "success": False,
             "error": f"Invalid file type: {file_path_obj.suffix}. Only .bin files supported for Gowin FPGA (not .bit)"
-        }, indent=2)
+        })
+    
+    # Refuse damaged bitstreams, and ones built for another part, before
+    # touching the port
+    bitstream = image
+    if bitstream is None:
+        bitstream = await asyncio.to_thread(parse_image, file_path_obj, "fpga")
+    if bitstream is not None and not bitstream["valid"]:
+        return damaged_image(file_path_obj, bitstream)
     
+    operation = get_progress_broker().start(operation_id, f"Flash FPGA {file_path_obj.name}")
+    started = time.perf_counter()
+    flash_timeout = get_config().flash_timeout
+    plan = None
+    diff_info = None
+    sparse_info = None
+    result = None
+    negotiation = None
     try:
-        # Use pesptool.exe from the application directory
-        if getattr(sys, 'frozen', False):
-            # Running as frozen executable - pesptool.exe is in same directory
-            pesptool_path = Path(sys.executable).parent / "pesptool.exe"
-        else:
-            # Running from source - use the dist/pesptool.exe if available
-            pesptool_path = Path(__file__).parent.parent.parent.parent / "dist" / "pesptool.exe"
-            if not pesptool_path.exists():
-                # Fallback: try to find in PATH
-                import shutil
-                pesptool_in_path = shutil.which("pesptool")
-                if pesptool_in_path:
-                    pesptool_path = Path(pesptool_in_path)
-                else:
-                    return json.dumps({
-                        "success": False,
-                        "error": "pesptool.exe not found. Please build it first with: python -m PyInstaller pesptool.spec"
-                    }, indent=2)
-        
-        if not pesptool_path.exists():
-            return json.dumps({
-                "success": False,
-                "error": f"pesptool.exe not found at: {pesptool_path}"
-            }, indent=2)
-        
         # Build command for FPGA flashing
         # FPGA bitstreams go to external flash at 0x100000 (1MB offset) by default
-        cmd = [
-            str(pesptool_path),
-        ]
+        cmd = []
         
         # Add port parameter only if not AUTO (for auto-detection)
         if port and port.upper() != "AUTO":
             cmd.extend(["--port", port])
         
-        cmd.extend([
-            "write-flash",
-            address if address else "0x100000",
-            str(file_path_obj)
-        ])
-        
-        # Note: pesptool write-flash doesn't support --verify flag
-        # Verification would need to be done separately with read-flash
+        cmd.append(tool_command("pesptool", "write-flash"))
+        address = address if address else "0x100000"
         
-        # Execute flashing
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        # Differential mode: only write the blocks that differ on the device
+        if differential:
+            plan, reason = await plan_differential_write(
+                "pesptool", port, file_path_obj, address, timeout=flash_timeout
+            )
+            diff_info = plan.to_dict() if plan else {"enabled": False, "reason": reason}
+            # Without block hashes, let the tool itself skip images already on the device
+            if plan is None and get_tool_registry().supports("pesptool", "--skip-flashed"):
+                cmd.append("--skip-flashed")
+                diff_info["fallback"] = "--skip-flashed"
         
-        stdout, stderr = await proc.communicate()
+        # Sparse mode: erase the 0xFF padding on the device, write the rest
+        if sparse and plan is None:
+            plan, reason = await plan_sparse_write(
+                "pesptool", port, file_path_obj, address, timeout=flash_timeout
+            )
+            sparse_info = plan.to_dict() if plan else {"enabled": False, "reason": reason}
         
-        output = stdout.decode() + stderr.decode()
+        if plan is not None and not plan.extents:
+            operation.feed(plan.nothing_to_write)
+            success = True
+        else:
+            if plan is not None:
+                for extent_address, extent_file in write_extent_files(plan, file_path_obj):
+                    cmd.extend([extent_address, extent_file])
+            else:
+                cmd.extend([address, str(file_path_obj)])
+            
+            # Note: pesptool write-flash doesn't support --verify flag
+            # Verification would need to be done separately with read-flash
+            
+            # Execute flashing, streaming output to the operation log
+            result, negotiation = await flash_with_baud_fallback(
+                "pesptool", port, cmd, operation.feed,
+                timeout=flash_timeout - (time.perf_counter() - started),
+            )
+            success = result.returncode == 0
+        operation.finish(success)
+        await record_operation(
+            "flash", "fpga", port, success, time.perf_counter() - started,
+            result.returncode if result else 0, operation.output_tail(), operation.id, file_path_obj, sha256,
+        )
         
-        return json.dumps({
-            "success": proc.returncode == 0,
+        response = {
+            "success": success,
             "device_type": "fpga",
             "port": port if port.upper() != "AUTO" else "auto-detected",
             "file": str(file_path_obj),
             "address": address,
             "verified": verify,
-            "output": output,
+            "output": operation.output_tail(),
+            "report": operation.report.to_dict(),
+            **operation.summary(),
             "tool": "pesptool (GadgetFactory esptool fork)"
-        }, indent=2)
+        }
+        if negotiation is not None:
+            response["baud"] = negotiation.to_dict()
+        if diff_info is not None:
+            response["differential"] = diff_info
+        if sparse_info is not None:
+            response["sparse"] = sparse_info
+        return ToolResult(response)
+        
+    except asyncio.CancelledError:
+        # The caller went away; the engine has already killed the tool
+        operation.feed("Cancelled before the flash finished")
+        operation.finish(False)
+        await record_operation(
+            "flash", "fpga", port, False, time.perf_counter() - started,
+            None, operation.output_tail(), operation.id, file_path_obj, sha256,
+        )
+        raise
         
     except Exception as e:
-        return json.dumps({
+        operation.finish(False)
+        await record_operation(
+            "flash", "fpga", port, False, time.perf_counter() - started,
+            None, f"{operation.output_tail()}\n{e}", operation.id, file_path_obj, sha256,
+        )
+        return ToolResult({
             "success": False,
-            "error": str(e)
-        }, indent=2)
+            "error": str(e),
+            "log_id": operation.id,
+            **timeout_details(e, operation.phase),
+        })
+    
+    finally:
+        cleanup(plan)
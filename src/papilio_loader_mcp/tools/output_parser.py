@@ -0,0 +1,178 @@
+"""Structured parsing of esptool/pesptool output.
+
+``OutputParser`` is fed tool output one line at a time, either while a tool
+is streaming (flash operations) or from a finished capture (``parse_output``),
+and fills in a ``ToolReport``. Each line is dispatched on its first four
+characters to the one precompiled pattern that can match it, so the
+thousands of progress lines in a flash log cost a dict lookup each.
+
+Both the esptool 4.x ("Chip is ESP32-D0WD-V3 (revision v3.1)") and 5.x
+("Chip type:          ESP32-S3 (QFN56) (revision v0.2)") layouts are
+understood.
+"""
+
+import re
+from dataclasses import asdict, dataclass, field
+
+# "Chip is ESP32-S3 (QFN56) (revision v0.2)" / "Chip type:   ESP32-S3 (QFN56) (revision v0.2)"
+CHIP_RE = re.compile(r"^Chip (?:is|type:)\s*(.+?)(?:\s*\(revision (v?[\d.]+)\))?\s*$")
+FEATURES_RE = re.compile(r"^Features:\s*(.+?)\s*$")
+# "Crystal is 40MHz" / "Crystal frequency:  40MHz"
+CRYSTAL_RE = re.compile(r"^Crystal (?:is|frequency:)\s*(\d+)\s*MHz")
+MAC_RE = re.compile(r"^MAC:\s*([0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5})")
+MANUFACTURER_RE = re.compile(r"^Manufacturer:\s*([0-9a-fA-F]+)")
+DEVICE_RE = re.compile(r"^Device:\s*([0-9a-fA-F]+)")
+FLASH_SIZE_RE = re.compile(r"^Detected flash size:\s*(\S+)")
+# "Wrote 313760 bytes (170011 compressed) at 0x00010000 in 4.1 seconds (612.2 kbit/s)."
+WROTE_RE = re.compile(r"^Wrote (\d+) bytes.*? in ([\d.]+) seconds")
+HASH_VERIFIED_RE = re.compile(r"^Hash of data verified")
+# The only record of which port an auto-detected run ended up on
+SERIAL_PORT_RE = re.compile(r"^Serial port (\S+?):?\s*$")
+CONNECTED_RE = re.compile(r"^Connected to \S+ on (\S+?):?\s*$")
+FATAL_RE = re.compile(r"^A fatal error occurred:\s*(.+)$")
+MD5_MISMATCH = "MD5 of file does not match"
+
+
+@dataclass
+class ToolReport:
+    """What esptool/pesptool output says about the device and the run."""
+
+    chip: str | None = None
+    revision: str | None = None
+    features: list[str] | None = None
+    crystal_mhz: int | None = None
+    mac: str | None = None
+    flash_manufacturer: str | None = None
+    flash_device: str | None = None
+    flash_size: str | None = None
+    bytes_written: int | None = None
+    write_seconds: float | None = None
+    kbit_per_s: float | None = None
+    hash_verified: bool | None = None
+    port: str | None = None
+    error: str | None = None
+    regions: list[dict] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        """Fields the output mentioned; absent ones are left out."""
+        return {key: value for key, value in asdict(self).items() if value not in (None, [])}
+
+
+class OutputParser:
+    """Incremental line parser producing a ToolReport."""
+
+    def __init__(self):
+        self.report = ToolReport()
+        self._seconds = 0.0
+        self._dispatch = {
+            "Chip": self._chip,
+            "Feat": self._features,
+            "Crys": self._crystal,
+            "MAC:": self._mac,
+            "Manu": self._manufacturer,
+            "Devi": self._device,
+            "Dete": self._flash_size,
+            "Wrot": self._wrote,
+            "Hash": self._hash,
+            "Seri": self._serial_port,
+            "Conn": self._connected,
+            "A fa": self._fatal,
+        }
+
+    def feed(self, line: str) -> None:
+        """Parse one line of output."""
+        line = line.strip()
+        handler = self._dispatch.get(line[:4])
+        if handler is not None:
+            handler(line)
+
+    def feed_text(self, text: str) -> "OutputParser":
+        """Parse a whole capture."""
+        feed = self.feed
+        for line in text.splitlines():
+            feed(line)
+        return self
+
+    def _chip(self, line):
+        match = CHIP_RE.match(line)
+        if match:
+            self.report.chip = match.group(1)
+            self.report.revision = match.group(2)
+
+    def _features(self, line):
+        match = FEATURES_RE.match(line)
+        if match:
+            self.report.features = [f.strip() for f in match.group(1).split(",") if f.strip()]
+
+    def _crystal(self, line):
+        match = CRYSTAL_RE.match(line)
+        if match:
+            self.report.crystal_mhz = int(match.group(1))
+
+    def _mac(self, line):
+        match = MAC_RE.match(line)
+        if match:
+            self.report.mac = match.group(1).lower()
+
+    def _manufacturer(self, line):
+        match = MANUFACTURER_RE.match(line)
+        if match:
+            self.report.flash_manufacturer = match.group(1).lower()
+
+    def _device(self, line):
+        match = DEVICE_RE.match(line)
+        if match:
+            self.report.flash_device = match.group(1).lower()
+
+    def _flash_size(self, line):
+        match = FLASH_SIZE_RE.match(line)
+        if match:
+            self.report.flash_size = match.group(1)
+
+    def _wrote(self, line):
+        match = WROTE_RE.match(line)
+        if not match:
+            return
+        written, seconds = int(match.group(1)), float(match.group(2))
+        report = self.report
+        report.regions.append({"bytes": written, "seconds": seconds})
+        report.bytes_written = (report.bytes_written or 0) + written
+        self._seconds += seconds
+        report.write_seconds = round(self._seconds, 3)
+        report.kbit_per_s = (
+            round(report.bytes_written * 8 / self._seconds / 1000, 1) if self._seconds else None
+        )
+
+    def _hash(self, line):
+        if HASH_VERIFIED_RE.match(line) and self.report.hash_verified is not False:
+            self.report.hash_verified = True
+
+    def _serial_port(self, line):
+        match = SERIAL_PORT_RE.match(line)
+        if match:
+            self.report.port = match.group(1)
+
+    def _connected(self, line):
+        match = CONNECTED_RE.match(line)
+        if match:
+            self.report.port = match.group(1)
+
+    def _fatal(self, line):
+        match = FATAL_RE.match(line)
+        if match:
+            self.report.error = match.group(1)
+            if MD5_MISMATCH in line:
+                self.report.hash_verified = False
+
+
+def parse_output(text: str) -> ToolReport:
+    """
+    Parse a captured esptool/pesptool output.
+
+    Args:
+        text: Tool output (stdout and stderr)
+
+    Returns:
+        ToolReport with whatever the output mentioned
+    """
+    return OutputParser().feed_text(text).report
@@ -0,0 +1,212 @@
+"""Resolve the AUTO port inside the loader.
+
+Left to itself, esptool handles a missing ``--port`` by trying to sync with
+every serial port on the machine, one after the other. On hosts with many
+ports that takes minutes and resets unrelated devices. Instead, AUTO is
+resolved here from the port watcher's table:
+
+1. A port that won for this device type before is reused while it is still
+   plugged in.
+2. Otherwise ports are filtered to USB devices that can be a Papilio/ESP32
+   board (known VID/PIDs and product strings), best matches first.
+3. A single candidate is used as is; several are probed in parallel with a
+   short ``chip_id`` and the first to answer wins. Concurrent requests for
+   the same device type share one round of probes.
+
+If nothing matches, AUTO is passed through and esptool scans as before.
+
+Callers resolve AUTO before queueing a job, so the job waits in the queue of
+the port it will open. Probes open ports too: each one is queued on its
+port like any other job, and ports with a job running or waiting are left
+out while any idle candidate remains, so a probe never resets a board in the
+middle of a flash.
+"""
+
+import asyncio
+import logging
+
+from ..config import get_config
+from ..scheduler import get_scheduler
+from .engine import ToolTimeoutError, run_tool
+from .serial_ports import get_port_watcher
+from .singleflight import SingleFlight
+from .tool_registry import tool_command
+
+logger = logging.getLogger(__name__)
+
+# (vid, pid) -> score; higher is a more likely Papilio/ESP32 board
+KNOWN_USB_IDS = {
+    (0x303A, 0x1001): 3,  # Espressif USB-Serial/JTAG (ESP32-S3/C3/C6 native USB)
+    (0x303A, 0x0002): 3,  # Espressif USB CDC (ESP32-S2/S3 TinyUSB)
+    (0x0403, 0x6010): 2,  # FTDI FT2232 (Papilio FPGA boards)
+    (0x0403, 0x6014): 2,  # FTDI FT232H
+    (0x0403, 0x6001): 1,  # FTDI FT232R
+    (0x0403, 0x6015): 1,  # FTDI FT231X
+    (0x10C4, 0xEA60): 1,  # Silicon Labs CP210x
+    (0x1A86, 0x7523): 1,  # WCH CH340
+    (0x1A86, 0x55D4): 1,  # WCH CH9102
+}
+
+# Substrings of the USB product/manufacturer/description that identify a board
+PRODUCT_HINTS = {
+    "papilio": 4,
+    "gadget factory": 4,
+    "esp32": 3,
+    "espressif": 3,
+    "usb jtag/serial": 3,
+}
+
+
+def _parse_usb_id(value: str) -> tuple[int, int] | None:
+    """Parse "303A:1001" from config."""
+    try:
+        vid, pid = value.split(":")
+        return int(vid, 16), int(pid, 16)
+    except ValueError:
+        logger.warning(f"Ignoring invalid USB id {value!r} (expected VID:PID in hex)")
+        return None
+
+
+def score_port(info: dict, extra_ids: set[tuple[int, int]] = frozenset()) -> int:
+    """How likely a port is to be a Papilio/ESP32 board (0 = not at all)."""
+    score = 0
+    usb_id = (info.get("vid"), info.get("pid"))
+    if usb_id in extra_ids:
+        score = 4
+    score = max(score, KNOWN_USB_IDS.get(usb_id, 0))
+    text = " ".join(
+        str(info.get(key) or "") for key in ("product", "manufacturer", "description")
+    ).lower()
+    for hint, hint_score in PRODUCT_HINTS.items():
+        if hint in text:
+            score = max(score, hint_score)
+    return score
+
+
+def candidate_ports(ports: list[dict], extra_ids: set[tuple[int, int]] = frozenset()) -> list[str]:
+    """Ports that may be a board, best match first."""
+    scored = [(score_port(info, extra_ids), info["device"]) for info in ports]
+    return [device for score, device in sorted(scored, key=lambda s: (-s[0], s[1])) if score > 0]
+
+
+class PortResolver:
+    """Turns AUTO into a concrete port and remembers the winner per device type."""
+
+    def __init__(self, probe_timeout: float = 5.0, extra_ids: list[str] | None = None):
+        self.probe_timeout = probe_timeout
+        self.extra_ids = {usb_id for usb_id in map(_parse_usb_id, extra_ids or []) if usb_id}
+        self._winners: dict[str, str] = {}
+        # Concurrent AUTO requests for a device type share one probe round
+        self._single_flight = SingleFlight()
+
+    def forget(self, added: list[dict], removed: list[dict]) -> None:
+        """Port watcher callback: drop winners that were unplugged."""
+        gone = {info["device"] for info in removed}
+        for device_type, port in list(self._winners.items()):
+            if port in gone:
+                del self._winners[device_type]
+
+    async def _probe(self, port: str, device_type: str) -> bool:
+        """Ask a port for its chip id with a single connection attempt."""
+        tool = "pesptool" if device_type == "fpga" else "esptool"
+        try:
+            result = await run_tool(
+                tool, ["--port", port, "--connect-attempts", "1", tool_command(tool, "chip_id")],
+                timeout=self.probe_timeout,
+            )
+        except (ToolTimeoutError, OSError) as e:
+            logger.debug(f"Probe of {port} failed: {e!r}")
+            return False
+        return result.returncode == 0
+
+    async def resolve(self, port: str | None, device_type: str) -> str:
+        """
+        Resolve AUTO for a device type.
+
+        Args:
+            port: Requested port; anything other than AUTO/empty is returned as is
+            device_type: "fpga" or "esp32"
+
+        Returns:
+            A concrete port, or "AUTO" if no candidate was found
+        """
+        if port and port.upper() != "AUTO":
+            return port
+
+        watcher = get_port_watcher()
+        await watcher.wait_ready()
+        ports = watcher.snapshot()["ports"]
+        present = {info["device"] for info in ports}
+
+        winner = self._winners.get(device_type)
+        if winner in present:
+            return winner
+
+        return await self._single_flight.do(
+            ("resolve", device_type), lambda: self._choose(ports, device_type)
+        )
+
+    async def _choose(self, ports: list[dict], device_type: str) -> str:
+        """Pick a port among the candidates and remember it."""
+        candidates = candidate_ports(ports, self.extra_ids)
+        if not candidates:
+            logger.info("AUTO: no known board among serial ports, leaving detection to esptool")
+            return "AUTO"
+        if len(candidates) == 1:
+            chosen = candidates[0]
+        else:
+            chosen = await self._first_to_answer(candidates, device_type)
+            if chosen is None:
+                logger.info(f"AUTO: none of {candidates} answered, leaving detection to esptool")
+                return "AUTO"
+
+        logger.info(f"AUTO resolved to {chosen} for {device_type}")
+        self._winners[device_type] = chosen
+        return chosen
+
+    async def _first_to_answer(self, candidates: list[str], device_type: str) -> str | None:
+        """Probe candidates in parallel, each in its port's queue; the first that answers wins."""
+        scheduler = get_scheduler()
+        # Busy ports would make the probe wait for their job; try idle ones first
+        idle = [port for port in candidates if not scheduler.is_busy(port)]
+        probes = {
+            asyncio.ensure_future(scheduler.submit(
+                port, self._probe, port, device_type, description=f"AUTO probe for {device_type}"
+            )): port
+            for port in idle or candidates
+        }
+        pending = set(probes)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and task.result():
+                        return probes[task]
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def winners(self) -> dict:
+        """Remembered port per device type."""
+        return dict(self._winners)
+
+
+_resolver: PortResolver | None = None
+
+
+def get_port_resolver() -> PortResolver:
+    """Get or create the global resolver, subscribed to port changes."""
+    global _resolver
+    if _resolver is None:
+        config = get_config()
+        _resolver = PortResolver(config.auto_port_probe_timeout, config.auto_port_usb_ids)
+        get_port_watcher().subscribe(_resolver.forget)
+    return _resolver
+
+
+async def resolve_port(port: str | None, device_type: str) -> str:
+    """Resolve AUTO to a concrete port (see ``PortResolver.resolve``)."""
+    if port and port.upper() != "AUTO":
+        return port
+    return await get_port_resolver().resolve(port, device_type)
@@ -0,0 +1,37 @@
+"""Result type returned by the device tools."""
+
+import json
+from pathlib import Path
+
+IMAGE_KINDS = {
+    "esp32-image": "ESP32 image",
+    "esp32-merged": "ESP32 image",
+    "gowin-bitstream": "FPGA bitstream",
+}
+
+
+class ToolResult(dict):
+    """
+    A tool's result.
+
+    Tools used to return JSON strings that the REST API parsed straight back
+    into dicts. A ToolResult stays a dict inside the server and is turned into
+    JSON once, at the edge: ``to_json()`` for MCP text content, FastAPI's own
+    encoder for REST responses.
+    """
+
+    def to_json(self) -> str:
+        """JSON text for MCP responses."""
+        return json.dumps(self, indent=2)
+
+    def __str__(self) -> str:
+        return self.to_json()
+
+
+def damaged_image(file_path: Path, image: dict) -> ToolResult:
+    """Error result for a file that failed the structural checks of ``file_detector.parse_image``."""
+    return ToolResult({
+        "success": False,
+        "error": f"Damaged {IMAGE_KINDS.get(image['format'], 'image')} {file_path.name}: {'; '.join(image['errors'])}",
+        "image": image,
+    })
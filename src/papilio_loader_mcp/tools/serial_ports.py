@@ -1,21 +1,34 @@
-"""List available serial ports."""
+"""List available serial ports.
+
+Enumerating ports can take hundreds of milliseconds on hosts with many
+USB-serial adapters, so a background ``PortWatcher`` thread rescans
+periodically and keeps the current table in memory. Callers read the cached
+table; its ``generation`` counter goes up whenever a port appears, disappears
+or changes.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable
 
-import json
 import serial.tools.list_ports
 
+from ..config import get_config
+from .results import ToolResult
 
-async def list_serial_ports() -> str:
-    """
-    List all available serial/COM ports on the system.
-    
-    Returns:
-        JSON string with port information
-    """
-    ports = serial.tools.list_ports.comports()
+logger = logging.getLogger(__name__)
+
+# Called from the watcher thread with (added, removed) port dicts
+PortChangeCallback = Callable[[list[dict], list[dict]], None]
+
+
+def scan_ports() -> list[dict]:
+    """Enumerate serial ports now. Blocking; call from a thread."""
     port_list = []
-    
-    for port in ports:
-        port_info = {
+    for port in serial.tools.list_ports.comports():
+        port_list.append({
             "device": port.device,
             "name": port.name,
             "description": port.description,
@@ -25,7 +38,133 @@ async def list_serial_ports() -> str:
             "serial_number": port.serial_number,
             "manufacturer": port.manufacturer,
             "product": port.product,
-        }
-        port_list.append(port_info)
+        })
+    port_list.sort(key=lambda p: p["device"])
+    return port_list
+
+
+class PortWatcher:
+    """Background thread that keeps an in-memory serial port table fresh."""
+
+    def __init__(self, interval: float = 2.0, scan: Callable[[], list[dict]] = scan_ports):
+        self.interval = interval
+        self.generation = 0
+        self.scanned_at: float | None = None
+        self._scan = scan
+        self._ports: list[dict] = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._subscribers: list[PortChangeCallback] = []
+
+    def start(self) -> None:
+        """Start the watcher thread if it is not already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="port-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the watcher thread."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def rescan(self) -> None:
+        """Ask the watcher thread to scan now instead of waiting for the interval."""
+        self._wake.set()
+
+    def subscribe(self, callback: PortChangeCallback) -> None:
+        """Register a callback for ports being added or removed."""
+        self._subscribers.append(callback)
+
+    def refresh(self) -> bool:
+        """
+        Scan once and update the table.
+
+        Returns:
+            True if the port table changed
+        """
+        ports = self._scan()
+        with self._lock:
+            self.scanned_at = time.time()
+            if ports == self._ports and self.generation:
+                return False
+            old = {p["device"]: p for p in self._ports}
+            new = {p["device"]: p for p in ports}
+            self._ports = ports
+            self.generation += 1
+
+        # A port whose details changed counts as removed and re-added
+        removed = [p for device, p in old.items() if new.get(device) != p]
+        added = [p for device, p in new.items() if old.get(device) != p]
+        if added or removed:
+            logger.info(
+                f"Serial ports changed (generation {self.generation}): "
+                f"+{[p['device'] for p in added]} -{[p['device'] for p in removed]}"
+            )
+        for callback in self._subscribers:
+            try:
+                callback(added, removed)
+            except Exception as e:
+                logger.warning(f"Port change callback failed: {e}")
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Serial port scan failed: {e}")
+            self._ready.set()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    async def wait_ready(self, timeout: float = 10.0) -> bool:
+        """Wait (off the event loop) until the first scan has finished."""
+        if self._ready.is_set():
+            return True
+        return await asyncio.to_thread(self._ready.wait, timeout)
+
+    def snapshot(self) -> dict:
+        """Current port table with its generation counter."""
+        with self._lock:
+            ports = list(self._ports)
+            return {
+                "ports": ports,
+                "count": len(ports),
+                "generation": self.generation,
+                "scanned_at": self.scanned_at,
+            }
+
+
+_watcher: PortWatcher | None = None
+
+
+def get_port_watcher() -> PortWatcher:
+    """Get the global port watcher, starting it on first use."""
+    global _watcher
+    if _watcher is None:
+        _watcher = PortWatcher(get_config().port_scan_interval)
+    _watcher.start()
+    return _watcher
+
+
+async def list_serial_ports() -> ToolResult:
+    """
+    List all available serial/COM ports on the system.
+    
+    Answers from the port watcher's cache; only the very first call waits
+    for a scan to finish.
     
-    return json.dumps({"ports": port_list, "count": len(port_list)}, indent=2)
+    Returns:
+        ToolResult with port information and the table's generation counter
+    """
+    watcher = get_port_watcher()
+    await watcher.wait_ready()
+    return ToolResult(watcher.snapshot())
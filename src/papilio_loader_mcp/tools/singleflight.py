@@ -0,0 +1,91 @@
+"""Coalescing of concurrent identical device queries.
+
+When several clients ask the same question about the same port at once
+(two browser tabs and an MCP agent all refreshing device info), only the
+first call runs the tool; the others wait for it and get the same result.
+Calls that arrive after the result is in start a new run. A run nobody is
+waiting for any more is cancelled, so it frees its port.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+from ..metrics import SINGLEFLIGHT_CALLS
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Share one in-flight call per key between concurrent callers."""
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self._waiters: dict[asyncio.Task, int] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: tuple, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run func, or join a run of it that is already in flight for key.
+
+        The shared run is a separate task, so a caller that gives up (e.g. an
+        HTTP client disconnecting) does not cancel it for the others; when the
+        last caller gives up, the run is cancelled.
+
+        Args:
+            key: Identifies identical calls; key[0] names the operation in metrics
+            func: Coroutine function doing the real work
+
+        Returns:
+            func's result; its exception is raised in every caller
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.executed += 1
+            SINGLEFLIGHT_CALLS.inc(operation=key[0], result="executed")
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+            SINGLEFLIGHT_CALLS.inc(operation=key[0], result="coalesced")
+            logger.debug(f"Joined in-flight {key}")
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                # Nobody is left to use the result; later callers start afresh
+                logger.debug(f"Cancelling abandoned {key}")
+                self._forget(key, task)
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        """Stop handing out task for key, unless a newer run took its place."""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        """Counters for diagnostics."""
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+
+_single_flight: SingleFlight | None = None
+
+
+def get_single_flight() -> SingleFlight:
+    """Get or create the global single-flight group for device queries."""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,274 @@
+"""Resolved tool executables and what they can do.
+
+Locating esptool/pesptool means checking for a frozen build, then
+``dist/<tool>.exe``, then ``PATH``. The ``ToolRegistry`` does that once per
+tool and keeps the path. A background thread started with the server asks
+each executable for its version, its subcommands and the options of
+``write-flash``. ``/health`` shows the result, and command lines are built
+with the spelling the installed tool knows: esptool 5 renamed ``chip_id`` to
+``chip-id`` and warns about the old names, while older releases and forks
+only know some of the new ones.
+"""
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+TOOLS = ("esptool", "pesptool")
+
+# Last token of `esptool version`: "4.7.0", "5.1.0", "v4.6-dev"
+VERSION_RE = re.compile(r"v?(\d+\.\d+[\w.+-]*)\s*$")
+# argparse help (esptool 4.x): "{load_ram,dump_mem,read_mem,...}"
+ARGPARSE_COMMANDS_RE = re.compile(r"\{([a-z0-9_-]+(?:,[a-z0-9_-]+)+)\}")
+# rich-click help (esptool 5.x): "│ write-flash    Write a binary blob to flash..."
+CLICK_COMMAND_RE = re.compile(r"^[│|]?\s?([a-z][a-z0-9_-]*)\s{2,}\S")
+CLICK_SECTION_RE = re.compile(r"^[╭+]─+\s*(.+?)\s*─")
+OPTION_RE = re.compile(r"(?<![\w-])(--[a-z][a-z0-9-]*)")
+
+
+def find_tool_executable(tool: str) -> Path:
+    """
+    Locate the executable for a tool.
+
+    Args:
+        tool: "esptool" or "pesptool"
+
+    Returns:
+        Path to the executable
+
+    Raises:
+        FileNotFoundError: If the executable cannot be found
+    """
+    if getattr(sys, 'frozen', False):
+        # Running as frozen executable - tools are in the same directory
+        path = Path(sys.executable).parent / f"{tool}.exe"
+    else:
+        # Running from source - use the dist/<tool>.exe if available
+        path = Path(__file__).parent.parent.parent.parent / "dist" / f"{tool}.exe"
+        if not path.exists():
+            # Fallback: try to find in PATH
+            in_path = shutil.which(tool)
+            if in_path:
+                path = Path(in_path)
+            else:
+                raise FileNotFoundError(
+                    f"{tool}.exe not found. Please build it first with: python -m PyInstaller {tool}.spec"
+                )
+
+    if not path.exists():
+        raise FileNotFoundError(f"{tool}.exe not found at: {path}")
+    return path
+
+
+def parse_commands(help_text: str) -> list[str]:
+    """Subcommand names from a tool's --help output (argparse or rich-click)."""
+    # Option choices ("--chip {auto,esp32,...}") use braces too; the
+    # subcommand list is the one with flash commands in it
+    for group in ARGPARSE_COMMANDS_RE.findall(help_text):
+        names = group.split(",")
+        if any("flash" in name for name in names):
+            return sorted(set(names))
+    commands = set()
+    in_commands = False
+    for line in help_text.splitlines():
+        section = CLICK_SECTION_RE.match(line.strip())
+        if section:
+            in_commands = "command" in section.group(1).lower()
+            continue
+        if in_commands:
+            command = CLICK_COMMAND_RE.match(line.strip())
+            if command:
+                commands.add(command.group(1))
+    return sorted(commands)
+
+
+def parse_version(version_text: str) -> str | None:
+    """Version number from `<tool> version` output."""
+    for line in reversed(version_text.strip().splitlines()):
+        match = VERSION_RE.search(line.strip())
+        if match:
+            return match.group(1)
+    return None
+
+
+@dataclass
+class ToolInfo:
+    """What probing one executable found out."""
+
+    tool: str
+    path: str | None = None
+    version: str | None = None
+    commands: list[str] = field(default_factory=list)
+    write_flash_options: list[str] = field(default_factory=list)
+    error: str | None = None
+    probe_seconds: float | None = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class ToolRegistry:
+    """Executable paths resolved once, plus probed versions and capabilities."""
+
+    def __init__(self, find: Callable[[str], Path] = find_tool_executable, probe_timeout: float = 30.0):
+        self.probe_timeout = probe_timeout
+        self._find = find
+        self._paths: dict[str, Path] = {}
+        self._info: dict[str, ToolInfo] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def path(self, tool: str) -> Path:
+        """
+        Executable for a tool, looked up on first use only.
+
+        Raises:
+            FileNotFoundError: If the executable cannot be found
+        """
+        with self._lock:
+            path = self._paths.get(tool)
+        if path is not None:
+            return path
+        path = self._find(tool)
+        with self._lock:
+            return self._paths.setdefault(tool, path)
+
+    def set_path(self, tool: str, path: Path) -> None:
+        """Use a specific executable for a tool (a custom build, or a stand-in in tests)."""
+        with self._lock:
+            self._paths[tool] = Path(path)
+            self._info.pop(tool, None)
+
+    def forget(self, tool: str) -> None:
+        """Drop what is known about a tool, e.g. after its executable disappeared."""
+        with self._lock:
+            self._paths.pop(tool, None)
+            self._info.pop(tool, None)
+
+    def start(self) -> None:
+        """Probe every tool in a background thread, once."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._probe_all, name="tool-probe", daemon=True)
+        self._thread.start()
+
+    def _probe_all(self) -> None:
+        for tool in TOOLS:
+            try:
+                self.probe(tool)
+            except Exception as e:
+                logger.warning(f"Probing {tool} failed: {e}")
+
+    def _run(self, path: Path, *args: str) -> str:
+        completed = subprocess.run(
+            [str(path), *args],
+            capture_output=True,
+            text=True,
+            errors="replace",
+            timeout=self.probe_timeout,
+            # Wide enough that rich-click does not truncate option names
+            env={**os.environ, "COLUMNS": "200"},
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+        )
+        return completed.stdout + completed.stderr
+
+    def probe(self, tool: str) -> ToolInfo:
+        """
+        Ask a tool for its version, subcommands and write-flash options. Blocking.
+
+        Returns:
+            The probe result, also kept for ``info`` and ``command``
+        """
+        start = time.perf_counter()
+        info = ToolInfo(tool)
+        try:
+            path = self.path(tool)
+            info.path = str(path)
+            info.version = parse_version(self._run(path, "version"))
+            info.commands = parse_commands(self._run(path, "--help"))
+            write_flash = _spelling(info.commands, "write-flash") or "write_flash"
+            info.write_flash_options = sorted(set(OPTION_RE.findall(self._run(path, write_flash, "--help"))))
+        except (OSError, subprocess.SubprocessError) as e:
+            info.error = str(e)
+        info.probe_seconds = round(time.perf_counter() - start, 3)
+        with self._lock:
+            # A path swapped in while probing makes this result stale
+            if info.path is None or str(self._paths.get(tool)) == info.path:
+                self._info[tool] = info
+        if info.error:
+            logger.warning(f"{tool} unavailable: {info.error}")
+        else:
+            logger.info(f"{tool} {info.version} at {info.path}: {len(info.commands)} commands")
+        return info
+
+    def info(self, tool: str) -> ToolInfo | None:
+        """Probe result for a tool, None until it has been probed."""
+        with self._lock:
+            return self._info.get(tool)
+
+    def command(self, tool: str, name: str) -> str:
+        """
+        A subcommand in the spelling the installed tool knows.
+
+        Args:
+            tool: "esptool" or "pesptool"
+            name: Command in either spelling ("chip_id" or "chip-id")
+
+        Returns:
+            The matching command, or name unchanged if the tool has not been
+            probed or knows neither spelling
+        """
+        info = self.info(tool)
+        if info is None or not info.commands:
+            return name
+        return _spelling(info.commands, name) or name
+
+    def supports(self, tool: str, name: str) -> bool | None:
+        """Whether a tool has a subcommand or write-flash option; None if unknown."""
+        info = self.info(tool)
+        if info is None or info.error:
+            return None
+        if name.startswith("--"):
+            return name in info.write_flash_options
+        return _spelling(info.commands, name) is not None
+
+    def status(self) -> dict:
+        """Probe results for /health."""
+        status = {}
+        for tool in TOOLS:
+            info = self.info(tool)
+            status[tool] = info.to_dict() if info else {"tool": tool, "probing": True}
+        return status
+
+
+def _spelling(commands: list[str], name: str) -> str | None:
+    for candidate in (name, name.replace("_", "-"), name.replace("-", "_")):
+        if candidate in commands:
+            return candidate
+    return None
+
+
+_registry: ToolRegistry | None = None
+
+
+def get_tool_registry() -> ToolRegistry:
+    """Get or create the global tool registry."""
+    global _registry
+    if _registry is None:
+        _registry = ToolRegistry()
+    return _registry
+
+
+def tool_command(tool: str, name: str) -> str:
+    """Subcommand spelling for the installed tool (see ``ToolRegistry.command``)."""
+    return get_tool_registry().command(tool, name)
@@ -0,0 +1,159 @@
+"""Streaming upload handling.
+
+Uploaded files are copied to disk in fixed-size chunks instead of being read
+into memory whole. The SHA-256 and the header used for file type detection
+are computed in the same pass, and the size limit is enforced on the running
+byte count. ``UploadLimitMiddleware`` rejects oversized request bodies before
+they are parsed at all, from Content-Length when the client sends it and from
+the bytes received otherwise.
+"""
+
+import hashlib
+import logging
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+
+from .file_detector import HEADER_SIZE, validate_file_for_device
+from .metrics import UPLOAD_BYTES, UPLOADS
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# Room for multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Most files accepted by one multi-partition request
+MAX_PARTITIONS = 16
+
+
+@dataclass
+class StoredUpload:
+    """An upload written to disk, with what was learned while copying it."""
+
+    path: Path
+    filename: str
+    size: int
+    sha256: str
+    header: bytes
+
+    def validate_for_device(self, device_type: str) -> dict:
+        """Check the file type against the intended device, from the stored file."""
+        return validate_file_for_device(self.path, device_type)
+
+
+def too_large(limit: int, filename: str | None = None) -> HTTPException:
+    """413 error for a body or file over the limit."""
+    subject = filename or "File"
+    return HTTPException(status_code=413, detail=f"{subject} too large (max {limit} bytes)")
+
+
+def temp_upload_path(temp_dir: Path, filename: str | None) -> Path:
+    """Unique temp path that keeps the client's file name for readable logs."""
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    name = Path(filename or "upload.bin").name
+    return temp_dir / f"{uuid.uuid4().hex}-{name}"
+
+
+async def save_upload(upload: UploadFile, dest: Path, limit: int) -> StoredUpload:
+    """
+    Copy an upload to disk chunk by chunk.
+
+    Args:
+        upload: File from the multipart form
+        dest: Where to write it; removed again if the copy fails
+        limit: Maximum size in bytes
+
+    Returns:
+        StoredUpload with size, SHA-256 and header bytes
+
+    Raises:
+        HTTPException: 413 as soon as the running byte count exceeds the limit
+    """
+    hasher = hashlib.sha256()
+    header = bytearray()
+    size = 0
+    try:
+        with open(dest, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > limit:
+                    raise too_large(limit, upload.filename)
+                if len(header) < HEADER_SIZE:
+                    header += chunk[:HEADER_SIZE - len(header)]
+                hasher.update(chunk)
+                f.write(chunk)
+    except HTTPException:
+        dest.unlink(missing_ok=True)
+        UPLOADS.inc(result="rejected")
+        raise
+    except BaseException:
+        dest.unlink(missing_ok=True)
+        UPLOADS.inc(result="error")
+        raise
+    finally:
+        UPLOAD_BYTES.inc(size)
+    UPLOADS.inc(result="stored")
+
+    return StoredUpload(
+        path=dest,
+        filename=upload.filename or dest.name,
+        size=size,
+        sha256=hasher.hexdigest(),
+        header=bytes(header),
+    )
+
+
+class UploadLimitMiddleware:
+    """
+    Reject request bodies over a per-path limit before they are parsed.
+
+    Starlette spools multipart files to temporary files as they arrive, so
+    without this an oversized upload is only refused after it has been
+    received in full.
+    """
+
+    def __init__(self, app, limits: dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    break
+                if content_length > limit:
+                    logger.warning(f"Rejected {content_length} byte upload to {scope['path']}")
+                    response = JSONResponse(
+                        {"detail": f"Request too large (max {limit} bytes)"}, status_code=413
+                    )
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing, turned into a 413 response by FastAPI
+                    raise HTTPException(
+                        status_code=413, detail=f"Request too large (max {limit} bytes)"
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
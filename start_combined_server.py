@@ -18,8 +18,12 @@ from mcp.server.sse import SseServerTransport
 import uvicorn
 
 from papilio_loader_mcp.server import app as mcp_app
-from papilio_loader_mcp.api import api
+from papilio_loader_mcp.api import api, lifespan
 from papilio_loader_mcp.config import get_config
+from papilio_loader_mcp.database import start_metadata_backfill
+from papilio_loader_mcp.metrics import SSE_SESSIONS
+from papilio_loader_mcp.tools.serial_ports import get_port_watcher
+from papilio_loader_mcp.tools.tool_registry import get_tool_registry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,16 +35,20 @@ sse = SseServerTransport("/messages/")
 
 async def handle_sse(request: Request):
     """Handle MCP SSE connections."""
-    async with sse.connect_sse(
-        request.scope,
-        request.receive,
-        request._send,
-    ) as (read_stream, write_stream):
-        await mcp_app.run(
-            read_stream,
-            write_stream,
-            mcp_app.create_initialization_options(),
-        )
+    SSE_SESSIONS.inc(stream="mcp")
+    try:
+        async with sse.connect_sse(
+            request.scope,
+            request.receive,
+            request._send,
+        ) as (read_stream, write_stream):
+            await mcp_app.run(
+                read_stream,
+                write_stream,
+                mcp_app.create_initialization_options(),
+            )
+    finally:
+        SSE_SESSIONS.dec(stream="mcp")
 
 
 # Mount both FastAPI (for web + API) and MCP SSE endpoints
@@ -54,6 +62,7 @@ combined_app = Starlette(
         # Mount the entire FastAPI app for web interface and API
         Mount("/", app=api),
     ],
+    lifespan=lifespan,
 )
 
 
@@ -80,9 +89,13 @@ def run_combined_server(host: str = "0.0.0.0", port: int = 8000):
     logger.info("🔧 REST API:")
     logger.info(f"   Documentation: http://{display_host}:{port}/docs")
     logger.info(f"   Health Check: http://{display_host}:{port}/health")
+    logger.info(f"   Metrics: http://{display_host}:{port}/metrics")
     logger.info(f"   API Key: {'Enabled' if config.api_key else 'Disabled'}")
     logger.info("=" * 70)
     
+    get_port_watcher()
+    get_tool_registry().start()
+    start_metadata_backfill()
     uvicorn.run(combined_app, host=host, port=port, log_level="info")
 
 
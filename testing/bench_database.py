@@ -0,0 +1,109 @@
+"""Benchmark saved-file list, search and insert latency at 100k rows.
+
+Builds a throwaway database with 100k saved-file rows, then times the
+database functions used by the web interface. For comparison it also times
+opening a fresh connection per call, which is what every call used to do.
+
+    python testing/bench_database.py --rows 100000 -n 200
+"""
+
+import argparse
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp import database
+from papilio_loader_mcp.config import get_config
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.median(samples), p95
+
+
+def populate(rows):
+    with database.transaction() as cursor:
+        cursor.executemany(
+            """
+            INSERT INTO saved_files (original_filename, stored_filename, device_type, description, file_size, created_at)
+            VALUES (?, ?, ?, ?, ?, datetime('2025-01-01', ? || ' seconds'))
+            """,
+            (
+                (f"build_{i}.bin", f"{i:064x}.bin", "fpga" if i % 2 else "esp32", f"nightly {i}", 500_000 + i, i)
+                for i in range(rows)
+            ),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    config = get_config()
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        database.init_db()
+
+        start = time.perf_counter()
+        populate(args.rows)
+        print("=" * 70)
+        print(f"Saved-file database: {args.rows} rows (populated in {time.perf_counter() - start:.2f}s)")
+        print("=" * 70)
+
+        conn = database.get_db_connection()
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM saved_files WHERE device_type = ? ORDER BY created_at DESC",
+            ("fpga",),
+        ).fetchall()
+        print("List plan:", "; ".join(row["detail"] for row in plan))
+
+        middle_id = args.rows // 2
+        deep = database.get_saved_file(middle_id)
+        deep_cursor = database.encode_cursor(deep["created_at"], deep["id"])
+        counter = iter(range(10**9))
+        cases = [
+            ("get_saved_file", lambda: database.get_saved_file(middle_id)),
+            ("update_saved_file_name", lambda: database.update_saved_file_name(middle_id, f"renamed_{next(counter)}.bin")),
+            ("add_saved_file", lambda: database.add_saved_file(
+                f"new_{next(counter)}.bin", "new.bin", "fpga", "", 1024)),
+            ("list_saved_files(fpga) page 1", lambda: database.list_saved_files("fpga")),
+            ("list_saved_files deep page", lambda: database.list_saved_files("fpga", cursor=deep_cursor)),
+            ("list_saved_files by name", lambda: database.list_saved_files(sort="original_filename")),
+            ("list_saved_files search", lambda: database.list_saved_files(search="build_4999")),
+            ("get_saved_files(fpga) (everything)", lambda: database.get_saved_files("fpga")),
+        ]
+
+        def fresh_connection_lookup():
+            fresh = sqlite3.connect(database.get_db_path())
+            fresh.row_factory = sqlite3.Row
+            fresh.execute("SELECT * FROM saved_files WHERE id = ?", (middle_id,)).fetchone()
+            fresh.close()
+
+        cases.insert(1, ("  (fresh connection per call)", fresh_connection_lookup))
+
+        print(f"{'operation':<36}{'p50':>12}{'p95':>12}")
+        for name, func in cases:
+            iterations = args.iterations if "everything" not in name else max(5, args.iterations // 20)
+            p50, p95 = timed(func, iterations)
+            print(f"{name:<36}{p50 * 1000:>10.3f}ms{p95 * 1000:>10.3f}ms")
+
+        database.close_db_connection()
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
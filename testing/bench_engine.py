@@ -0,0 +1,78 @@
+"""Benchmark per-operation latency of the subprocess and in-process tool backends.
+
+Runs a command that needs no hardware (``version`` by default) repeatedly on
+each backend. Pass a port to benchmark a real round trip, e.g.:
+
+    python testing/bench_engine.py --port COM4 --command flash_id --tool pesptool
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools.engine import get_backend, shutdown_backends
+
+
+async def bench(backend_name, tool, args, iterations):
+    backend = get_backend(backend_name)
+
+    # First call pays worker start-up for the in-process backend; report it separately
+    start = time.perf_counter()
+    result = await backend.run(tool, args)
+    first = time.perf_counter() - start
+    if result.returncode != 0:
+        print(f"  ✗ {backend_name}: exit code {result.returncode}\n{result.output}")
+        return None
+
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await backend.run(tool, args)
+        samples.append(time.perf_counter() - start)
+    return first, samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tool", default="esptool", choices=["esptool", "pesptool"])
+    parser.add_argument("--port", help="Serial port for a real device round trip")
+    parser.add_argument("--command", default="version", help="Tool subcommand to run")
+    parser.add_argument("-n", "--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    cmd = ["--port", args.port] if args.port else []
+    cmd.append(args.command)
+
+    print("=" * 70)
+    print(f"Tool backend latency: {args.tool} {' '.join(cmd)} x{args.iterations}")
+    print("=" * 70)
+    print(f"{'backend':<12}{'first':>10}{'mean':>10}{'p50':>10}{'p95':>10}{'min':>10}")
+
+    for backend_name in ("subprocess", "inprocess"):
+        try:
+            measured = await bench(backend_name, args.tool, cmd, args.iterations)
+        except FileNotFoundError as e:
+            print(f"{backend_name:<12}skipped: {e}")
+            continue
+        if measured is None:
+            continue
+        first, samples = measured
+        samples.sort()
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(
+            f"{backend_name:<12}{first * 1000:>8.1f}ms{statistics.mean(samples) * 1000:>8.1f}ms"
+            f"{statistics.median(samples) * 1000:>8.1f}ms{p95 * 1000:>8.1f}ms{samples[0] * 1000:>8.1f}ms"
+        )
+
+    shutdown_backends()
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
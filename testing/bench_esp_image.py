@@ -0,0 +1,93 @@
+"""Benchmark ESP32 image parsing on large merged flash images.
+
+Builds merged images like ``esptool merge-bin`` writes them (bootloader at
+0x1000, partition table at 0x8000, app at 0x10000) with apps of growing size
+in four segments,
+then times ``parse_image`` on the file: every segment is XOR-checksummed and
+the appended SHA-256 recomputed, through a memory map. For scale it also
+times header-only type detection, which is all that was checked before.
+
+    python testing/bench_esp_image.py --max-mb 16 -n 10
+"""
+
+import argparse
+import hashlib
+import os
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.esp_image import IMAGE_HEADER, PARTITION_ENTRY, _xor_bytes
+from papilio_loader_mcp.file_detector import detect_binary_type, parse_image
+
+SEGMENT_SIZE = 1024 * 1024
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def build_image(segments: int, data: bytes) -> bytes:
+    """Image of segments copies of data, with checksum and SHA-256."""
+    body = bytearray(IMAGE_HEADER.pack(
+        0xE9, segments, 2, 0x20, 0x40080000, 0xEE, bytes(3), 0, 0, 0, 0xFFFF, bytes(4), 1
+    ))
+    checksum = 0xEF
+    for index in range(segments):
+        body += struct.pack("<II", 0x3F400000 + index * len(data), len(data)) + data
+        checksum ^= _xor_bytes(memoryview(data), 0, len(data))
+    body += bytes(15 - len(body) % 16)
+    body.append(checksum)
+    return bytes(body + hashlib.sha256(body).digest())
+
+
+def build_merged(app_mb: int) -> bytes:
+    """Bootloader at 0x1000, partition table at 0x8000, app of app_mb MB at 0x10000."""
+    merged = bytearray(b"\xff" * 0x10000)
+    bootloader = build_image(1, os.urandom(24 * 1024))
+    merged[0x1000:0x1000 + len(bootloader)] = bootloader
+    table = PARTITION_ENTRY.pack(b"\xaa\x50", 0, 0, 0x10000, (app_mb + 1) * SEGMENT_SIZE, b"factory", 0)
+    merged[0x8000:0x8000 + len(table)] = table
+    return bytes(merged + build_image(4, os.urandom(app_mb * SEGMENT_SIZE // 4)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-mb", type=int, default=16)
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    sizes = [mb for mb in (1, 2, 4, 8, 16, 32, 64) if mb <= args.max_mb]
+    with tempfile.TemporaryDirectory() as tmp:
+        for mb in sizes:
+            path = Path(tmp) / f"merged-{mb}.bin"
+            path.write_bytes(build_merged(mb))
+            report = parse_image(path)
+            assert report["valid"] and report["format"] == "esp32-merged", report["errors"]
+
+            size_mb = path.stat().st_size / 1e6
+            parse = timed(lambda: parse_image(path), args.iterations)
+            detect = timed(lambda: detect_binary_type(path), args.iterations)
+            tracemalloc.start()
+            parse_image(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {size_mb:6.1f} MB merged  parse {parse * 1000:7.2f} ms ({size_mb / parse:6.0f} MB/s, "
+                  f"{peak / 1024:5.0f} KB peak)   header only {detect * 1e6:6.1f} us")
+            path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark firmware validation time and memory for 1 KB to 64 MB files.
+
+Writes ESP32 and Gowin-looking images of each size to a temp directory and
+times ``validate_file_for_device`` on the path, which maps the file and only
+touches its first pages. For comparison it also times reading the whole
+file and validating the bytes, which is what the MCP flash path used to do.
+Peak allocation is measured with tracemalloc.
+
+    python testing/bench_file_detector.py --max-mb 64 -n 20
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.file_detector import validate_file_for_device
+
+HEADERS = {
+    "esp32": b"\xe9\x05\x02\x2f\xf0\x6f\x37\x40" + bytes(24),
+    "fpga": b"\xff" * 22 + b"\xa5\xc3\x06\x00" + bytes(6),
+}
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def peak_bytes(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def write_image(path: Path, device: str, size: int) -> None:
+    with open(path, "wb") as f:
+        f.write(HEADERS[device])
+        # Real content, not a sparse file, so whole-file reads pay for it
+        chunk = bytes(range(256)) * 4096
+        remaining = size - len(HEADERS[device])
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+
+def read_whole(path: Path, device: str) -> dict:
+    with open(path, "rb") as f:
+        return validate_file_for_device(f.read(), device)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-mb", type=int, default=64)
+    parser.add_argument("-n", "--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    sizes = [1024 * 4 ** i for i in range(20) if 1024 * 4 ** i <= args.max_mb * 1024 * 1024]
+    with tempfile.TemporaryDirectory() as tmp:
+        for device in HEADERS:
+            print(f"{device}:")
+            for size in sizes:
+                path = Path(tmp) / f"{device}-{size}.bin"
+                write_image(path, device, size)
+                assert validate_file_for_device(path, device)["detected_type"] == device
+
+                label = f"{size // 1024} KB" if size < 1024 * 1024 else f"{size // (1024 * 1024)} MB"
+                mapped = timed(lambda: validate_file_for_device(path, device), args.iterations)
+                whole = timed(lambda: read_whole(path, device), max(1, args.iterations // 4))
+                mapped_peak = peak_bytes(lambda: validate_file_for_device(path, device))
+                whole_peak = peak_bytes(lambda: read_whole(path, device))
+                print(f"  {label:>7s}  path {mapped * 1e6:8.1f} us {mapped_peak / 1024:8.1f} KB peak   "
+                      f"read() {whole * 1e6:10.1f} us {whole_peak / 1024:10.1f} KB peak")
+                path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark Gowin bitstream checking on full-size bitstreams.
+
+Builds bitstreams of about --mb MB with the frame length of the bundled
+GW2A-18 sample (422 data bytes) and with the longer frames of larger parts,
+and times ``parse_image`` on the file: header commands walked, every frame CRC
+checked, footer found, through a memory map. The first run includes building
+the CRC masks; later runs reuse them. A copy with one flipped bit shows the
+cost of finding the damaged frame.
+
+    python testing/bench_gowin_bitstream.py --mb 4 -n 10
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.gowin_bitstream import FRAME_TRAILER, _crc_masks, crc16
+from papilio_loader_mcp.file_detector import parse_image
+
+SAMPLE = Path(__file__).parent / "fpga_gateware_hdmi_test.bin"
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def build_bitstream(size: int, data_length: int) -> bytes:
+    """GW2A-18 style header, then random frames of data_length bytes up to about size bytes."""
+    header = bytes.fromhex("060000000000081b 1000000000000000 5100ffffffffffff 0b000000")
+    count = size // (data_length + 8)
+    frame_command = (0x3B800000 | count).to_bytes(4, "big")
+    body = bytearray(b"\xff" * 22 + b"\xa5\xc3" + header + bytes.fromhex("d200ffff00000000") + frame_command)
+    prefix = header + frame_command
+    for _ in range(count):
+        data = os.urandom(data_length)
+        body += data + crc16(data, crc16(prefix)).to_bytes(2, "little") + FRAME_TRAILER
+        prefix = FRAME_TRAILER
+    dummy = b"\xff" * 18
+    body += dummy + crc16(FRAME_TRAILER + dummy).to_bytes(2, "little")
+    body += bytes.fromhex("0a00000000001234 ffffffffffffffff 08000000")
+    return bytes(body)
+
+
+def report(label: str, path: Path, iterations: int) -> None:
+    _crc_masks.cache_clear()
+    start = time.perf_counter()
+    result = parse_image(path)
+    cold = time.perf_counter() - start
+    assert result["format"] == "gowin-bitstream" and result["valid"], result["errors"]
+    warm = timed(lambda: parse_image(path), iterations)
+    tracemalloc.start()
+    parse_image(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    damaged = path.with_name(f"damaged-{path.name}")
+    data = bytearray(path.read_bytes())
+    data[len(data) // 2] ^= 0x01
+    damaged.write_bytes(data)
+    assert len(parse_image(damaged)["bad_frames"]) == 1
+    locate = timed(lambda: parse_image(damaged), max(1, iterations // 2))
+    damaged.unlink()
+
+    size_mb = path.stat().st_size / 1e6
+    print(f"  {label:24s} {size_mb:5.2f} MB, {result['frames_checked']:5d} frames   "
+          f"first {cold * 1000:6.2f} ms   warm {warm * 1000:6.2f} ms ({size_mb / warm:6.0f} MB/s, "
+          f"{peak / 1024:4.0f} KB peak)   one bad frame {locate * 1000:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, default=4)
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    report("sample (GW2A-18)", SAMPLE, args.iterations)
+    with tempfile.TemporaryDirectory() as tmp:
+        for data_length in (422, 1024, 2048):
+            path = Path(tmp) / f"bitstream-{data_length}.bin"
+            path.write_bytes(build_bitstream(args.mb * 1024 * 1024, data_length))
+            report(f"{data_length}-byte frames", path, args.iterations)
+            path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark esptool output parsing on a large captured log.
+
+Builds a synthetic multi-partition flash log (a few header lines, then
+thousands of redrawn progress lines per partition, like a real capture of
+esptool writing to a pipe) and times ``parse_output`` on it. For comparison
+it also times trying every pattern on every line, which is what the prefix
+dispatch avoids.
+
+    python testing/bench_output_parser.py --partitions 200 -n 5
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools import output_parser
+from papilio_loader_mcp.tools.output_parser import parse_output
+
+HEADER = """esptool v5.1.0
+Connected to ESP32-S3 on COM4:
+Chip type:          ESP32-S3 (QFN56) (revision v0.2)
+Features:           Wi-Fi, BT 5 (LE), Dual Core + LP Core, 240MHz
+Crystal frequency:  40MHz
+MAC:                24:0a:c4:12:34:56
+"""
+
+ALL_PATTERNS = [
+    value for name, value in vars(output_parser).items()
+    if name.endswith("_RE") and hasattr(value, "match")
+]
+
+
+def build_log(partitions: int, progress_lines: int) -> str:
+    parts = [HEADER]
+    for index in range(partitions):
+        address = 0x10000 + index * 0x100000
+        parts.append("Compressed 1048576 bytes to 524288...\n")
+        for step in range(progress_lines):
+            percent = step * 100 / progress_lines
+            parts.append(
+                f"Writing at 0x{address + step * 4096:08x} [{'=' * (step % 30):<30}] "
+                f"{percent:5.1f}% {step * 4096}/524288 bytes...\n"
+            )
+        parts.append(
+            f"Wrote 1048576 bytes (524288 compressed) at 0x{address:08x} in 12.3 seconds (682.0 kbit/s).\n"
+            "Hash of data verified.\n"
+        )
+    parts.append("Hard resetting via RTS pin...\n")
+    return "".join(parts)
+
+
+def every_pattern(text: str) -> int:
+    hits = 0
+    for line in text.splitlines():
+        line = line.strip()
+        for pattern in ALL_PATTERNS:
+            if pattern.match(line):
+                hits += 1
+    return hits
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--partitions", type=int, default=200)
+    parser.add_argument("--progress-lines", type=int, default=128)
+    parser.add_argument("-n", "--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    log = build_log(args.partitions, args.progress_lines)
+    size_mb = len(log) / 1e6
+    lines = log.count("\n")
+    report = parse_output(log)
+    assert report.bytes_written == args.partitions * 1048576 and report.hash_verified
+
+    print(f"Log: {size_mb:.1f} MB, {lines:,} lines")
+    for label, func in (
+        ("parse_output (prefix dispatch)", lambda: parse_output(log)),
+        ("every pattern on every line", lambda: every_pattern(log)),
+    ):
+        seconds = timed(func, args.iterations)
+        print(f"  {label:32s} {seconds * 1000:8.1f} ms  {size_mb / seconds:7.1f} MB/s  "
+              f"{lines / seconds / 1e6:5.2f} M lines/s")
+
+
+if __name__ == "__main__":
+    main()
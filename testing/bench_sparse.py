@@ -0,0 +1,98 @@
+"""Benchmark the sparse-flash scan on the bundled binaries and padded layouts.
+
+Scans each image for runs of erased (0xFF) 4 KB sectors with ``erased_runs``
+and reports how many bytes sparse flashing would leave out of the write. The
+bundled samples are flashed as they are; the padded layouts place them the
+way they end up on a board: the FPGA bitstream padded to a 2 MB slot, a
+merged ESP32 image (bootloader at 0x1000, partition table at 0x8000, app at
+0x10000), and a full 4 MB flash image with the app at 0x10000 and the
+bitstream at 0x100000. esptool deflates what it sends, so the bytes still
+sent after deflate are shown as well: the padding costs little on the wire,
+but every byte written is still programmed on the chip.
+
+    python testing/bench_sparse.py -n 10
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools.differential import data_extents, erased_runs
+
+TEST_DIR = Path(__file__).parent
+ESP_SAMPLE = TEST_DIR / "esp32_firmware_hdmi_test.bin"
+FPGA_SAMPLE = TEST_DIR / "fpga_gateware_hdmi_test.bin"
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def place(size: int, images: dict[int, bytes]) -> bytes:
+    """Erased flash of size bytes with each image written at its offset."""
+    flash = bytearray(b"\xff" * size)
+    for offset, image in images.items():
+        flash[offset:offset + len(image)] = image
+    return bytes(flash)
+
+
+def layouts() -> dict[str, bytes]:
+    esp, fpga = ESP_SAMPLE.read_bytes(), FPGA_SAMPLE.read_bytes()
+    # Any data stands in for the bootloader and partition table; only where it sits matters
+    bootloader, table = esp[:24 * 1024], esp[:0x60]
+    return {
+        "esp32 sample": esp,
+        "fpga sample": fpga,
+        "fpga in 2 MB slot": place(2 * 1024 * 1024, {0: fpga}),
+        "esp32 merged": place(0x10000, {0x1000: bootloader, 0x8000: table}) + esp,
+        "4 MB flash image": place(4 * 1024 * 1024, {
+            0x1000: bootloader, 0x8000: table, 0x10000: esp, 0x100000: fpga,
+        }),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    parser.add_argument("--min-run", type=int, default=16 * 1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, data in layouts().items():
+            path = Path(tmp) / "image.bin"
+            path.write_bytes(data)
+            runs = erased_runs(path, args.min_run)
+            extents = data_extents(runs, len(data))
+            written = sum(length for _, length in extents)
+            scan = timed(lambda: erased_runs(path, args.min_run), args.iterations)
+            tracemalloc.start()
+            erased_runs(path, args.min_run)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            deflated_full = len(zlib.compress(data, 9))
+            deflated_sparse = sum(len(zlib.compress(data[o:o + n], 9)) for o, n in extents)
+            print(f"  {label:18s} {len(data) / 1e6:5.2f} MB   scan {scan * 1000:6.3f} ms "
+                  f"({len(data) / 1e6 / scan:5.0f} MB/s, {peak / 1024:3.0f} KB peak)   "
+                  f"{len(extents)} extents, {len(runs)} erased   "
+                  f"written {written / 1e6:5.2f} MB, saved {(len(data) - written) / 1e6:5.2f} MB "
+                  f"({(len(data) - written) / len(data):4.0%})   "
+                  f"deflated {deflated_full / 1e3:5.0f} -> {deflated_sparse / 1e3:5.0f} KB")
+            path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Test baud-rate fallback for flashing with a fake esptool."""
+
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.config import get_config
+from papilio_loader_mcp.tools import device_registry
+from papilio_loader_mcp.tools.baud import baud_ladder, flash_with_baud_fallback
+from papilio_loader_mcp.tools.device_registry import DeviceRegistry
+from papilio_loader_mcp.tools.tool_registry import get_tool_registry
+
+# Behaves like esptool on an adapter that cannot hold rates above {limit}
+FAKE_TOOL = """#!{python}
+import sys
+args = sys.argv[1:]
+baud = int(args[args.index("--baud") + 1])
+print("Connecting....")
+if {no_board}:
+    print("A fatal error occurred: Failed to connect to ESP32: No serial data received.")
+    sys.exit(2)
+print(f"Changing baud rate to {{baud}}")
+if baud > {limit}:
+    print("A fatal error occurred: Invalid head of packet (0x00)")
+    sys.exit(2)
+print("Changed.")
+print("Wrote 65536 bytes (12000 compressed) at 0x00010000 in 1.0 seconds (524.3 kbit/s).")
+print("Hash of data verified.")
+"""
+
+PORTS = [{"device": "/dev/ttyFAKE", "serial_number": "CABLE1", "hwid": "USB VID:PID=10C4:EA60"}]
+
+
+def test_baud_ladder():
+    """Ladder starts at the requested rate and ends at the floor."""
+    assert baud_ladder(2000000, 115200) == [2000000, 1500000, 921600, 460800, 230400, 115200]
+    assert baud_ladder(1000000, 115200) == [1000000, 921600, 460800, 230400, 115200]
+    assert baud_ladder(921600, 230400) == [921600, 460800, 230400]
+    assert baud_ladder(115200, 115200) == [115200]
+    assert baud_ladder(0, 115200) == [115200]
+    print("✓ Baud ladder")
+
+
+def _run(tmp: Path, limit: int, no_board: bool = False, registry: DeviceRegistry | None = None):
+    tool = tmp / "fake-esptool"
+    tool.write_text(FAKE_TOOL.format(python=sys.executable, limit=limit, no_board=no_board))
+    tool.chmod(0o755)
+    lines = []
+    original_registry = device_registry._registry
+    get_tool_registry().set_path("esptool", tool)
+    device_registry._registry = registry or DeviceRegistry(ttl=60, ports=lambda: PORTS)
+    try:
+        result, negotiation = asyncio.run(flash_with_baud_fallback(
+            "esptool", "/dev/ttyFAKE", ["--port", "/dev/ttyFAKE", "write-flash", "0x10000", "app.bin"],
+            lines.append, timeout=30,
+        ))
+        return result, negotiation, device_registry._registry, lines
+    finally:
+        get_tool_registry().forget("esptool")
+        device_registry._registry = original_registry
+
+
+def test_step_down_and_remember():
+    """A failing rate steps down, and the rate that worked is used next time."""
+    if sys.platform == "win32":
+        print("- Skipped: the fake tool is a POSIX script")
+        return
+    config = get_config()
+    original = config.flash_baud_rate, config.default_baud_rate
+    config.flash_baud_rate, config.default_baud_rate = 2000000, 115200
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            result, negotiation, registry, lines = _run(Path(tmp), limit=460800)
+            assert result.returncode == 0
+            assert [a.baud for a in negotiation.attempts] == [2000000, 1500000, 921600, 460800]
+            assert [a.success for a in negotiation.attempts] == [False, False, False, True]
+            assert negotiation.baud == 460800 and negotiation.kbit_per_s == 524.3
+            assert "Flash failed at 2000000 baud, retrying at 1500000 baud" in lines
+            assert registry.baud_rate("/dev/ttyFAKE", 2000000) == 460800
+            assert registry.stats()["baud_rates"] == {"serial:CABLE1": 460800}
+
+            # Same adapter again: starts at the remembered rate
+            _, again, _, _ = _run(Path(tmp), limit=460800, registry=registry)
+            assert [a.baud for a in again.attempts] == [460800]
+    finally:
+        config.flash_baud_rate, config.default_baud_rate = original
+    print(f"✓ Stepped down to {negotiation.baud} baud: {negotiation.to_dict()['attempts']}")
+
+
+def test_high_speed_is_opt_in():
+    """Without PAPILIO_FLASH_BAUD_RATE a flash runs at the default rate only."""
+    if sys.platform == "win32":
+        print("- Skipped: the fake tool is a POSIX script")
+        return
+    config = get_config()
+    original = config.flash_baud_rate
+    config.flash_baud_rate = None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            result, negotiation, _, _ = _run(Path(tmp), limit=115200)
+    finally:
+        config.flash_baud_rate = original
+    assert result.returncode == 0
+    assert [a.baud for a in negotiation.attempts] == [config.default_baud_rate]
+    print(f"✓ Default flash at {negotiation.baud} baud, one attempt")
+
+
+def test_no_retry_without_board():
+    """A failure before the baud switch is not retried at lower rates."""
+    if sys.platform == "win32":
+        print("- Skipped: the fake tool is a POSIX script")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        result, negotiation, registry, _ = _run(Path(tmp), limit=0, no_board=True)
+    assert result.returncode == 2
+    assert len(negotiation.attempts) == 1 and not negotiation.attempts[0].switched
+    assert registry.baud_rate("/dev/ttyFAKE", 115200) is None
+    print("✓ No retry when the board never answered")
+
+
+def test_step_down_is_not_permanent():
+    """A stepped-down rate only applies to its configured rate and is dropped after clean flashes or a while."""
+    registry = DeviceRegistry(ttl=60, ports=lambda: PORTS)
+
+    # Flashes that never stepped down leave nothing behind
+    registry.limit_baud_rate("/dev/ttyFAKE", 115200, 115200)
+    registry.baud_rate_held("/dev/ttyFAKE", 115200)
+    assert registry.baud_rate("/dev/ttyFAKE", 115200) is None
+
+    registry.limit_baud_rate("/dev/ttyFAKE", 921600, 2000000)
+    assert registry.baud_rate("/dev/ttyFAKE", 2000000) == 921600
+    for _ in range(device_registry.BAUD_LIMIT_CLEAN_FLASHES - 1):
+        registry.baud_rate_held("/dev/ttyFAKE", 921600)
+    assert registry.baud_rate("/dev/ttyFAKE", 2000000) == 921600
+    registry.baud_rate_held("/dev/ttyFAKE", 921600)
+    assert registry.baud_rate("/dev/ttyFAKE", 2000000) is None
+
+    # Learned under 2M; a different configured rate starts from scratch
+    registry.limit_baud_rate("/dev/ttyFAKE", 921600, 2000000)
+    assert registry.baud_rate("/dev/ttyFAKE", 1500000) is None
+    assert registry.baud_rate("/dev/ttyFAKE", 2000000) is None
+
+    registry.limit_baud_rate("/dev/ttyFAKE", 921600, 2000000)
+    registry._baud_limits["serial:CABLE1"].learned_at -= device_registry.BAUD_LIMIT_TTL + 1
+    assert registry.baud_rate("/dev/ttyFAKE", 2000000) is None
+    print("✓ Step-downs expire and step back up")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Baud Fallback Test")
+    print("=" * 60)
+    test_baud_ladder()
+    test_step_down_and_remember()
+    test_high_speed_is_opt_in()
+    test_no_retry_without_board()
+    test_step_down_is_not_permanent()
+    print("=" * 60)
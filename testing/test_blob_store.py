@@ -0,0 +1,256 @@
+"""Test the content-addressed saved file store."""
+
+import hashlib
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp import database
+from papilio_loader_mcp.config import get_config
+from papilio_loader_mcp.file_detector import image_metadata
+
+TEST_DIR = Path(__file__).parent
+
+
+def test_duplicates_share_one_blob():
+    """Saving the same content twice stores it once; the blob outlives all but the last delete."""
+    config = get_config()
+    original_dir = config.user_data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        try:
+            database.init_db()
+            saved_dir = database.get_saved_files_dir()
+            content = b"\xe9" + bytes(range(255)) * 10
+            sha256 = hashlib.sha256(content).hexdigest()
+
+            ids = []
+            for name in ("a.bin", "b.bin"):
+                upload = saved_dir / f".upload-{name}"
+                upload.write_bytes(content)
+                file_id, deduplicated = database.save_file_by_hash(
+                    upload, sha256, len(content), name, "esp32", ""
+                )
+                ids.append(file_id)
+                assert deduplicated == (name == "b.bin")
+                assert not upload.exists()
+            ids.append(database.add_saved_file_reference(sha256, "c.bin", "esp32", ""))
+            assert database.add_saved_file_reference("0" * 64, "d.bin", "esp32", "") is None
+
+            assert [p.name for p in saved_dir.iterdir()] == [f"{sha256}.bin"]
+            assert database.get_blob(sha256)["ref_count"] == 3
+
+            blob_path = database.get_saved_file_path(ids[0])
+            for file_id in ids[:-1]:
+                assert database.delete_saved_file(file_id)
+                assert blob_path.exists()
+            assert database.delete_saved_file(ids[-1])
+            assert not blob_path.exists()
+            assert database.get_blob(sha256) is None
+        finally:
+            database.close_db_connection()
+            config.user_data_dir = original_dir
+    print("✓ 3 saved files, 1 blob, removed with the last reference")
+
+
+def test_failed_save_leaves_no_blob():
+    """A save that rolls back moves the upload back instead of leaving an orphan blob."""
+    config = get_config()
+    original_dir = config.user_data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        try:
+            database.init_db()
+            saved_dir = database.get_saved_files_dir()
+            content = b"\xe9" + bytes(100)
+            upload = saved_dir / ".upload-a.bin"
+            upload.write_bytes(content)
+            try:
+                # device_type is NOT NULL, so the saved_files insert fails after the blob's
+                database.save_file_by_hash(
+                    upload, hashlib.sha256(content).hexdigest(), len(content), "a.bin", None, ""
+                )
+                raise AssertionError("save should have failed")
+            except sqlite3.IntegrityError:
+                pass
+            assert upload.read_bytes() == content
+            assert [p.name for p in saved_dir.iterdir()] == [upload.name]
+            assert database.get_blob(hashlib.sha256(content).hexdigest()) is None
+        finally:
+            database.close_db_connection()
+            config.user_data_dir = original_dir
+    print("✓ Failed save rolled back, upload kept, no orphan blob")
+
+
+def test_failed_delete_keeps_blob():
+    """A delete that rolls back puts the blob's file back where its row expects it."""
+    config = get_config()
+    original_dir = config.user_data_dir
+    original_transaction = database.transaction
+
+    @contextmanager
+    def failing_commit():
+        with original_transaction() as cursor:
+            yield cursor
+            raise sqlite3.OperationalError("database is locked")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        try:
+            database.init_db()
+            saved_dir = database.get_saved_files_dir()
+            content = b"\xe9" + bytes(100)
+            upload = saved_dir / ".upload-a.bin"
+            upload.write_bytes(content)
+            file_id, _ = database.save_file_by_hash(
+                upload, hashlib.sha256(content).hexdigest(), len(content), "a.bin", "esp32", ""
+            )
+            database.transaction = failing_commit
+            try:
+                database.delete_saved_file(file_id)
+                raise AssertionError("delete should have failed")
+            except sqlite3.OperationalError:
+                pass
+            finally:
+                database.transaction = original_transaction
+            assert database.get_saved_file_path(file_id).read_bytes() == content
+            assert [p.name for p in saved_dir.iterdir()] == [database.get_saved_file(file_id)["stored_filename"]]
+
+            assert database.delete_saved_file(file_id)
+            assert list(saved_dir.iterdir()) == []
+        finally:
+            database.close_db_connection()
+            config.user_data_dir = original_dir
+    print("✓ Failed delete rolled back, blob file kept")
+
+
+def test_connection_setup():
+    """Connections are reused per thread, in WAL mode, and listing uses the index."""
+    config = get_config()
+    original_dir = config.user_data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        try:
+            database.init_db()
+            conn = database.get_db_connection()
+            assert database.get_db_connection() is conn
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            plan = " ".join(row["detail"] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM saved_files WHERE device_type = ? ORDER BY created_at DESC",
+                ("fpga",),
+            ))
+            assert "idx_saved_files_device_created" in plan and "TEMP B-TREE" not in plan, plan
+        finally:
+            database.close_db_connection()
+            config.user_data_dir = original_dir
+    print(f"✓ WAL connection reused; plan: {plan}")
+
+
+def test_keyset_pages_and_search():
+    """Pages never overlap or skip rows, and search matches word prefixes."""
+    config = get_config()
+    original_dir = config.user_data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        try:
+            database.init_db()
+            for i in range(25):
+                database.add_saved_file(
+                    f"gateware_{i:02d}.bin", "x.bin", "fpga" if i % 2 else "esp32",
+                    "hdmi nightly" if i % 5 == 0 else "", 1000 + i % 3,
+                )
+            version = database.get_saved_files_version()
+
+            seen, cursor = [], None
+            while True:
+                page = database.list_saved_files(sort="file_size", limit=4, cursor=cursor)
+                seen += [(f["file_size"], f["id"]) for f in page["files"]]
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            assert seen == sorted(seen, reverse=True) and len(set(seen)) == 25, seen
+
+            found = database.list_saved_files(search="hdm night")["files"]
+            assert sorted(f["id"] for f in found) == [1, 6, 11, 16, 21]
+            assert database.list_saved_files(device_type="fpga", search="gateware_03")["files"][0]["id"] == 4
+
+            assert database.get_saved_files_version() == version
+            database.update_saved_file_description(2, "renamed")
+            assert database.get_saved_files_version() > version
+            assert database.list_saved_files(search="renamed")["files"][0]["id"] == 2
+        finally:
+            database.close_db_connection()
+            config.user_data_dir = original_dir
+    print(f"✓ {len(seen)} rows over {len(seen) // 4 + 1} pages, search found {len(found)}")
+
+
+def test_image_metadata_filters():
+    """Image metadata is stored per blob, filterable, indexed, and backfilled for old blobs."""
+    config = get_config()
+    original_dir = config.user_data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        try:
+            database.init_db()
+            saved_dir = database.get_saved_files_dir()
+            ids = {}
+            for sample in ("esp32_firmware_hdmi_test.bin", "fpga_gateware_hdmi_test.bin"):
+                content = (TEST_DIR / sample).read_bytes()
+                upload = saved_dir / f".upload-{sample}"
+                upload.write_bytes(content)
+                ids[sample], _ = database.save_file_by_hash(
+                    upload, hashlib.sha256(content).hexdigest(), len(content), sample,
+                    "esp32" if sample.startswith("esp32") else "fpga", "",
+                    metadata=image_metadata(upload),
+                )
+            esp_id, fpga_id = ids.values()
+
+            esp = database.get_saved_file(esp_id)
+            assert esp["chip"] == "ESP32-S3" and esp["detected_type"] == "esp32" and esp["image_valid"] == 1
+            assert esp["project_name"] == "arduino-lib-builder" and esp["build_date"] == "2024-03-05"
+            assert esp["idf_version"] == "v4.4.7-dirty"
+
+            def found(**filters):
+                return [f["id"] for f in database.list_saved_files(**filters)["files"]]
+
+            assert found(chip="esp32-s3", app_version=esp["app_version"]) == [esp_id]
+            assert found(fpga_idcode="0x0000081b") == [fpga_id]
+            assert found(chip="GW2A(R)-18(C)", detected_type="fpga") == [fpga_id]
+            assert found(built_after="2024-03-01", built_before="2024-03-31") == [esp_id]
+            assert found(built_after="2024-04-01") == []
+            assert found(sha256=esp["sha256"]) == [esp_id]
+
+            plan = " ".join(row["detail"] for row in database.get_db_connection().execute(
+                "EXPLAIN QUERY PLAN SELECT sha256 FROM blobs WHERE chip = ? AND app_version = ?",
+                ("ESP32-S3", "1.0"),
+            ))
+            assert "idx_blobs_chip_app_version" in plan, plan
+
+            # Blobs saved before metadata was extracted are filled in on startup
+            database.get_db_connection().execute("UPDATE blobs SET detected_type = NULL, chip = NULL")
+            assert found(chip="ESP32-S3") == []
+            assert database.backfill_image_metadata() == 2
+            assert found(chip="ESP32-S3") == [esp_id]
+            assert database.backfill_image_metadata() == 0
+        finally:
+            database.close_db_connection()
+            config.user_data_dir = original_dir
+    print(f"✓ Filtered by chip, app version, IDCODE and build date; plan: {plan}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Saved File Store Test")
+    print("=" * 60)
+    test_duplicates_share_one_blob()
+    test_failed_save_leaves_no_blob()
+    test_failed_delete_keeps_blob()
+    test_connection_setup()
+    test_keyset_pages_and_search()
+    test_image_metadata_filters()
+    print("=" * 60)
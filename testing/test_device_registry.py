@@ -0,0 +1,96 @@
+"""Test the device identity cache without hardware."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools.device_registry import DeviceRegistry, port_identity
+from papilio_loader_mcp.tools.results import ToolResult
+
+
+def _port(device, serial="A1B2", hwid="USB VID:PID=303A:1001"):
+    return {"device": device, "serial_number": serial, "hwid": hwid}
+
+
+class FakeProbe:
+    """Counts how often the device is actually queried."""
+
+    def __init__(self, status="Connected"):
+        self.calls = 0
+        self.status = status
+
+    async def __call__(self):
+        self.calls += 1
+        return ToolResult({"device_type": "esp32", "status": self.status, "device": {"chip": "ESP32-S3"}})
+
+
+def test_port_identity():
+    """Serial number first, then hwid; no identity for plain UARTs."""
+    assert port_identity(_port("COM4")) == "serial:A1B2"
+    assert port_identity(_port("COM4", serial=None)) == "hwid:USB VID:PID=303A:1001"
+    assert port_identity({"device": "/dev/ttyS0", "serial_number": None, "hwid": "n/a"}) is None
+    print("✓ Port identities")
+
+
+def test_hits_and_ttl():
+    """The second query is served from memory until the TTL runs out."""
+    ports = [_port("COM4")]
+    registry = DeviceRegistry(ttl=0.2, ports=lambda: ports)
+    probe = FakeProbe()
+
+    async def run():
+        first = await registry.query("info", "COM4", "esp32", probe)
+        start = time.perf_counter()
+        second = await registry.query("info", "COM4", "esp32", probe)
+        hit_seconds = time.perf_counter() - start
+        other_type = await registry.query("info", "COM4", "fpga", probe)
+        refreshed = await registry.query("info", "COM4", "esp32", probe, refresh=True)
+        await asyncio.sleep(0.25)
+        expired = await registry.query("info", "COM4", "esp32", probe)
+        return first, second, hit_seconds, other_type, refreshed, expired
+
+    first, second, hit_seconds, other_type, refreshed, expired = asyncio.run(run())
+    assert "cached" not in first and second["cached"] is True
+    assert second["device"] == {"chip": "ESP32-S3"}
+    assert "cached" not in other_type and "cached" not in refreshed and "cached" not in expired
+    assert probe.calls == 4, probe.calls
+    assert registry.stats()["hits"] == 1
+    print(f"✓ Cache hit in {hit_seconds * 1e6:.0f} µs, {probe.calls} probes")
+
+
+def test_invalidation():
+    """Unplugging the board, a failed probe, or an unidentifiable port all bypass the cache."""
+    ports = [_port("COM4"), {"device": "COM1", "serial_number": None, "hwid": "n/a"}]
+    registry = DeviceRegistry(ttl=60, ports=lambda: ports)
+    probe = FakeProbe()
+
+    async def run():
+        await registry.query("info", "COM4", "esp32", probe)
+        registry.on_ports_changed([], [_port("COM4")])
+        await registry.query("info", "COM4", "esp32", probe)
+        probe.status = "Error"
+        await registry.query("info", "COM4", "esp32", probe, refresh=True)
+        probe.status = "Connected"
+        await registry.query("info", "COM4", "esp32", probe)
+        for _ in range(2):
+            await registry.query("info", "COM1", "esp32", probe)
+            await registry.query("info", "AUTO", "esp32", probe)
+
+    asyncio.run(run())
+    assert probe.calls == 8, probe.calls
+    assert registry.stats()["invalidations"] == 2
+    print(f"✓ Invalidation: {registry.stats()}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Device Registry Test")
+    print("=" * 60)
+    test_port_identity()
+    test_hits_and_ttl()
+    test_invalidation()
+    print("=" * 60)
@@ -0,0 +1,143 @@
+"""Test block comparison for differential flashing without hardware."""
+
+import asyncio
+import hashlib
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools.differential import (
+    DiffPlan,
+    SparsePlan,
+    changed_extents,
+    cleanup,
+    data_extents,
+    erased_runs,
+    local_block_md5s,
+    plan_sparse_write,
+    write_extent_files,
+)
+
+BLOCK = 4096
+TEST_DIR = Path(__file__).parent
+
+
+def test_changed_extents():
+    """Adjacent changed blocks merge; the short last block keeps its length."""
+    size = 5 * BLOCK + 100
+    local = ["a", "b", "c", "d", "e", "f"]
+    device = ["a", "X", "X", "d", "X", "X"]
+    extents = changed_extents(local, device, BLOCK, size)
+    assert extents == [(BLOCK, 2 * BLOCK), (4 * BLOCK, BLOCK + 100)], extents
+    assert changed_extents(local, local, BLOCK, size) == []
+    print(f"✓ Extents: {extents}")
+
+
+def test_extent_files_match_image():
+    """Extent temp files hold exactly the changed bytes at the right addresses."""
+    image = bytes(range(256)) * 80  # 20480 bytes, 5 blocks
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "image.bin"
+        path.write_bytes(image)
+
+        local = local_block_md5s(path, BLOCK)
+        assert local[0] == hashlib.md5(image[:BLOCK]).hexdigest()
+        assert len(local) == 5
+
+        device = list(local)
+        device[3] = "0" * 32
+        plan = DiffPlan(
+            address=0x100000,
+            size=len(image),
+            block_size=BLOCK,
+            extents=changed_extents(local, device, BLOCK, len(image)),
+            blocks_total=5,
+            blocks_changed=1,
+            hash_seconds=0.0,
+        )
+        pairs = write_extent_files(plan, path, Path(tmp))
+        try:
+            assert [addr for addr, _ in pairs] == [hex(0x100000 + 3 * BLOCK)]
+            assert Path(pairs[0][1]).read_bytes() == image[3 * BLOCK:4 * BLOCK]
+            assert plan.bytes_skipped == 4 * BLOCK
+        finally:
+            cleanup(plan)
+        assert not Path(pairs[0][1]).exists()
+    print(f"✓ Wrote {plan.bytes_written} bytes, skipped {plan.bytes_skipped}")
+
+
+def test_erased_runs():
+    """Only whole 0xFF sectors count, across chunk boundaries and a short last sector."""
+    image = bytearray(b"\xff" * (40 * BLOCK + 100))
+    image[0:10] = b"data......"  # sector 0
+    image[5 * BLOCK + 4095] = 0  # sector 5, last byte
+    image[17 * BLOCK] = 0xFE  # sector 17, straddles no chunk but ends a run
+    image[30 * BLOCK:31 * BLOCK] = bytes(BLOCK)  # sector 30
+    runs = erased_runs(bytes(image))
+    assert runs == [(BLOCK, 4 * BLOCK), (6 * BLOCK, 11 * BLOCK), (18 * BLOCK, 12 * BLOCK),
+                    (31 * BLOCK, 10 * BLOCK)], runs
+    extents = data_extents(runs, len(image))
+    assert extents == [(0, BLOCK), (5 * BLOCK, BLOCK), (17 * BLOCK, BLOCK), (30 * BLOCK, BLOCK)]
+
+    # Runs shorter than the minimum are written with their neighbours
+    assert erased_runs(bytes(image), 8 * BLOCK) == runs[1:]
+    image[-1] = 0
+    assert erased_runs(bytes(image))[-1] == (31 * BLOCK, 9 * BLOCK)
+    assert data_extents([], 100) == [(0, 100)]
+    assert erased_runs(b"\xff" * 100) == [(0, BLOCK)] and data_extents([(0, BLOCK)], 100) == []
+
+    # The bundled samples have no padding to skip
+    for sample in ("esp32_firmware_hdmi_test.bin", "fpga_gateware_hdmi_test.bin"):
+        assert erased_runs(TEST_DIR / sample) == []
+    print(f"✓ Erased runs: {runs}")
+
+
+def test_sparse_plan_extents():
+    """A padded image writes only its data; the plan falls back when it saves nothing."""
+    gateware = (TEST_DIR / "fpga_gateware_hdmi_test.bin").read_bytes()
+    padded = gateware + b"\xff" * (2 * 1024 * 1024 - len(gateware))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "padded.bin"
+        path.write_bytes(padded)
+        runs = erased_runs(path)
+        plan = SparsePlan(
+            address=0x100000, size=len(padded), extents=data_extents(runs, len(padded)),
+            erased=runs, scan_seconds=0.0,
+        )
+        pairs = write_extent_files(plan, path, Path(tmp))
+        try:
+            # Written up to the end of the last sector holding gateware
+            data_end = -(-len(gateware) // BLOCK) * BLOCK
+            assert [addr for addr, _ in pairs] == ["0x100000"]
+            assert Path(pairs[0][1]).read_bytes() == padded[:data_end]
+            assert plan.bytes_skipped == len(padded) - data_end
+            assert plan.to_dict()["erased_regions"] == 1
+        finally:
+            cleanup(plan)
+
+        # No port is opened: nothing to skip, or no port to erase on
+        sample = TEST_DIR / "fpga_gateware_hdmi_test.bin"
+        assert asyncio.run(plan_sparse_write("pesptool", "COM99", sample, "0x100000")) == (
+            None, "no run of 0xFF of 16384 bytes or more"
+        )
+        assert asyncio.run(plan_sparse_write("pesptool", "AUTO", path, "0x100000")) == (
+            None, "sparse mode needs an explicit port"
+        )
+        assert asyncio.run(plan_sparse_write("pesptool", "COM99", path, "0x100800"))[1] == (
+            "address 0x100800 is not 4 KB aligned"
+        )
+    print(f"✓ Sparse: wrote {plan.bytes_written} bytes, skipped {plan.bytes_skipped}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Differential Flash Test")
+    print("=" * 60)
+    test_changed_extents()
+    test_extent_files_match_image()
+    test_erased_runs()
+    test_sparse_plan_extents()
+    print("=" * 60)
@@ -0,0 +1,141 @@
+"""Test ESP32 image parsing: structure, checksums, app description, merged images."""
+
+import asyncio
+import hashlib
+import struct
+import sys
+import tempfile
+from functools import reduce
+from operator import xor
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.esp_image import APP_DESC, IMAGE_HEADER, PARTITION_ENTRY, parse_esp_firmware
+from papilio_loader_mcp.file_detector import detect_binary_type, parse_image, validate_file_for_device
+from papilio_loader_mcp.tools.esp_flash import flash_esp_device, flash_esp_multi_partition
+
+TEST_DIR = Path(__file__).parent
+SAMPLE = TEST_DIR / "esp32_firmware_hdmi_test.bin"
+
+
+def build_image(segments: list[tuple[int, bytes]], chip_id: int = 0, project: str | None = None) -> bytes:
+    """ESP32 image laid out like esptool writes it, with checksum and SHA-256."""
+    if project is not None:
+        desc = APP_DESC.pack(0xABCD5432, 0, bytes(8), b"1.2.3", project.encode(), b"10:00:00",
+                             b"Jan  2 2025", b"v5.3.1", bytes(32))
+        address, data = segments[0]
+        segments = [(address, desc + data)] + segments[1:]
+    body = bytearray(IMAGE_HEADER.pack(
+        0xE9, len(segments), 2, 0x20, 0x40080000, 0xEE, bytes(3), chip_id, 0, 0, 0xFFFF, bytes(4), 1
+    ))
+    checksum = 0xEF
+    for address, data in segments:
+        body += struct.pack("<II", address, len(data)) + data
+        checksum = reduce(xor, data, checksum)
+    body += bytes(15 - len(body) % 16)
+    body.append(checksum)
+    return bytes(body + hashlib.sha256(body).digest())
+
+
+def build_merged(bootloader: bytes, app: bytes, bootloader_offset: int = 0x1000) -> bytes:
+    """Flash image as `esptool merge-bin` makes it: bootloader, partition table, app."""
+    table = b"".join([
+        PARTITION_ENTRY.pack(b"\xaa\x50", 1, 2, 0x9000, 0x6000, b"nvs", 0),
+        PARTITION_ENTRY.pack(b"\xaa\x50", 0, 0, 0x10000, 0x100000, b"factory", 0),
+        PARTITION_ENTRY.pack(b"\xaa\x50", 0, 0x10, 0x110000, 0x100000, b"ota_0", 0),
+    ])
+    merged = bytearray(b"\xff" * 0x10000)
+    merged[bootloader_offset:bootloader_offset + len(bootloader)] = bootloader
+    merged[0x8000:0x8000 + len(table)] = table
+    return bytes(merged + app)
+
+
+def test_sample_image():
+    """The bundled ESP32-S3 build parses with valid checksum, hash and app description."""
+    firmware = parse_esp_firmware(memoryview(SAMPLE.read_bytes()))
+    assert firmware.valid and not firmware.merged
+    image = firmware.images[0]
+    assert image.chip == "ESP32-S3" and image.flash_mode == "dio" and image.flash_size == "4MB"
+    assert len(image.segments) == 5 and image.size == SAMPLE.stat().st_size
+    assert image.checksum_valid and image.sha256_valid
+    assert firmware.app.project_name == "arduino-lib-builder"
+    assert firmware.app.idf_version == "v4.4.7-dirty"
+    assert firmware.app.build_date == "Mar  5 2024"
+    print(f"✓ {image.chip} {firmware.app.project_name} {firmware.app.version}, sha256 {image.sha256[:16]}...")
+
+
+def test_damage_is_found():
+    """Flipped bytes, truncation and a bad header are all reported."""
+    data = SAMPLE.read_bytes()
+
+    flipped = bytearray(data)
+    flipped[50000] ^= 0x40
+    errors = parse_esp_firmware(memoryview(flipped)).errors
+    assert any("Checksum mismatch" in e for e in errors) and any("SHA-256 mismatch" in e for e in errors)
+
+    # A changed digest alone still breaks the image
+    digest = bytearray(data)
+    digest[-1] ^= 1
+    assert parse_esp_firmware(memoryview(digest)).errors == [
+        "Image at 0x0: SHA-256 mismatch: image contents do not match the appended digest"
+    ]
+
+    truncated = parse_esp_firmware(memoryview(data[:200000]))
+    assert not truncated.valid and "Truncated: segment 3" in truncated.errors[0]
+    assert "SHA-256 missing" in parse_esp_firmware(memoryview(data[:-10])).errors[0]
+    assert "segment count" in parse_esp_firmware(memoryview(b"\xe9" * 1024)).errors[0]
+    assert parse_esp_firmware(memoryview(b"\x7fELF" + bytes(60))) is None
+    print(f"✓ Damage reported: {truncated.errors[0]}")
+
+
+def test_merged_image():
+    """Merged images are detected from the partition table and every image is checked."""
+    bootloader = build_image([(0x3FFF0000, bytes(range(256)) * 8)])
+    app = build_image([(0x3F400020, b"\x11" * 700), (0x40080000, b"\x22" * 333)], project="blink")
+    merged = build_merged(bootloader, app)
+
+    # Starts with erased flash, like FPGA padding, but is an ESP32 image
+    assert merged[:0x1000] == b"\xff" * 0x1000
+    detection = detect_binary_type(merged)
+    assert detection["type"] == "esp32" and "0x1000" in detection["reason"]
+
+    report = parse_image(merged)
+    assert report["format"] == "esp32-merged" and report["valid"]
+    assert [image["offset"] for image in report["images"]] == [0x1000, 0x10000]
+    assert report["chip"] == "ESP32" and report["app"]["project_name"] == "blink"
+    assert report["app"]["version"] == "1.2.3" and report["app"]["idf_version"] == "v5.3.1"
+
+    broken = bytearray(merged)
+    broken[0x10000 + 100] ^= 1
+    validation = validate_file_for_device(bytes(broken), "esp32")
+    assert validation["valid"] and not validation["image"]["valid"]
+    assert "Image at 0x10000: Checksum mismatch" in validation["warning"]
+    print(f"✓ Merged image: {len(report['images'])} images, app {report['app']['project_name']}")
+
+
+def test_flash_refuses_damaged_image():
+    """A damaged image is refused before the port is resolved or a tool is started."""
+    data = SAMPLE.read_bytes()
+    with tempfile.TemporaryDirectory() as tmp:
+        image = Path(tmp) / "app.bin"
+        image.write_bytes(data[:100000])
+        # "AUTO" would probe serial ports if the check let the flash through
+        result = asyncio.run(flash_esp_device("AUTO", str(image), "0x10000"))
+        multi = asyncio.run(flash_esp_multi_partition("AUTO", [("0x10000", str(image))]))
+    assert result["success"] is False and result["error"].startswith("Damaged ESP32 image app.bin")
+    assert "log_id" not in result and not result["image"]["valid"]
+    assert multi["success"] is False and multi["error"] == result["error"]
+    print(f"✓ Refused: {result['error']}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("ESP32 Image Parser Test")
+    print("=" * 60)
+    test_sample_image()
+    test_damage_is_found()
+    test_merged_image()
+    test_flash_refuses_damaged_image()
+    print("=" * 60)
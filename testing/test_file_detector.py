@@ -1,10 +1,17 @@
 """Test the binary file type detector."""
 
+import mmap
 import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
 sys.path.insert(0, 'src')
 
 from papilio_loader_mcp.file_detector import detect_binary_type, validate_file_for_device
 
+TEST_DIR = Path(__file__).parent
+
 def test_file(filepath, device_type):
     """Test file detection."""
     print(f"\n{'='*60}")
@@ -30,6 +37,46 @@ def test_file(filepath, device_type):
     if validation['warning']:
         print(f"  Warning: {validation['warning']}")
 
+def test_sources_agree():
+    """A path, bytes, memoryview and mmap of the same file give the same answer."""
+    for name, expected in (("esp32_firmware_hdmi_test.bin", "esp32"), ("fpga_gateware_hdmi_test.bin", "fpga")):
+        path = TEST_DIR / name
+        data = path.read_bytes()
+        results = [detect_binary_type(path), detect_binary_type(str(path)),
+                   detect_binary_type(data), detect_binary_type(memoryview(data))]
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            results.append(detect_binary_type(mapped))
+        assert all(result == results[0] for result in results), results
+        assert results[0]["type"] == expected and results[0]["size"] == len(data)
+        print(f"✓ {name}: {expected} from every source")
+
+
+def test_sync_word_past_header():
+    """Padding longer than the header still finds the Gowin sync word."""
+    detection = detect_binary_type(b"\xff" * 100 + b"\xa5\xc3" + bytes(64))
+    assert detection["type"] == "fpga" and detection["confidence"] == "high"
+    assert detect_binary_type(b"\xff" * 100)["confidence"] == "medium"
+    print(f"✓ {detection['reason']}")
+
+
+def test_constant_memory():
+    """Validating a large file from its path does not read it into memory."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "big.bin"
+        with open(path, "wb") as f:
+            f.write(b"\xe9\x05\x02\x2f" + bytes(28))
+            f.truncate(32 * 1024 * 1024)
+        tracemalloc.start()
+        try:
+            validation = validate_file_for_device(path, "esp32")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    assert validation["valid"] and validation["details"]["size"] == 32 * 1024 * 1024
+    assert peak < 64 * 1024, peak
+    print(f"✓ 32 MB file validated with {peak} bytes peak allocation")
+
+
 if __name__ == "__main__":
     print("\n" + "="*60)
     print("BINARY FILE TYPE DETECTOR TEST")
@@ -47,6 +94,10 @@ if __name__ == "__main__":
     # Test FPGA bitstream on ESP32 device (should warn)
     test_file("debugging/papilio_arcade_template.bin", "esp32")
     
+    test_sources_agree()
+    test_sync_word_past_header()
+    test_constant_memory()
+    
     print("\n" + "="*60)
     print("TEST COMPLETE")
     print("="*60 + "\n")
@@ -0,0 +1,185 @@
+"""Test Gowin bitstream parsing: header, frame CRCs, footer, target part."""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp import file_detector, server
+from papilio_loader_mcp.config import get_config
+from papilio_loader_mcp.file_detector import validate_file_for_device
+from papilio_loader_mcp.gowin_bitstream import FRAME_TRAILER, _crc_is_zero, crc16, parse_gowin_bitstream
+from papilio_loader_mcp.tools.esp_flash import flash_esp_multi_partition
+from papilio_loader_mcp.tools.fpga_flash import flash_fpga_device
+
+TEST_DIR = Path(__file__).parent
+SAMPLE = TEST_DIR / "fpga_gateware_hdmi_test.bin"
+FRAMES_START = 0x44  # after the sample's header commands
+
+
+def build_bitstream(frames: list[bytes], idcode: int = 0x1100481B, compressed: bool = False) -> bytes:
+    """Bitstream laid out like the Gowin tools write it, with frame CRCs and footer."""
+    header = b"".join([
+        bytes([0x06, 0, 0, 0]) + idcode.to_bytes(4, "big"),
+        bytes([0x10, 0, 0, 0, 0, 0, 0x20 if compressed else 0, 0]),
+        bytes([0x51, 0]) + b"\xff" * 6,
+        bytes([0x0B, 0, 0, 0]),
+    ])
+    spi_address = bytes([0xD2, 0, 0xFF, 0xFF, 0, 0, 0, 0])
+    frame_command = (0x3B800000 | len(frames)).to_bytes(4, "big")
+    body = bytearray(b"\xff" * 16 + b"\xa5\xc3" + header + spi_address + frame_command)
+    prefix = header + frame_command
+    for data in frames:
+        body += data + crc16(prefix + data).to_bytes(2, "little") + FRAME_TRAILER
+        prefix = FRAME_TRAILER
+    dummy = b"\xff" * 18
+    body += dummy + crc16(FRAME_TRAILER + dummy).to_bytes(2, "little")
+    body += bytes([0x0A, 0, 0, 0, 0, 0, 0x12, 0x34]) + b"\xff" * 8 + bytes([0x08, 0, 0, 0]) + b"\xff" * 8
+    return bytes(body)
+
+
+def test_sample_bitstream():
+    """The bundled GW2A-18 bitstream parses with every frame CRC correct."""
+    bitstream = parse_gowin_bitstream(memoryview(SAMPLE.read_bytes()))
+    assert bitstream.valid and not bitstream.warnings
+    assert bitstream.idcode == 0x0000081B and bitstream.part == "GW2A(R)-18(C)"
+    assert bitstream.crc_check and not bitstream.compressed
+    assert bitstream.frame_count == bitstream.frames_checked == 2110
+    assert bitstream.frame_size == 422 and bitstream.checksum == 0x577C
+    report = bitstream.to_dict()
+    assert report["format"] == "gowin-bitstream" and report["idcode"] == "0x0000081B"
+    print(f"✓ {bitstream.part}: {bitstream.frames_checked} frames of {bitstream.frame_size} bytes")
+
+
+def test_crc_masks():
+    """Mask parities give the CRC, also for messages folded over the polynomial's period."""
+    for length in (1, 7, 430, 4095, 32767, 32768, 100003):
+        data = os.urandom(length)
+        message = data + crc16(data).to_bytes(2, "little")
+        assert _crc_is_zero(memoryview(message), 0, len(message))
+        broken = bytearray(message)
+        broken[length // 3] ^= 0x10
+        assert not _crc_is_zero(memoryview(bytes(broken)), 0, len(message))
+    print("✓ Bit-sliced CRC matches the table CRC")
+
+
+def test_damage_is_found():
+    """Flipped bits, truncation and a missing footer are reported."""
+    data = SAMPLE.read_bytes()
+
+    flipped = bytearray(data)
+    flipped[FRAMES_START + 430 * 1000 + 17] ^= 0x04
+    bitstream = parse_gowin_bitstream(memoryview(flipped))
+    assert bitstream.bad_frames == [1001]
+    assert bitstream.errors == ["CRC mismatch in 1 of 2110 frames (first: frame 1001 at 0x68ff4)"]
+
+    # The first frame's CRC covers the header commands (here the IDCODE)
+    header = bytearray(data)
+    header[0x1F] ^= 0x01
+    assert "Frame 1 at 0x44: no matching CRC" in parse_gowin_bitstream(memoryview(header)).errors[0]
+
+    truncated = parse_gowin_bitstream(memoryview(data[:600000]))
+    assert truncated.frames_checked == 1395 and "Truncated: 2110 frames" in truncated.errors[0]
+    assert parse_gowin_bitstream(memoryview(data[:-20])).errors == [
+        "Truncated: no program-done command after the frames"
+    ]
+    assert parse_gowin_bitstream(memoryview(b"\xff" * 64)) is None
+    print(f"✓ Damage reported: {bitstream.errors[0]}")
+
+
+def test_wrong_part():
+    """A bitstream for another part is an error once the board's IDCODEs are configured."""
+    view = memoryview(SAMPLE.read_bytes())
+    assert parse_gowin_bitstream(view, [0x1100481B]).errors == [
+        "Built for GW2A(R)-18(C) (0x0000081B), but this board takes GW1N(R)-9C (0x1100481B)"
+    ]
+    assert parse_gowin_bitstream(view, [0x0000081B]).valid
+
+    config = get_config()
+    original = config.fpga_idcodes
+    config.fpga_idcodes = ["0x1100481B"]
+    try:
+        validation = validate_file_for_device(SAMPLE, "fpga")
+    finally:
+        config.fpga_idcodes = original
+    assert validation["valid"] and not validation["image"]["valid"]
+    assert "Built for GW2A(R)-18(C)" in validation["warning"]
+    print(f"✓ Wrong part: {validation['warning']}")
+
+
+def test_synthetic_bitstreams():
+    """Built bitstreams parse, including compressed ones with frames of varying length."""
+    frames = [bytes([index]) * 100 for index in range(50)]
+    bitstream = parse_gowin_bitstream(memoryview(build_bitstream(frames)))
+    assert bitstream.valid and bitstream.part == "GW1N(R)-9C" and bitstream.frame_size == 100
+    assert bitstream.frames_checked == 50 and bitstream.checksum == 0x1234
+
+    varying = [os.urandom(60 + index) for index in range(40)]
+    compressed = parse_gowin_bitstream(memoryview(build_bitstream(varying, compressed=True)))
+    assert compressed.valid and compressed.compressed and compressed.frames_checked == 40
+    assert compressed.frame_size is None
+
+    broken = bytearray(build_bitstream(varying, compressed=True))
+    broken[-200] ^= 0x80
+    assert "no matching CRC" in parse_gowin_bitstream(memoryview(broken)).errors[0]
+    print(f"✓ Synthetic: {bitstream.frames_checked} frames, {compressed.frames_checked} compressed")
+
+
+def test_flash_refuses_damaged_bitstream():
+    """A damaged bitstream is refused before the port is resolved or a tool is started."""
+    data = bytearray(SAMPLE.read_bytes())
+    data[FRAMES_START + 430 * 20] ^= 0xFF
+    with tempfile.TemporaryDirectory() as tmp:
+        bitstream = Path(tmp) / "gateware.bin"
+        bitstream.write_bytes(data)
+        # "AUTO" would probe serial ports if the check let the flash through
+        result = asyncio.run(flash_fpga_device("AUTO", str(bitstream)))
+        multi = asyncio.run(flash_esp_multi_partition("AUTO", [("0x100000", str(bitstream))], tool="pesptool"))
+    assert result["success"] is False and result["error"].startswith("Damaged FPGA bitstream gateware.bin")
+    assert "log_id" not in result and result["image"]["bad_frames"] == [21]
+    assert multi["success"] is False and multi["error"] == result["error"]
+    print(f"✓ Refused: {result['error']}")
+
+
+def test_mcp_flash_parses_once():
+    """The MCP flash tool's file check parses the bitstream; the flash reuses that report."""
+    data = bytearray(SAMPLE.read_bytes())
+    data[FRAMES_START + 430 * 20] ^= 0xFF
+    calls = []
+
+    def counting_parse(*args, **kwargs):
+        calls.append(args)
+        return parse_gowin_bitstream(*args, **kwargs)
+
+    file_detector.parse_gowin_bitstream = counting_parse
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            bitstream = Path(tmp) / "gateware.bin"
+            bitstream.write_bytes(data)
+            # Refused before the port is touched, so AUTO is safe here
+            content = asyncio.run(server.call_tool("flash_device", {
+                "device_type": "fpga", "file_path": str(bitstream),
+            }))
+    finally:
+        file_detector.parse_gowin_bitstream = parse_gowin_bitstream
+    assert "Damaged FPGA bitstream gateware.bin" in content[0].text
+    assert len(calls) == 1, len(calls)
+    print("✓ Bitstream parsed once per MCP flash")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Gowin Bitstream Parser Test")
+    print("=" * 60)
+    test_sample_bitstream()
+    test_crc_masks()
+    test_damage_is_found()
+    test_wrong_part()
+    test_synthetic_bitstreams()
+    test_flash_refuses_damaged_bitstream()
+    test_mcp_flash_parses_once()
+    print("=" * 60)
@@ -0,0 +1,102 @@
+"""Test flash history recording and stats without hardware."""
+
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp import database, history
+from papilio_loader_mcp.config import get_config
+from papilio_loader_mcp.history import history_stats, percentile, record_operation
+
+ESPTOOL_OUTPUT = """esptool v5.1.0
+Serial port /dev/ttyUSB0:
+Connecting....
+MAC: 24:0a:c4:12:34:56
+Wrote 65536 bytes (12000 compressed) at 0x00000000 in 1.0 seconds (524.3 kbit/s).
+Wrote 313760 bytes (170011 compressed) at 0x00010000 in 4.1 seconds (612.2 kbit/s).
+Hash of data verified.
+"""
+
+
+def test_percentile():
+    """Nearest-rank percentiles."""
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) is None
+    print("✓ Percentiles")
+
+
+def test_record_and_stats():
+    """Recorded operations show up in history and per-port stats."""
+    config = get_config()
+    original_dir = config.user_data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir = Path(tmp)
+        try:
+            database.init_db()
+            image = Path(tmp) / "app.bin"
+            image.write_bytes(b"\xe9" * 1024)
+
+            # AUTO port is resolved from the tool output
+            asyncio.run(record_operation(
+                "flash", "esp32", "AUTO", True, 5.5, 0, ESPTOOL_OUTPUT, "op1", image
+            ))
+            for duration in (1.0, 2.0, 3.0):
+                database.add_history_record({
+                    "operation": "flash", "device_type": "fpga", "port": "COM4",
+                    "duration": duration, "success": 1,
+                })
+            database.add_history_record({
+                "operation": "flash", "device_type": "fpga", "port": "COM4",
+                "duration": 0.2, "exit_code": 2, "success": 0,
+            })
+
+            latest = database.get_history(operation="flash", port="/dev/ttyUSB0")
+            assert len(latest) == 1
+            record = latest[0]
+            assert record["device_serial"] == "24:0a:c4:12:34:56"
+            assert record["bytes_written"] == 65536 + 313760
+            assert record["image_size"] == 1024 and len(record["image_sha256"]) == 64
+
+            page = database.get_history(limit=2)
+            assert len(page) == 2
+            older = database.get_history(limit=10, before_id=page[-1]["id"])
+            assert len(older) == 3
+
+            stats = history_stats("flash")
+            com4 = stats["by_port"]["COM4"]
+            assert com4["count"] == 4 and com4["failures"] == 1
+            # Failed runs are left out of the duration percentiles
+            assert com4["duration_p50"] == 2.0 and com4["duration_p95"] == 3.0
+            assert stats["by_device_type"]["esp32"]["kbit_per_s_p50"] == record["kbit_per_s"]
+            assert stats["total"]["count"] == 5
+
+            # A hash the caller already has is recorded without reading the image again
+            original_hash = history._file_sha256
+            history._file_sha256 = None  # would raise if called
+            try:
+                asyncio.run(record_operation(
+                    "flash", "esp32", "COM9", True, 1.0, 0, "", "op2", image, "ab" * 32
+                ))
+            finally:
+                history._file_sha256 = original_hash
+            assert database.get_history(port="COM9")[0]["image_sha256"] == "ab" * 32
+        finally:
+            database.close_db_connection()
+            config.user_data_dir = original_dir
+    print(f"✓ History stats: {stats['by_port']['COM4']}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Flash History Test")
+    print("=" * 60)
+    test_percentile()
+    test_record_and_stats()
+    print("=" * 60)
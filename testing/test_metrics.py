@@ -0,0 +1,115 @@
+"""Test the Prometheus metrics registry and the /metrics endpoint."""
+
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp import metrics
+from papilio_loader_mcp.metrics import Counter, Gauge, Histogram, Registry
+from papilio_loader_mcp.progress import ProgressBroker
+
+
+def _samples(text: str) -> dict[str, float]:
+    """Parse exposition text into {series: value}."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+
+def test_exposition_format():
+    """Counters, gauges and cumulative histogram buckets render correctly."""
+    registry = Registry()
+    requests = registry.register(Counter("t_requests_total", "Requests.", ("route",)))
+    sessions = registry.register(Gauge("t_sessions", "Sessions."))
+    latency = registry.register(Histogram("t_latency_seconds", "Latency.", buckets=(0.1, 1)))
+    depth = registry.register(Gauge("t_depth", "Depth.", ("port",), callback=lambda: {("COM3",): 2}))
+
+    requests.inc(route='/a"b')
+    requests.inc(2, route='/a"b')
+    sessions.inc()
+    sessions.inc()
+    sessions.dec()
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+
+    text = registry.render()
+    samples = _samples(text)
+    assert "# TYPE t_latency_seconds histogram" in text
+    assert samples['t_requests_total{route="/a\\"b"}'] == 3
+    assert samples["t_sessions"] == 1
+    assert samples['t_depth{port="COM3"}'] == 2
+    # le is inclusive, buckets are cumulative
+    assert samples['t_latency_seconds_bucket{le="0.1"}'] == 2
+    assert samples['t_latency_seconds_bucket{le="1"}'] == 3
+    assert samples['t_latency_seconds_bucket{le="+Inf"}'] == 4
+    assert samples["t_latency_seconds_count"] == 4
+    assert abs(samples["t_latency_seconds_sum"] - 3.65) < 1e-9
+    print(f"✓ Rendered {len(samples)} samples")
+
+
+def test_flash_phases():
+    """Each phase an operation passes through is timed once."""
+    before = {p: metrics.FLASH_PHASE.count(phase=p) for p in ("connect", "write", "verify")}
+    operation = ProgressBroker(logs_dir=Path(tempfile.mkdtemp())).start("phases")
+    for line in ("Connecting....", "Compressed 1024 bytes to 512...",
+                 "Writing at 0x00010000... (100 %)", "Hash of data verified."):
+        operation.feed(line)
+    operation.finish(True)
+    operation.finish(True)
+    for phase, count in before.items():
+        assert metrics.FLASH_PHASE.count(phase=phase) == count + 1, phase
+    print("✓ Flash phases timed")
+
+
+def test_scrape_endpoint():
+    """/metrics is served by the API and counts requests per route template."""
+    from fastapi.testclient import TestClient
+    from papilio_loader_mcp.api import api, config
+
+    original_key = config.api_key
+    config.api_key = None
+    try:
+        client = TestClient(api)
+        assert client.get("/health").status_code == 200
+        client.get("/web/logs/abc")  # 401, counted under its route template
+        response = client.get("/metrics")
+    finally:
+        config.api_key = original_key
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = _samples(response.text)
+    assert samples['papilio_http_requests_total{method="GET",route="/health",status="200"}'] >= 1
+    assert samples['papilio_http_requests_total{method="GET",route="/web/logs/{operation_id}",status="401"}'] >= 1
+    assert 'papilio_http_request_duration_seconds_bucket{method="GET",route="/health",le="+Inf"}' in samples
+    assert "# TYPE papilio_queue_depth gauge" in response.text
+    assert "# TYPE papilio_upload_bytes_total counter" in response.text
+    print(f"✓ Scraped {len(samples)} samples from /metrics")
+
+
+def test_mcp_tool_metrics():
+    """MCP tool calls are counted per tool name; unknown names share a label."""
+    from papilio_loader_mcp.server import call_tool
+
+    asyncio.run(call_tool("no_such_tool", {}))
+    assert metrics.MCP_TOOL_CALLS.value(tool="unknown", status="error") >= 1
+    assert metrics.MCP_TOOL_LATENCY.count(tool="unknown") >= 1
+    print("✓ MCP tool calls counted")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Metrics Test")
+    print("=" * 60)
+    test_exposition_format()
+    test_flash_phases()
+    test_scrape_endpoint()
+    test_mcp_tool_metrics()
+    print("=" * 60)
@@ -0,0 +1,117 @@
+"""Test parsing of esptool/pesptool output into structured reports."""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.progress import ProgressBroker
+from papilio_loader_mcp.tools.output_parser import OutputParser, parse_output
+from papilio_loader_mcp.tools.results import ToolResult
+
+# esptool 5.x layout
+ESPTOOL5_FLASH = """esptool v5.1.0
+Connected to ESP32-S3 on COM4:
+Chip type:          ESP32-S3 (QFN56) (revision v0.2)
+Features:           Wi-Fi, BT 5 (LE), Dual Core + LP Core, 240MHz, Embedded PSRAM 8MB (AP_3v3)
+Crystal frequency:  40MHz
+MAC:                24:0A:C4:12:34:56
+
+Flash will be erased from 0x00000000 to 0x00004fff...
+Flash will be erased from 0x00010000 to 0x0005cfff...
+Compressed 20000 bytes to 12000...
+Writing at 0x00000000 [==============================] 100.0% 12000/12000 bytes...
+Wrote 20000 bytes (12000 compressed) at 0x00000000 in 0.9 seconds (177.8 kbit/s).
+Hash of data verified.
+Compressed 313760 bytes to 170011...
+Writing at 0x0003a1f2 [=============>                ]  48.2% 81920/170011 bytes...
+Wrote 313760 bytes (170011 compressed) at 0x00010000 in 4.1 seconds (612.2 kbit/s).
+Hash of data verified.
+
+Hard resetting via RTS pin...
+"""
+
+# esptool 4.x flash_id
+ESPTOOL4_FLASH_ID = """esptool.py v4.8.1
+Serial port /dev/ttyUSB0
+Connecting....
+Detecting chip type... ESP32
+Chip is ESP32-D0WD-V3 (revision v3.1)
+Features: WiFi, BT, Dual Core, 240MHz, VRef calibration in efuse, Coding Scheme None
+Crystal is 40MHz
+MAC: 08:3a:f2:aa:bb:cc
+Uploading stub...
+Running stub...
+Stub running...
+Manufacturer: 20
+Device: 4016
+Detected flash size: 4MB
+Hard resetting via RTS pin...
+"""
+
+VERIFY_FAILED = """Wrote 1024 bytes (512 compressed) at 0x00100000 in 0.1 seconds (81.9 kbit/s).
+A fatal error occurred: MD5 of file does not match data in flash!
+"""
+
+
+def test_esptool5_flash():
+    """Chip details, total write speed and verify status from a 5.x flash."""
+    report = parse_output(ESPTOOL5_FLASH)
+    assert report.chip == "ESP32-S3 (QFN56)" and report.revision == "v0.2"
+    assert report.crystal_mhz == 40
+    assert report.mac == "24:0a:c4:12:34:56"
+    assert report.features[0] == "Wi-Fi"
+    assert report.port == "COM4"
+    assert report.bytes_written == 333760
+    assert report.write_seconds == 5.0
+    assert report.kbit_per_s == round(333760 * 8 / 5.0 / 1000, 1)
+    assert len(report.regions) == 2
+    assert report.hash_verified is True
+    print(f"✓ {report.chip} {report.revision}, {report.kbit_per_s} kbit/s")
+
+
+def test_esptool4_flash_id():
+    """Flash chip ids and size from a 4.x flash_id run."""
+    report = parse_output(ESPTOOL4_FLASH_ID)
+    assert report.chip == "ESP32-D0WD-V3" and report.revision == "v3.1"
+    assert report.port == "/dev/ttyUSB0"
+    assert (report.flash_manufacturer, report.flash_device, report.flash_size) == ("20", "4016", "4MB")
+    assert report.bytes_written is None and report.hash_verified is None
+    # Only what the output mentioned is included
+    assert "bytes_written" not in report.to_dict() and "regions" not in report.to_dict()
+    print(f"✓ Flash {report.flash_manufacturer}/{report.flash_device} {report.flash_size}")
+
+
+def test_verify_failure():
+    """A failed hash check is reported as such, with the error."""
+    parser = OutputParser()
+    for line in VERIFY_FAILED.splitlines():
+        parser.feed(line)
+    assert parser.report.hash_verified is False
+    assert parser.report.error.startswith("MD5 of file does not match")
+    print("✓ Verify failure detected")
+
+
+def test_operation_report():
+    """Flash operations parse their output as it streams."""
+    operation = ProgressBroker(logs_dir=Path(tempfile.mkdtemp())).start("report")
+    for line in ESPTOOL5_FLASH.splitlines():
+        operation.feed(line)
+    operation.finish(True)
+    result = ToolResult({"success": True, "report": operation.report.to_dict()})
+    assert result["report"]["bytes_written"] == 333760
+    assert '"hash_verified": true' in result.to_json()
+    print("✓ Operation report")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Tool Output Parser Test")
+    print("=" * 60)
+    test_esptool5_flash()
+    test_esptool4_flash_id()
+    test_verify_failure()
+    test_operation_report()
+    print("=" * 60)
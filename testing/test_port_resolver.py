@@ -0,0 +1,144 @@
+"""Test AUTO port resolution without hardware."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp import scheduler
+from papilio_loader_mcp.tools import serial_ports
+from papilio_loader_mcp.tools.port_resolver import PortResolver, candidate_ports
+from papilio_loader_mcp.tools.serial_ports import PortWatcher
+
+
+def _port(device, vid=None, pid=None, product=None, description="n/a"):
+    return {"device": device, "vid": vid, "pid": pid, "product": product,
+            "manufacturer": None, "description": description, "hwid": "n/a", "serial_number": None}
+
+
+PORTS = [
+    _port("/dev/ttyS0"),
+    _port("/dev/ttyUSB0", 0x0403, 0x6001, "FT232R USB UART"),
+    _port("/dev/ttyACM0", 0x2341, 0x0043, "Arduino Uno"),
+    _port("/dev/ttyACM1", 0x303A, 0x1001, "USB JTAG/serial debug unit"),
+    _port("/dev/ttyUSB1", 0x1234, 0x5678, "Papilio RetroCade"),
+]
+
+
+class FakeResolver(PortResolver):
+    """Probes answer from a fixed set of ports, after a short delay."""
+
+    def __init__(self, answering, extra_ids=None):
+        super().__init__(probe_timeout=1, extra_ids=extra_ids)
+        self.answering = answering
+        self.probed = []
+
+    async def _probe(self, port, device_type):
+        self.probed.append(port)
+        # Probes run as jobs in their port's queue
+        assert scheduler.get_scheduler().is_busy(port)
+        await asyncio.sleep(0.01 if port in self.answering else 0.05)
+        return port in self.answering
+
+
+def _with_ports(ports, coro_factory):
+    watcher = PortWatcher(interval=60, scan=lambda: list(ports))
+    serial_ports._watcher = watcher
+    scheduler._scheduler = scheduler.FlashScheduler()
+    try:
+        return asyncio.run(coro_factory())
+    finally:
+        watcher.stop()
+        serial_ports._watcher = None
+        scheduler._scheduler = None
+
+
+def test_candidates():
+    """Unknown adapters and plain UARTs are left out; board names rank first."""
+    assert candidate_ports(PORTS) == ["/dev/ttyUSB1", "/dev/ttyACM1", "/dev/ttyUSB0"]
+    extra = PortResolver(extra_ids=["2341:0043", "nonsense"]).extra_ids
+    assert candidate_ports(PORTS, extra)[0] in ("/dev/ttyACM0", "/dev/ttyUSB1")
+    print(f"✓ Candidates: {candidate_ports(PORTS)}")
+
+
+def test_parallel_probe_and_memory():
+    """Several candidates are probed at once; the winner is remembered until unplugged."""
+    resolver = FakeResolver(answering={"/dev/ttyACM1"})
+
+    async def run():
+        first = await resolver.resolve("AUTO", "esp32")
+        probed = list(resolver.probed)
+        again = await resolver.resolve("AUTO", "esp32")
+        explicit = await resolver.resolve("COM9", "esp32")
+        resolver.forget([], [_port("/dev/ttyACM1")])
+        return first, probed, again, explicit
+
+    first, probed, again, explicit = _with_ports(PORTS, run)
+    assert first == "/dev/ttyACM1" and again == "/dev/ttyACM1" and explicit == "COM9"
+    assert sorted(probed) == sorted(candidate_ports(PORTS)), probed
+    assert len(resolver.probed) == len(probed)  # second call did not probe
+    assert resolver.winners() == {}
+    print(f"✓ Resolved {first} after probing {len(probed)} candidates")
+
+
+def test_single_candidate_and_fallback():
+    """One candidate is used without probing; no answer falls back to AUTO."""
+    single = FakeResolver(answering=set())
+    assert _with_ports([PORTS[0], PORTS[3]], lambda: single.resolve(None, "fpga")) == "/dev/ttyACM1"
+    assert single.probed == []
+
+    silent = FakeResolver(answering=set())
+    assert _with_ports(PORTS, lambda: silent.resolve("auto", "esp32")) == "AUTO"
+    nothing = FakeResolver(answering=set())
+    assert _with_ports([PORTS[0]], lambda: nothing.resolve("AUTO", "esp32")) == "AUTO"
+    print("✓ Single candidate and fallback")
+
+
+def test_concurrent_requests_share_probes():
+    """Simultaneous AUTO requests probe each candidate once and agree on the port."""
+    resolver = FakeResolver(answering={"/dev/ttyACM1"})
+
+    async def run():
+        return await asyncio.gather(*[resolver.resolve("AUTO", "esp32") for _ in range(5)])
+
+    results = _with_ports(PORTS, run)
+    assert results == ["/dev/ttyACM1"] * 5
+    assert sorted(resolver.probed) == sorted(candidate_ports(PORTS)), resolver.probed
+    print(f"✓ 5 requests, {len(resolver.probed)} probes")
+
+
+def test_busy_ports_are_not_probed():
+    """A port with a job running is left alone while idle candidates remain."""
+    resolver = FakeResolver(answering={"/dev/ttyACM1", "/dev/ttyUSB0"})
+
+    async def run():
+        release = asyncio.Event()
+
+        async def flash(port):
+            await release.wait()
+
+        job = asyncio.ensure_future(scheduler.get_scheduler().submit("/dev/ttyACM1", flash, "/dev/ttyACM1"))
+        await asyncio.sleep(0)
+        try:
+            return await resolver.resolve("AUTO", "esp32")
+        finally:
+            release.set()
+            await job
+
+    assert _with_ports(PORTS, run) == "/dev/ttyUSB0"
+    assert "/dev/ttyACM1" not in resolver.probed, resolver.probed
+    print(f"✓ Busy port skipped, probed {resolver.probed}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("AUTO Port Resolution Test")
+    print("=" * 60)
+    test_candidates()
+    test_parallel_probe_and_memory()
+    test_single_candidate_and_fallback()
+    test_concurrent_requests_share_probes()
+    test_busy_ports_are_not_probed()
+    print("=" * 60)
@@ -0,0 +1,67 @@
+"""Test the cached serial port table without hardware."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools import serial_ports
+from papilio_loader_mcp.tools.serial_ports import PortWatcher
+
+
+def _port(device, serial_number="A1"):
+    return {"device": device, "hwid": f"USB VID:PID=0403:6010 SER={serial_number}",
+            "serial_number": serial_number}
+
+
+def test_generation_and_changes():
+    """Generation only moves when the table changes; subscribers see the diff."""
+    scans = [[_port("/dev/ttyUSB0")], [_port("/dev/ttyUSB0")],
+             [_port("/dev/ttyUSB0"), _port("/dev/ttyUSB1", "B2")], [_port("/dev/ttyUSB1", "B2")]]
+    watcher = PortWatcher(scan=lambda: scans.pop(0))
+    changes = []
+    watcher.subscribe(lambda added, removed: changes.append(
+        ([p["device"] for p in added], [p["device"] for p in removed])))
+
+    assert watcher.refresh() and watcher.generation == 1
+    assert not watcher.refresh() and watcher.generation == 1
+    assert watcher.refresh() and watcher.generation == 2
+    assert watcher.refresh() and watcher.generation == 3
+    assert changes == [(["/dev/ttyUSB0"], []), (["/dev/ttyUSB1"], []), ([], ["/dev/ttyUSB0"])], changes
+    assert watcher.snapshot()["count"] == 1
+    print(f"✓ Generation {watcher.generation}, changes {changes}")
+
+
+def test_list_answers_from_cache():
+    """list_serial_ports reads the watcher table instead of scanning itself."""
+    calls = []
+
+    def scan():
+        calls.append(1)
+        return [_port("COM4")]
+
+    async def run():
+        return await asyncio.gather(*[serial_ports.list_serial_ports() for _ in range(10)])
+
+    watcher = PortWatcher(interval=60, scan=scan)
+    serial_ports._watcher = watcher
+    try:
+        results = asyncio.run(run())
+    finally:
+        watcher.stop()
+        serial_ports._watcher = None
+    parsed = results[-1]
+    assert parsed["ports"][0]["device"] == "COM4" and parsed["generation"] == 1
+    assert len(calls) == 1, calls
+    print(f"✓ 10 listings, {len(calls)} scan")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Port Watcher Test")
+    print("=" * 60)
+    test_generation_and_changes()
+    test_list_answers_from_cache()
+    print("=" * 60)
@@ -0,0 +1,124 @@
+"""Test progress parsing and event fan-out for flash operations."""
+
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.progress import ProgressBroker, WRITE_PROGRESS_RE
+from papilio_loader_mcp.tools.engine import LineSplitter
+
+ESPTOOL_OUTPUT = """esptool v5.1.0
+Connecting....
+Connected to ESP32-S3 on COM4:
+Chip type:          ESP32-S3 (QFN56) (revision v0.2)
+Flash will be erased from 0x00010000 to 0x0005cfff...
+Compressed 313760 bytes to 170011...
+Writing at 0x00010000 [                              ]   0.0% 0/170011 bytes...
+Writing at 0x0003a1f2 [=============>                ]  48.2% 81920/170011 bytes...
+Writing at 0x0005c9a0 [==============================] 100.0% 170011/170011 bytes...
+Wrote 313760 bytes (170011 compressed) at 0x00010000 in 4.1 seconds (612.2 kbit/s).
+Hash of data verified.
+
+Hard resetting via RTS pin...
+"""
+
+def test_line_splitter():
+    """Carriage returns and split chunks still produce whole lines."""
+    splitter = LineSplitter()
+    # esptool 4.x redraws its progress line with carriage returns
+    lines = splitter.feed("Writing at 0x0001") + splitter.feed("0000... (3 %)\rDone\r\nTail")
+    lines += splitter.flush()
+    assert lines == ["Writing at 0x00010000... (3 %)", "Done", "Tail"], lines
+    assert WRITE_PROGRESS_RE.search(lines[0]).groups() == ("0x00010000", "3")
+    print("✓ Line splitter handles \\r, \\r\\n and partial chunks")
+
+
+def test_operation_events():
+    """Progress, phase and done events reach a subscriber; log goes to disk."""
+    async def run():
+        broker = ProgressBroker(logs_dir=Path(tempfile.mkdtemp()))
+        # Subscribe before the operation starts, like the web UI does
+        placeholder = broker.get("op1", create=True)
+        events = []
+
+        async def collect():
+            async for event in placeholder.events():
+                events.append(event)
+
+        collector = asyncio.create_task(collect())
+        await asyncio.sleep(0)
+
+        operation = broker.start("op1", "Flash ESP32 test.bin")
+        assert operation is placeholder
+        splitter = LineSplitter()
+        for line in splitter.feed(ESPTOOL_OUTPUT) + splitter.flush():
+            operation.feed(line)
+        operation.finish(True)
+        await asyncio.wait_for(collector, 1)
+        return operation, events
+
+    operation, events = asyncio.run(run())
+    phases = [e["phase"] for e in events if e["type"] == "phase"]
+    percents = [e["percent"] for e in events if e["type"] == "progress"]
+    assert phases == ["connect", "erase", "write", "verify", "reset"], phases
+    assert percents == [0.0, 48.2, 100.0], percents
+    assert events[-1] == {"operation_id": "op1", "type": "done", "success": True}
+
+    log_text = operation.log_path.read_text()
+    assert "Hash of data verified." in log_text
+    assert log_text.count("Writing at") == 3
+    # Redrawn progress lines collapse to the latest one in the tail
+    assert operation.output_tail().count("Writing at") == 1
+    print(f"✓ {len(events)} events, phases {phases}")
+
+
+def test_invalid_operation_id():
+    """Ids that could escape the log directory are rejected."""
+    broker = ProgressBroker(logs_dir=Path(tempfile.mkdtemp()))
+    assert broker.get("../secrets", create=True) is None
+    assert broker.log_path("..") is None
+    operation = broker.start("../../etc/passwd")
+    assert operation.id != "../../etc/passwd"
+    operation.finish(False)
+    print("✓ Unsafe operation ids rejected")
+
+
+def test_prune_keeps_running_operations():
+    """Only finished operations and unstarted placeholders are pruned; live logs stay."""
+    broker = ProgressBroker(max_operations=2, logs_dir=Path(tempfile.mkdtemp()))
+    connecting = broker.start("connecting", "Flash, no output yet")
+    chatty = broker.start("chatty", "Flash with output")
+    chatty.feed("Connecting....")
+    finished = broker.start("finished")
+    finished.finish(True)
+    broker.get("waiting", create=True)
+
+    # Over the limit with two running: the finished one goes, then the placeholder
+    assert broker.get("finished") is None and not finished.log_path.exists()
+    assert broker.get("waiting") is None
+    assert broker.get("connecting") is connecting and connecting.log_path.exists()
+    assert broker.get("chatty") is chatty and chatty.log_path.exists()
+
+    # Finished operations after a long-running one are still pruned
+    for index in range(3):
+        broker.start(f"later{index}").finish(True)
+    assert broker.get("connecting") is connecting and broker.get("later0") is None
+    assert broker.get("later2") is not None
+    connecting.finish(False)
+    chatty.finish(True)
+    print("✓ Running operations kept while finished ones are pruned")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Flash Progress Test")
+    print("=" * 60)
+    test_line_splitter()
+    test_operation_events()
+    test_invalid_operation_id()
+    test_prune_keeps_running_operations()
+    print("=" * 60)
@@ -0,0 +1,123 @@
+"""Test the per-port job scheduler without hardware."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.scheduler import FlashScheduler
+
+
+async def _fake_flash(log, port, name, duration):
+    log.append(("start", port, name, time.monotonic()))
+    await asyncio.sleep(duration)
+    log.append(("end", port, name, time.monotonic()))
+    return name
+
+
+def test_same_port_runs_in_order():
+    """Jobs on one port never overlap and finish in submission order."""
+    async def run():
+        scheduler = FlashScheduler(max_concurrent=4)
+        log = []
+        results = await asyncio.gather(*[
+            scheduler.submit("COM4", _fake_flash, log, "COM4", f"job{i}", 0.02)
+            for i in range(5)
+        ])
+        return results, log
+
+    results, log = asyncio.run(run())
+    assert results == [f"job{i}" for i in range(5)]
+    events = [(kind, name) for kind, _, name, _ in log]
+    expected = []
+    for i in range(5):
+        expected += [("start", f"job{i}"), ("end", f"job{i}")]
+    assert events == expected
+    print("✓ Same-port jobs serialized in order")
+
+
+def test_ports_run_in_parallel():
+    """Jobs on different ports overlap, up to the global cap."""
+    async def run(cap):
+        scheduler = FlashScheduler(max_concurrent=cap)
+        log = []
+        start = time.monotonic()
+        await asyncio.gather(*[
+            scheduler.submit(f"COM{i}", _fake_flash, log, f"COM{i}", "job", 0.1)
+            for i in range(4)
+        ])
+        return time.monotonic() - start
+
+    parallel = asyncio.run(run(4))
+    capped = asyncio.run(run(1))
+    assert parallel < 0.3, parallel
+    assert capped >= 0.4, capped
+    print(f"✓ 4 ports in {parallel:.2f}s with cap 4, {capped:.2f}s with cap 1")
+
+
+def test_errors_do_not_stall_queue():
+    """A failing job reports its exception and the next job still runs."""
+    async def boom():
+        raise RuntimeError("port busy")
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        scheduler = FlashScheduler()
+        first = asyncio.ensure_future(scheduler.submit("com7", boom))
+        second = asyncio.ensure_future(scheduler.submit("COM7", ok))
+        try:
+            await first
+        except RuntimeError as e:
+            error = str(e)
+        return error, await second, scheduler.status()
+
+    error, result, status = asyncio.run(run())
+    assert error == "port busy"
+    assert result == "ok"
+    assert status["failed"] == 1 and status["completed"] == 1
+    assert status["queued"] == 0
+    print("✓ Failed job isolated, queue drained")
+
+
+def test_cancelled_jobs_release_callers():
+    """Callers are released when a job cancels itself or the port worker is cancelled."""
+    async def gives_up():
+        raise asyncio.CancelledError()
+
+    async def run():
+        scheduler = FlashScheduler()
+        try:
+            await asyncio.wait_for(scheduler.submit("COM8", gives_up), 1)
+            inside = "returned"
+        except asyncio.CancelledError:
+            inside = "cancelled"
+
+        log = []
+        running = asyncio.ensure_future(scheduler.submit("COM9", _fake_flash, log, "COM9", "a", 10))
+        queued = asyncio.ensure_future(scheduler.submit("COM9", _fake_flash, log, "COM9", "b", 10))
+        await asyncio.sleep(0.05)
+        scheduler._workers["COM9"].cancel()
+        done, _ = await asyncio.wait({running, queued}, timeout=1)
+        return inside, [task.cancelled() for task in (running, queued)], len(done), scheduler.status()
+
+    inside, cancelled, done, status = asyncio.run(run())
+    assert inside == "cancelled"
+    assert done == 2 and cancelled == [True, True]
+    assert status["queued"] == 0 and status["running"] == 0
+    print("✓ Cancelled jobs never leave their callers waiting")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Job Scheduler Test")
+    print("=" * 60)
+    test_same_port_runs_in_order()
+    test_ports_run_in_parallel()
+    test_errors_do_not_stall_queue()
+    test_cancelled_jobs_release_callers()
+    print("=" * 60)
@@ -0,0 +1,107 @@
+"""Test coalescing of concurrent identical device queries."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    """Ten identical calls run the tool once; a different key runs separately."""
+    group = SingleFlight()
+    runs = []
+
+    async def probe():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return {"status": "Connected", "run": len(runs)}
+
+    async def run():
+        same = [group.do(("info", "COM4", "esp32"), probe) for _ in range(10)]
+        other = group.do(("info", "COM5", "esp32"), probe)
+        results = await asyncio.gather(*same, other)
+        # The key is free again once the result is in
+        again = await group.do(("info", "COM4", "esp32"), probe)
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert len(runs) == 3, runs
+    assert all(r is results[0] for r in results[:10])
+    assert results[10] is not results[0] and again["run"] == 3
+    assert group.stats() == {"in_flight": 0, "executed": 3, "coalesced": 9}
+    print(f"✓ 12 calls, {group.executed} runs, {group.coalesced} coalesced")
+
+
+def test_errors_and_cancellation():
+    """Every caller sees the error; a cancelled caller does not cancel the run."""
+    group = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("port busy")
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        outcomes = await asyncio.gather(
+            *[group.do(("status", "COM4", "fpga"), failing) for _ in range(3)],
+            return_exceptions=True,
+        )
+        impatient = asyncio.ensure_future(group.do(("info", "COM4", "fpga"), slow))
+        patient = asyncio.ensure_future(group.do(("info", "COM4", "fpga"), slow))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return outcomes, await patient
+
+    outcomes, result = asyncio.run(run())
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+    assert result == "done"
+    print("✓ Errors shared, cancellation isolated")
+
+
+def test_abandoned_run_is_cancelled():
+    """When the last caller gives up, the run is cancelled and the key is free."""
+    group = SingleFlight()
+    cancelled = []
+
+    async def stuck():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def quick():
+        return "fresh"
+
+    async def run():
+        callers = [asyncio.ensure_future(group.do(("info", "COM4", "esp32"), stuck)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        survived = not cancelled
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        # A caller arriving right after starts a new run instead of joining the cancelled one
+        return survived, await group.do(("info", "COM4", "esp32"), quick)
+
+    survived, result = asyncio.run(run())
+    assert survived and cancelled == [1] and result == "fresh"
+    assert group.stats()["in_flight"] == 0 and group._waiters == {}
+    print("✓ Abandoned run cancelled")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Single-Flight Test")
+    print("=" * 60)
+    test_concurrent_calls_share_one_run()
+    test_errors_and_cancellation()
+    test_abandoned_run_is_cancelled()
+    print("=" * 60)
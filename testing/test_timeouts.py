@@ -0,0 +1,251 @@
+"""Test tool deadlines and cancellation with a fake tool that hangs."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from fastapi import HTTPException
+
+from papilio_loader_mcp import api, database
+from papilio_loader_mcp.config import get_config
+from papilio_loader_mcp.scheduler import FlashScheduler
+from papilio_loader_mcp.tools import engine
+from papilio_loader_mcp.tools.engine import ToolTimeoutError, call_in_tool, run_tool
+from papilio_loader_mcp.tools.esp_flash import flash_esp_device
+from papilio_loader_mcp.tools.tool_registry import get_tool_registry
+
+# Prints like esptool, starts a child (as PyInstaller one-file builds do),
+# writes both pids to a file and then hangs
+HANGING_TOOL = """#!{python}
+import subprocess, sys, time
+child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+with open({pids!r}, "w") as f:
+    f.write(f"{{child.pid}}")
+print("Serial port /dev/ttyFAKE:", flush=True)
+print({last!r}, end="", flush=True)
+time.sleep(60)
+"""
+
+
+def _make_tool(directory: Path, last: str = "Connecting....") -> tuple[Path, Path]:
+    pids = directory / "pids"
+    tool = directory / "fake-esptool"
+    tool.write_text(HANGING_TOOL.format(python=sys.executable, pids=str(pids), last=last))
+    tool.chmod(0o755)
+    return tool, pids
+
+
+def _running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    stat = Path(f"/proc/{pid}/stat")
+    # Orphans may linger as zombies until init gets round to them
+    return not (stat.exists() and stat.read_text().split()[2] == "Z")
+
+
+def _wait_gone(pid: int, seconds: float = 5.0) -> bool:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if not _running(pid):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _windows() -> bool:
+    if sys.platform == "win32":
+        print("- Skipped: the fake tool is a POSIX script")
+        return True
+    return False
+
+
+def test_timeout_kills_process_tree():
+    """A tool past its deadline is killed with its children and reports the phase."""
+    if _windows():
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        tool, pids = _make_tool(Path(tmp))
+        get_tool_registry().set_path("esptool", tool)
+        try:
+            start = time.perf_counter()
+            try:
+                asyncio.run(run_tool("esptool", ["chip_id"], backend="subprocess", timeout=1.0))
+            except ToolTimeoutError as e:
+                error = e
+            else:
+                raise AssertionError("Expected a timeout")
+            elapsed = time.perf_counter() - start
+        finally:
+            get_tool_registry().forget("esptool")
+
+        assert elapsed < 5, elapsed
+        assert error.phase == "connect"
+        assert error.last_line == "Connecting...."
+        assert "during connect" in str(error)
+        assert _wait_gone(int(pids.read_text()))
+    print(f"✓ Timed out after {elapsed:.2f}s: {error}")
+
+
+def test_cancel_running_job():
+    """Cancelling the caller of a scheduled job kills its tool and frees the port."""
+    if _windows():
+        return
+    async def scenario(pids: Path):
+        scheduler = FlashScheduler(max_concurrent=2)
+
+        async def hang():
+            await run_tool("esptool", ["chip_id"], backend="subprocess")
+
+        async def quick():
+            return "next"
+
+        waiter = asyncio.ensure_future(scheduler.submit("COM7", hang, description="hang"))
+        for _ in range(100):
+            if pids.exists() and pids.read_text():
+                break
+            await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(scheduler.submit("COM7", quick, description="quick"))
+        waiter.cancel()
+        result = await asyncio.wait_for(follower, 5)
+        return scheduler, result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tool, pids = _make_tool(Path(tmp))
+        get_tool_registry().set_path("esptool", tool)
+        try:
+            scheduler, result = asyncio.run(scenario(pids))
+        finally:
+            get_tool_registry().forget("esptool")
+
+        assert result == "next"
+        assert scheduler.cancelled == 1 and scheduler.completed == 1
+        assert _wait_gone(int(pids.read_text()))
+    print(f"✓ Cancelled job stopped its tool: {scheduler.status()}")
+
+
+def test_flash_timeout_reports_phase():
+    """A flash that hangs mid-write returns an error naming the write phase."""
+    if _windows():
+        return
+    config = get_config()
+    original_dir, original_timeout = config.user_data_dir, config.flash_timeout
+    with tempfile.TemporaryDirectory() as tmp:
+        tool, pids = _make_tool(Path(tmp), "Connecting....\nWriting at 0x00010000... (12 %)")
+        image = Path(tmp) / "app.bin"
+        image.write_bytes((Path(__file__).parent / "esp32_firmware_hdmi_test.bin").read_bytes())
+        get_tool_registry().set_path("esptool", tool)
+        config.user_data_dir = Path(tmp)
+        config.flash_timeout = 1
+        try:
+            database.init_db()
+            result = asyncio.run(flash_esp_device("/dev/ttyFAKE", str(image), "0x10000"))
+        finally:
+            database.close_db_connection()
+            get_tool_registry().forget("esptool")
+            config.user_data_dir, config.flash_timeout = original_dir, original_timeout
+
+        assert result["success"] is False
+        assert result["timed_out"] is True and result["timeout"] <= 1
+        assert result["phase"] == "write" and "during write" in result["error"]
+        assert _wait_gone(int(pids.read_text()))
+    print(f"✓ Flash timeout: {result['error']}")
+
+
+def test_http_disconnect_cancels():
+    """A request whose client went away stops waiting and cancels its operation."""
+    class GoneClient:
+        class url:
+            path = "/flash/upload"
+
+        async def is_disconnected(self):
+            return True
+
+    cancelled = []
+
+    async def operation():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        try:
+            await api._cancel_on_disconnect(GoneClient(), operation())
+        except HTTPException as e:
+            await asyncio.sleep(0)  # let the cancellation land
+            return e.status_code, list(cancelled)
+        raise AssertionError("Expected the request to be abandoned")
+
+    original = api.DISCONNECT_POLL_SECONDS
+    api.DISCONNECT_POLL_SECONDS = 0.05
+    try:
+        status, cancelled_before_exit = asyncio.run(scenario())
+    finally:
+        api.DISCONNECT_POLL_SECONDS = original
+    assert status == 499 and cancelled_before_exit == [True]
+    print("✓ Disconnected client cancels its operation")
+
+
+def test_abort_spares_other_calls():
+    """Abandoning one in-process call kills only its worker; output still streams."""
+    if not engine.inprocess_available():
+        print("- Skipped: esptool is not installed")
+        return
+
+    async def run():
+        backend = engine.InProcessBackend(max_workers=2)
+        try:
+            other = asyncio.ensure_future(backend.call("esptool", time.sleep, 1.0))
+            try:
+                await backend.call("esptool", time.sleep, 30, timeout=0.5)
+                raise AssertionError("call should have timed out")
+            except ToolTimeoutError:
+                pass
+            await other  # would raise BrokenProcessPool if its worker had been killed
+
+            lines = []
+            result = await backend.run("esptool", ["version"], on_line=lines.append)
+            return result, lines
+        finally:
+            backend.shutdown()
+
+    result, lines = asyncio.run(run())
+    assert result.returncode == 0 and lines and lines[-1] in result.stdout
+    print(f"✓ Other call finished after a timeout; streamed {lines[-1]!r}")
+
+
+def test_shutdown_stops_workers():
+    """Leaving the API's lifespan stops the in-process workers."""
+    from fastapi.testclient import TestClient
+
+    if not engine.inprocess_available():
+        print("- Skipped: esptool is not installed")
+        return
+    with TestClient(api.api):
+        pid = asyncio.run(call_in_tool("esptool", os.getpid))
+        assert _running(pid) and engine._backends
+    assert not engine._backends
+    assert _wait_gone(pid), f"worker {pid} still running"
+    print(f"✓ Worker {pid} stopped at shutdown")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Tool Timeout Test")
+    print("=" * 60)
+    test_timeout_kills_process_tree()
+    test_cancel_running_job()
+    test_flash_timeout_reports_phase()
+    test_http_disconnect_cancels()
+    test_abort_spares_other_calls()
+    test_shutdown_stops_workers()
+    print("=" * 60)
@@ -0,0 +1,108 @@
+"""Test tool resolution caching and help-output parsing."""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from papilio_loader_mcp.tools.tool_registry import (
+    ToolInfo,
+    ToolRegistry,
+    parse_commands,
+    parse_version,
+)
+
+ARGPARSE_HELP = """usage: esptool [-h] [--chip {auto,esp8266,esp32}] [--port PORT] [--baud BAUD]
+               {load_ram,dump_mem,read_mem,write_mem,write_flash,run,image_info,chip_id,flash_id,flash_md5sum}
+               ...
+"""
+
+CLICK_HELP = """ Usage: esptool [OPTIONS] COMMAND [ARGS]...
+╭─ Options ────────────────────────────────────────────────────────╮
+│ --port              -p  SERIAL-PORT               Serial port.   │
+│ --help              -h                            Show this.     │
+╰──────────────────────────────────────────────────────────────────╯
+╭─ Basic commands ─────────────────────────────────────────────────╮
+│ write-flash         Write a binary blob to flash. The address is │
+│                     followed by binary filename.                 │
+│ flash-id            Print the SPI flash memory manufacturer.     │
+╰──────────────────────────────────────────────────────────────────╯
+╭─ Advanced commands ──────────────────────────────────────────────╮
+│ chip-id             Print the chip ID.                           │
+╰──────────────────────────────────────────────────────────────────╯
+"""
+
+
+def test_parse_help():
+    """Subcommands and versions from esptool 4.x and 5.x output."""
+    assert parse_commands(ARGPARSE_HELP) == sorted([
+        "load_ram", "dump_mem", "read_mem", "write_mem", "write_flash",
+        "run", "image_info", "chip_id", "flash_id", "flash_md5sum",
+    ])
+    assert parse_commands(CLICK_HELP) == ["chip-id", "flash-id", "write-flash"]
+    assert parse_version("esptool.py v4.7.0\n4.7.0\n") == "4.7.0"
+    assert parse_version("esptool v5.1.0\n5.1.0") == "5.1.0"
+    assert parse_version("") is None
+    print("✓ Help output parsed")
+
+
+def test_path_cached_and_spelling():
+    """The executable is looked up once; commands follow the tool's spelling."""
+    lookups = []
+
+    def find(tool):
+        lookups.append(tool)
+        return Path(f"/opt/{tool}")
+
+    registry = ToolRegistry(find=find)
+    assert registry.path("esptool") == Path("/opt/esptool")
+    assert registry.path("esptool") == Path("/opt/esptool")
+    assert lookups == ["esptool"]
+
+    # Unprobed: names pass through unchanged, capabilities are unknown
+    assert registry.command("esptool", "chip_id") == "chip_id"
+    assert registry.supports("esptool", "--skip-flashed") is None
+
+    registry._info["esptool"] = ToolInfo(
+        "esptool", "/opt/esptool", "5.1.0",
+        commands=["chip-id", "flash-id", "write-flash"], write_flash_options=["--compress"],
+    )
+    registry._info["pesptool"] = ToolInfo(
+        "pesptool", "/opt/pesptool", "4.7.0", commands=["chip_id", "flash_id", "write_flash"],
+    )
+    assert registry.command("esptool", "chip_id") == "chip-id"
+    assert registry.command("pesptool", "write-flash") == "write_flash"
+    assert registry.command("esptool", "merge-bin") == "merge-bin"
+    assert registry.supports("esptool", "--compress") is True
+    assert registry.supports("esptool", "--skip-flashed") is False
+    assert registry.supports("pesptool", "flash-id") is True
+
+    registry.forget("esptool")
+    registry.path("esptool")
+    assert lookups == ["esptool", "esptool"]
+    assert registry.status()["esptool"] == {"tool": "esptool", "probing": True}
+    print("✓ Paths cached, command spelling follows the tool")
+
+
+def test_probe_missing_tool():
+    """A missing executable is reported, not raised."""
+    def find(tool):
+        raise FileNotFoundError(f"{tool}.exe not found")
+
+    registry = ToolRegistry(find=find)
+    info = registry.probe("pesptool")
+    assert info.error == "pesptool.exe not found" and info.path is None
+    assert registry.status()["pesptool"]["error"] == "pesptool.exe not found"
+    assert registry.supports("pesptool", "chip_id") is None
+    print("✓ Missing tool reported")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Tool Registry Test")
+    print("=" * 60)
+    test_parse_help()
+    test_path_cached_and_spelling()
+    test_probe_missing_tool()
+    print("=" * 60)
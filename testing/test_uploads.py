@@ -0,0 +1,79 @@
+"""Test streaming uploads: chunked copy, hashing and size enforcement."""
+
+import asyncio
+import hashlib
+import io
+import sys
+import tempfile
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from fastapi import HTTPException, UploadFile
+
+from papilio_loader_mcp.config import get_config
+from papilio_loader_mcp.uploads import save_upload
+
+TEST_DIR = Path(__file__).parent
+
+
+def test_save_upload_hashes_in_one_pass():
+    """The copy on disk, SHA-256 and detection header all come from one read."""
+    data = (TEST_DIR / "esp32_firmware_hdmi_test.bin").read_bytes()
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = Path(tmp) / "fw.bin"
+        upload = UploadFile(io.BytesIO(data), filename="fw.bin")
+        stored = asyncio.run(save_upload(upload, dest, len(data)))
+        assert dest.read_bytes() == data
+        assert stored.validate_for_device("esp32")["detected_type"] == "esp32"
+    assert stored.size == len(data)
+    assert stored.sha256 == hashlib.sha256(data).hexdigest()
+    assert stored.header == data[:32]
+    print(f"✓ {stored.size} bytes, sha256 {stored.sha256[:16]}...")
+
+
+def test_save_upload_rejects_oversized():
+    """Going over the limit raises 413 and leaves no partial file behind."""
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = Path(tmp) / "big.bin"
+        upload = UploadFile(io.BytesIO(b"\xff" * 3_000_000), filename="big.bin")
+        try:
+            asyncio.run(save_upload(upload, dest, 2_000_000))
+            assert False, "expected HTTPException"
+        except HTTPException as e:
+            assert e.status_code == 413
+        assert not dest.exists()
+    print("✓ Oversized upload rejected with 413")
+
+
+def test_failed_flash_is_an_error():
+    """/flash reports a flash that failed as an error, like /flash/multi."""
+    from fastapi.testclient import TestClient
+    from papilio_loader_mcp import api
+
+    config = get_config()
+    original = config.user_data_dir, config.api_key
+    with tempfile.TemporaryDirectory() as tmp:
+        config.user_data_dir, config.api_key = Path(tmp), None
+        try:
+            response = TestClient(api.api).post(
+                "/flash/upload",
+                params={"port": "COM99", "device_type": "esp32", "address": "0x10000"},
+                files={"file": ("notes.txt", b"not firmware")},
+            )
+        finally:
+            config.user_data_dir, config.api_key = original
+    assert response.status_code == 500, response.text
+    assert "Invalid file type" in response.json()["detail"]
+    print(f"✓ Failed flash answered {response.status_code}: {response.json()['detail']}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("Streaming Upload Test")
+    print("=" * 60)
+    test_save_upload_hashes_in_one_pass()
+    test_save_upload_rejects_oversized()
+    test_failed_flash_is_an_error()
+    print("=" * 60)